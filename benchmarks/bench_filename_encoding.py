@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк исправления кодировки имен файлов на корпусах tests/data.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_filename_encoding.py [повторы]
+
+Имена полного корпуса исправляются декодированием, имена частичного
+корпуса (кракозябры рядом с кириллицей) - только словарем замен; оба
+пути замеряются отдельно. Первый проход по корпусу - холодный (кэш
+результатов очищен), остальные повторяют обращения к тем же именам, как
+это делают этапы обработки.
+"""
+
+import importlib.util
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "tests", "data")
+CORPUS_PATH = os.path.join(DATA_DIR, "filename_corpus.txt")
+PARTIAL_CORPUS_PATH = os.path.join(DATA_DIR, "filename_partial_corpus.txt")
+
+# Модули импортируют config напрямую, а друг друга - через пакет
+# DocKitBot; пакет загружается так же, как в tests/conftest.py
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+if importlib.util.find_spec("DocKitBot") is None:
+    spec = importlib.util.spec_from_file_location(
+        "DocKitBot", os.path.join(ROOT, "__init__.py"),
+        submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["DocKitBot"] = package
+    spec.loader.exec_module(package)
+
+from loguru import logger  # noqa: E402
+
+from DocKitBot.filename_encoding import fix_filename_encoding  # noqa: E402
+
+
+def load_lines(path):
+    with open(path, encoding="utf-8") as file:
+        return [line.strip() for line in file
+                if line.strip() and not line.startswith("#")]
+
+
+def load_mojibake_corpus():
+    """Имена корпуса в виде кракозябр и их правильные значения"""
+    return [(name.encode("utf-8").decode("cp437"), name)
+            for name in load_lines(CORPUS_PATH)]
+
+
+def load_partial_corpus():
+    """Частично исправленные имена и их правильные значения"""
+    return [tuple(line.split("\t")) for line in load_lines(PARTIAL_CORPUS_PATH)]
+
+
+def measure(title, corpus, repeats: int):
+    """Замеряет холодный и повторные проходы, возвращает неверные имена"""
+    fix_filename_encoding.cache_clear()
+    started = time.perf_counter()
+    wrong = [name for mojibake, name in corpus
+             if fix_filename_encoding(mojibake) != name]
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for mojibake, _ in corpus:
+            fix_filename_encoding(mojibake)
+    warm = time.perf_counter() - started
+
+    calls = len(corpus) * repeats
+    print(f"{title}")
+    print(f"  Имен в корпусе: {len(corpus)}, исправлено неверно: {len(wrong)}")
+    print(f"  Холодный проход: {cold / len(corpus) * 1e6:.1f} мкс на имя")
+    print(f"  Повторные вызовы: {warm / calls * 1e6:.2f} мкс на имя "
+          f"({calls} вызовов)")
+    print(f"  Кэш: {fix_filename_encoding.cache_info()}")
+    for name in wrong:
+        print(f"    неверно: {name}")
+    return wrong
+
+
+def run(repeats: int):
+    # Каждое исправление пишется в лог, в замер это не входит
+    logger.remove()
+
+    wrong = measure("Кракозябры cp437 (декодирование):",
+                    load_mojibake_corpus(), repeats)
+    wrong += measure("Частично исправленные имена (словарь замен):",
+                     load_partial_corpus(), repeats)
+    return 1 if wrong else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
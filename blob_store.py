@@ -0,0 +1,320 @@
+"""
+Хранилище файлов по содержимому для DocKitBot
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+from config import Config
+from DocKitBot.file_cache import link_file
+
+
+def digest_file(file_path: str) -> str:
+    """SHA-256 содержимого файла"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def copy_with_digest(source_path: str, target_path: str) -> Tuple[str, int]:
+    """Копирует файл и возвращает SHA-256 и размер записанной копии"""
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            sha256.update(chunk)
+            target.write(chunk)
+            size += len(chunk)
+    return sha256.hexdigest(), size
+
+
+class BlobStore:
+    """Файлы, адресуемые по SHA-256 содержимого, со счетчиками ссылок.
+
+    Исходные файлы и результаты их обработки хранятся один раз, сколько бы
+    пользователей и заданий их ни прислали. В хранилище файл попадает
+    копией, ведь исходник может быть позже перезаписан на месте; хэш
+    считается в том же проходе, что и копирование. В рабочие каталоги
+    файл выдается жесткой ссылкой. Хэш при выдаче пересчитывается, только
+    если размер или время изменения файла разошлись с записанными при
+    помещении в хранилище. Манифест
+    хранит ссылки заданий на каждый файл и производные результаты:
+    (исходный файл, этап) -> файл результата. Он пишется на диск не чаще
+    BLOB_STORE_SAVE_INTERVAL секунд, при сборке мусора и в flush().
+    Файлы без ссылок удаляются сборкой мусора через BLOB_STORE_RETENTION
+    секунд после освобождения последней ссылки.
+
+    Методы блокирующие и потокобезопасные, из цикла событий их вызывают
+    через asyncio.to_thread.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.config = Config()
+        self.root = root or self.config.BLOB_STORE_DIR
+        self._manifest_path = os.path.join(self.root, 'manifest.json')
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._lock = threading.RLock()
+        self._dirty = False
+        # Первое изменение записывается сразу
+        self._saved_at = float('-inf')
+
+    def _load(self) -> Dict[str, Any]:
+        if self._manifest is None:
+            os.makedirs(self.root, exist_ok=True)
+            try:
+                with open(self._manifest_path, 'r', encoding='utf-8') as file:
+                    self._manifest = json.load(file)
+            except FileNotFoundError:
+                self._manifest = {'blobs': {}, 'derived': {}}
+            except (OSError, ValueError) as e:
+                logger.error(
+                    f"Манифест хранилища поврежден, начинаем заново: {e}")
+                self._manifest = {'blobs': {}, 'derived': {}}
+            self._adopt_orphans()
+        return self._manifest
+
+    def _adopt_orphans(self):
+        """Учитывает файлы, записанные после последнего сохранения манифеста.
+
+        Они остаются без ссылок и удаляются обычной сборкой мусора.
+        """
+        objects_dir = os.path.join(self.root, 'objects')
+        if not os.path.isdir(objects_dir):
+            return
+        blobs = self._manifest['blobs']
+        now = time.time()
+        for directory, _, file_names in os.walk(objects_dir):
+            for file_name in file_names:
+                file_path = os.path.join(directory, file_name)
+                if file_name.endswith('.part'):
+                    # Недописанная копия прерванного put
+                    os.remove(file_path)
+                elif file_name not in blobs:
+                    blobs[file_name] = {
+                        'size': os.path.getsize(file_path),
+                        'refs': [],
+                        'released_at': now
+                    }
+
+    def _save(self):
+        """Отмечает изменения манифеста, запись - не чаще интервала"""
+        self._dirty = True
+        if (time.monotonic() - self._saved_at >=
+                self.config.BLOB_STORE_SAVE_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Записывает измененный манифест на диск"""
+        with self._lock:
+            if not self._dirty:
+                return
+            temp_path = f"{self._manifest_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self._manifest, file)
+            os.replace(temp_path, self._manifest_path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+    def blob_path(self, digest: str) -> str:
+        """Путь к файлу в хранилище"""
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def blob_size(self, digest: str) -> int:
+        """Размер файла в хранилище (0, если его нет)"""
+        with self._lock:
+            blob = self._load()['blobs'].get(digest)
+            return blob['size'] if blob else 0
+
+    def put(self, file_path: str, ref: Optional[str] = None,
+            digest: Optional[str] = None) -> str:
+        """Помещает копию файла в хранилище и возвращает ее хэш.
+
+        digest - SHA-256, уже посчитанный при приеме файла: если такой
+        файл в хранилище есть, содержимое не читается вовсе.
+        """
+        with self._lock:
+            # Манифест загружается до копирования: при загрузке удаляются
+            # недописанные копии прерванных вызовов
+            self._load()
+            if digest is not None and self._has_blob(digest):
+                self._add_ref(digest, ref)
+                self._save()
+                return digest
+
+        # Хэш считается по самой копии за один проход чтения
+        objects_dir = os.path.join(self.root, 'objects')
+        os.makedirs(objects_dir, exist_ok=True)
+        temp_path = os.path.join(
+            objects_dir, f"{uuid.uuid4().hex}.part")
+        try:
+            digest, size = copy_with_digest(file_path, temp_path)
+            with self._lock:
+                blob_path = self.blob_path(digest)
+                if self._has_blob(digest):
+                    os.remove(temp_path)
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    # Файл хранилища появляется целиком и больше не меняется
+                    os.replace(temp_path, blob_path)
+                    self._manifest['blobs'][digest] = {
+                        'size': size,
+                        'mtime': os.stat(blob_path).st_mtime_ns,
+                        'refs': [],
+                        'released_at': time.time()
+                    }
+                self._add_ref(digest, ref)
+                self._save()
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest
+
+    def checkout(self, digest: str, target_path: str,
+                 ref: Optional[str] = None) -> bool:
+        """Связывает файл хранилища с target_path, проверив его хэш"""
+        with self._lock:
+            if not self._has_blob(digest):
+                return False
+            blob = self._manifest['blobs'][digest]
+            recorded = (blob['size'], blob.get('mtime'))
+        blob_path = self.blob_path(digest)
+        stat = os.stat(blob_path)
+        current = (stat.st_size, stat.st_mtime_ns)
+        # Запись через любую жесткую ссылку меняет время изменения файла,
+        # поэтому нетронутый файл повторно не читается. Хэш проверяется
+        # без блокировки: файлы хранилища не перезаписываются
+        intact = current == recorded or digest_file(blob_path) == digest
+        with self._lock:
+            if not intact:
+                # Файл изменили на месте через одну из его жестких ссылок
+                logger.warning(
+                    f"Файл хранилища {digest} поврежден и будет удален")
+                self._drop(digest)
+                return False
+            if not self._has_blob(digest):
+                return False
+            if current != recorded:
+                # Файл цел: запоминаем его нынешние размер и время
+                self._manifest['blobs'][digest].update(
+                    size=current[0], mtime=current[1])
+            link_file(blob_path, target_path)
+            self._add_ref(digest, ref)
+            self._save()
+        return True
+
+    def _has_blob(self, digest: str) -> bool:
+        return (digest in self._load()['blobs'] and
+                os.path.exists(self.blob_path(digest)))
+
+    def _drop(self, digest: str):
+        """Забывает файл и все результаты, связанные с ним"""
+        manifest = self._manifest
+        try:
+            os.remove(self.blob_path(digest))
+        except FileNotFoundError:
+            pass
+        manifest['blobs'].pop(digest, None)
+        manifest['derived'] = {
+            key: derived for key, derived in manifest['derived'].items()
+            if derived != digest and key.split(':', 1)[0] != digest
+        }
+        self._save()
+
+    def get_derived(self, digest: str, step: str) -> Optional[str]:
+        """Хэш уже полученного результата этапа step для файла digest"""
+        with self._lock:
+            manifest = self._load()
+            derived = manifest['derived'].get(f"{digest}:{step}")
+            if derived and derived in manifest['blobs']:
+                return derived
+        return None
+
+    def put_derived(self, digest: str, step: str, file_path: str,
+                    ref: Optional[str] = None) -> str:
+        """Запоминает результат этапа step для файла digest"""
+        derived = self.put(file_path, ref)
+        with self._lock:
+            self._load()['derived'][f"{digest}:{step}"] = derived
+            self._save()
+        return derived
+
+    def release(self, ref: str):
+        """Освобождает все ссылки задания ref"""
+        with self._lock:
+            now = time.time()
+            for blob in self._load()['blobs'].values():
+                if ref in blob['refs']:
+                    blob['refs'].remove(ref)
+                    if not blob['refs']:
+                        blob['released_at'] = now
+            self._save()
+
+    def gc(self, retention: Optional[float] = None) -> int:
+        """Удаляет файлы без ссылок, освобожденные дольше retention секунд.
+
+        Возвращает число освобожденных байт.
+        """
+        if retention is None:
+            retention = self.config.BLOB_STORE_RETENTION
+        removed = 0
+        freed = 0
+        with self._lock:
+            manifest = self._load()
+            deadline = time.time() - retention
+            for digest, blob in list(manifest['blobs'].items()):
+                if blob['refs'] or blob['released_at'] > deadline:
+                    continue
+                try:
+                    os.remove(self.blob_path(digest))
+                    freed += blob['size']
+                except FileNotFoundError:
+                    pass
+                del manifest['blobs'][digest]
+                removed += 1
+
+            if removed:
+                # Забываем результаты, исходник или итог которых удален
+                blobs = manifest['blobs']
+                manifest['derived'] = {
+                    key: derived
+                    for key, derived in manifest['derived'].items()
+                    if derived in blobs and key.split(':', 1)[0] in blobs
+                }
+                self._dirty = True
+                logger.info(
+                    f"Хранилище: удалено файлов без ссылок: {removed} "
+                    f"({freed / 1024 / 1024:.1f}MB)")
+            # Сборка мусора запускается периодически, заодно сохраняем
+            # накопленные изменения манифеста
+            self.flush()
+        return freed
+
+    def _add_ref(self, digest: str, ref: Optional[str]):
+        blob = self._manifest['blobs'][digest]
+        if ref is None:
+            # Файл без владельца живет до ближайшей сборки мусора
+            if not blob['refs']:
+                blob['released_at'] = time.time()
+        elif ref not in blob['refs']:
+            blob['refs'].append(ref)
+
+
+_shared_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    """Возвращает общее для всего бота хранилище"""
+    global _shared_store
+    if _shared_store is None:
+        _shared_store = BlobStore()
+    return _shared_store
@@ -2,17 +2,25 @@
 Обработчик Telegram бота для DocKitBot
 """
 
+import asyncio
 import os
-from typing import Any, Dict, List
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from loguru import logger
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, PhotoSize, Update
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
 from config import Config
-from DocKitBot.document_processor import DocumentProcessor
-from DocKitBot.file_handler import FileHandler
+from DocKitBot.document_processor import DocumentProcessor, SpeculativeTask
+from DocKitBot.file_handler import ArchiveLimitError, ArchiveStats, FileHandler
+from DocKitBot.file_record import FileRecord
+from DocKitBot.job_scheduler import JOB_QUEUED, Job, JobScheduler, new_job_id
+from DocKitBot.progress_reporter import ProgressReporter
+from DocKitBot.update_processor import UserOrderedUpdateProcessor
+from DocKitBot.workspace import JobWorkspace
 
 
 class BotHandler:
@@ -20,26 +28,65 @@ class BotHandler:
         self.config = Config()
         self.document_processor = DocumentProcessor()
         self.file_handler = FileHandler()
+        self.job_scheduler = JobScheduler()
+        # Слоты низкого приоритета для предобработки загрузок
+        self._speculative_slots = asyncio.Semaphore(
+            self.config.SPECULATIVE_CONCURRENCY)
 
         # Словарь для хранения состояния пользователей
         self.user_sessions: Dict[int, Dict[str, Any]] = {}
+        # Альбомы, фото которых еще приходят: (user_id, media_group_id)
+        self._media_groups: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        self._media_group_tasks: Set[asyncio.Task] = set()
+        # Файлы заданий, ожидающих в очереди: job_id -> (файлы, предобработка)
+        self._queued_inputs: Dict[str, Tuple[List[FileRecord], Dict[str, SpeculativeTask]]] = {}
+        # Каталоги выполняемых заданий: job_id -> рабочий каталог
+        self._workspaces: Dict[str, JobWorkspace] = {}
+        # Предобработка выполняемых заданий: job_id -> {путь: предобработка}
+        self._job_speculative: Dict[str, Dict[str, SpeculativeTask]] = {}
 
     def _get_user_session(self, user_id: int) -> Dict[str, Any]:
         """Получает или создает сессию пользователя"""
         if user_id not in self.user_sessions:
             self.user_sessions[user_id] = {
+                # Записи FileRecord загруженных файлов
                 'files': [],
+                'speculative': {},
+                'user_id': user_id,
                 'processing': False,
-                'last_message_id': None
+                'last_message_id': None,
+                'last_activity': time.monotonic()
             }
             logger.info(f"Создана новая сессия для пользователя {user_id}")
         else:
             files_count = len(self.user_sessions[user_id]['files'])
+            self.user_sessions[user_id]['last_activity'] = time.monotonic()
             logger.info(
                 f"Получена существующая сессия для пользователя {user_id}, "
                 f"файлов: {files_count}")
         return self.user_sessions[user_id]
 
+    def expire_idle_sessions(self) -> int:
+        """Закрывает сессии без активности дольше SESSION_IDLE_TIMEOUT.
+
+        Файлы таких сессий удаляются: иначе paths_in_use защищал бы их
+        от очистки диска бессрочно. Возвращает число закрытых сессий.
+        """
+        deadline = time.monotonic() - self.config.SESSION_IDLE_TIMEOUT
+        # Альбом еще собирается - сессия пользователя скоро понадобится
+        collecting = {user_id for user_id, _ in self._media_groups}
+        expired = [user_id for user_id, session in self.user_sessions.items()
+                   if session['last_activity'] < deadline and
+                   user_id not in collecting]
+        for user_id in expired:
+            session = self.user_sessions.pop(user_id)
+            if session['files']:
+                logger.info(
+                    f"Сессия пользователя {user_id} закрыта по неактивности, "
+                    f"удалено файлов: {len(session['files'])}")
+            self._unregister_files(session, session['files'])
+        return len(expired)
+
     async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user_id = update.effective_user.id
@@ -66,7 +113,7 @@ class BotHandler:
 💡 **Советы:**
 • Называйте файлы осмысленно (например: "Договор №1 от 01.01.2025 г.")
 • Для многостраничных документов используйте: "стр. 1", "стр. 2" и т.д.
-• Максимальный размер файла: 50MB
+• Максимальный размер файла: {self.config.MAX_DOWNLOAD_SIZE // 1024 // 1024}MB
 
 Используйте /help для получения справки.
         """
@@ -80,7 +127,7 @@ class BotHandler:
 
     async def handle_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
-        help_message = """
+        help_message = f"""
 📚 **Справка по использованию DocKitBot**
 
 🔄 **Процесс обработки:**
@@ -88,6 +135,9 @@ class BotHandler:
 2. Используйте /process для начала обработки
 3. Получите готовый архив и опись
 
+Обработка идет в фоне: /status покажет ее состояние,
+а кнопка "⛔ Отменить" под прогрессом остановит ее.
+
 📁 **Поддерживаемые форматы:**
 • Изображения: JPG, JPEG, PNG
 • Документы: PDF
@@ -107,8 +157,8 @@ class BotHandler:
 • "page 1", "page 2" (английский)
 
 ⚠️ **Ограничения:**
-• Максимальный размер файла: 50MB
-• Общий размер архива: 100MB
+• Максимальный размер файла: {self.config.MAX_DOWNLOAD_SIZE // 1024 // 1024}MB
+• Общий размер архива: {self.config.MAX_TOTAL_SIZE // 1024 // 1024}MB
 • Время обработки: до 2 минут на файл
 
 🆘 **Если что-то пошло не так:**
@@ -162,15 +212,10 @@ class BotHandler:
         def escape_markdown(text):
             return text.replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace(']', '\\]')
 
-        # Исправляем кодировку имен файлов для показа пользователю
-        def fix_display_name(file_path):
-            original_name = os.path.basename(file_path)
-            fixed_name = self.file_handler._fix_filename_encoding(
-                original_name)
-            return escape_markdown(fixed_name)
-
+        # Имена с исправленной кодировкой посчитаны при загрузке
         files_list = "\n".join(
-            [f"• {fix_display_name(f)}" for f in session['files']])
+            [f"• {escape_markdown(record.decoded_name)}"
+             for record in session['files']])
         message_text = f"""
 📋 **Готов к обработке {len(session['files'])} документов:**
 
@@ -213,33 +258,146 @@ class BotHandler:
         session = self._get_user_session(user_id)
 
         if query.data == "process_yes":
+            if session['processing']:
+                await query.edit_message_text(
+                    "⏳ Документы уже обрабатываются.\n"
+                    "Используйте /status, чтобы узнать состояние обработки."
+                )
+                return
             session['processing'] = True
             await self._process_user_files(update, context, user_id)
         elif query.data == "process_no":
-            session['files'] = []
-            session['processing'] = False
+            self._unregister_files(session, list(session['files']))
             await query.edit_message_text("❌ Обработка отменена.")
+        elif query.data.startswith("cancel_"):
+            await self._cancel_job(update, user_id, query.data[len("cancel_"):])
+
+    def _detach_session_files(self, session: Dict[str, Any]
+                              ) -> Tuple[List[FileRecord], Dict[str, SpeculativeTask]]:
+        """Передает файлы сессии заданию и начинает новую сессию.
+
+        Файлы остаются на диске: ими владеет задание, а пользователь
+        может сразу загружать документы для следующего.
+        """
+        files = session['files']
+        speculative = session['speculative']
+        session['files'] = []
+        session['speculative'] = {}
+        return files, speculative
+
+    def _discard_job_inputs(self, files: List[FileRecord],
+                            speculative: Dict[str, SpeculativeTask]):
+        """Удаляет файлы задания, которое так и не запустилось"""
+        for speculation in speculative.values():
+            speculation.discard()
+        for record in files:
+            try:
+                os.remove(record.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл {record.path}: {e}")
+
+    def _cancel_markup(self, job_id: str) -> InlineKeyboardMarkup:
+        """Клавиатура с кнопкой отмены задания"""
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton("⛔ Отменить",
+                                 callback_data=f"cancel_{job_id}")
+        ]])
 
     async def _process_user_files(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-        """Обрабатывает все файлы пользователя"""
+        """Запускает фоновую обработку всех файлов пользователя"""
         session = self._get_user_session(user_id)
 
         if not session['files']:
+            session['processing'] = False
             return
 
-        # Отправляем сообщение о начале обработки
-        progress_message = await update.callback_query.edit_message_text(
-            "🔄 Начинаю обработку документов...\n\n"
-            "⏳ Прогресс: 0%"
+        progress_message = update.callback_query.message
+        job_id = new_job_id()
+
+        async def show_queue_position(position: int):
+            await progress_message.edit_text(
+                f"🕒 Документы в очереди на обработку\n\n"
+                f"📍 Ваша позиция в очереди: {position}\n"
+                f"Обработка начнется автоматически.",
+                reply_markup=self._cancel_markup(job_id)
+            )
+
+        # Сообщение отправляется до постановки в очередь: иначе оно
+        # может прийти позже первого сообщения о прогрессе задания
+        # и затереть его
+        try:
+            await progress_message.edit_text(
+                "🔄 Начинаю обработку документов...\n\n"
+                "⏳ Прогресс: 0%",
+                reply_markup=self._cancel_markup(job_id)
+            )
+        except Exception as e:
+            # Обработка не зависит от сообщения о ней
+            logger.warning(f"Не удалось обновить сообщение о задании: {e}")
+
+        # Отсеиваем повторно загруженные страницы до начала обработки
+        duplicates, similar = {}, {}
+        if self.config.DUPLICATE_DETECTION:
+            duplicates, similar = self.file_handler.find_duplicates(
+                session['files'])
+
+        files, speculative = self._detach_session_files(session)
+        session['processing'] = False
+
+        # Задание выполняется в фоне, обработчик callback сразу освобождается
+        job = self.job_scheduler.submit(
+            user_id, len(files),
+            lambda: self._run_processing_job(
+                update, job, files, progress_message, duplicates,
+                speculative, similar),
+            show_queue_position, job_id
         )
+        # Задание запустится не раньше следующего шага цикла событий
+        self._queued_inputs[job.job_id] = (files, speculative)
+
+        if job.queue_position:
+            # Задание ждет, пока завершится другое, и до этого
+            # сообщение о прогрессе не появится
+            await show_queue_position(job.queue_position)
+
+    async def _run_processing_job(self, update: Update, job: Job, files: List[FileRecord],
+                                  progress_message, duplicates: Dict[FileRecord, FileRecord],
+                                  speculative: Dict[str, SpeculativeTask],
+                                  similar: Optional[Dict[FileRecord, FileRecord]] = None):
+        """Фоновое задание: обработка файлов и отправка результата"""
+        user_id = job.user_id
+        workspace = JobWorkspace(user_id, job.job_id)
+        self._workspaces[job.job_id] = workspace
+        self._job_speculative[job.job_id] = speculative
 
         try:
+            # Задание работает со своими копиями файлов в отдельном каталоге.
+            # Входные файлы остаются в _queued_inputs, пока копии не готовы:
+            # очистка диска не должна застать их без защиты
+            try:
+                adopted = await asyncio.to_thread(
+                    workspace.adopt, [record.path for record in files])
+            finally:
+                self._queued_inputs.pop(job.job_id, None)
+            job_speculative = {adopted[file_path]: speculation
+                               for file_path, speculation in speculative.items()
+                               if file_path in adopted}
+            # Записи сессии уже принадлежат заданию и переходят вместе
+            # с файлами; дубликаты ссылаются на те же записи
+            for record in files:
+                record.path = adopted[record.path]
+
             # Обрабатываем файлы с показом прогресса
             result = await self._process_files_with_progress(
-                session['files'], user_id, progress_message
+                files, user_id, progress_message, duplicates, job,
+                job_speculative, workspace, similar
             )
 
             if result['success']:
+                await progress_message.edit_text(
+                    "✅ Обработка завершена, отправляю результат...")
                 # Отправляем результат
                 await self._send_processing_result(update, result, user_id)
             else:
@@ -247,6 +405,11 @@ class BotHandler:
                     f"❌ Ошибка обработки: {result['error']}"
                 )
 
+        except asyncio.CancelledError:
+            logger.info(
+                f"Задание {job.job_id} пользователя {user_id} прервано")
+            await progress_message.edit_text("⛔ Обработка отменена.")
+            raise
         except Exception as e:
             logger.error(
                 f"Ошибка обработки файлов пользователя {user_id}: {e}")
@@ -254,77 +417,246 @@ class BotHandler:
                 "❌ Произошла ошибка при обработке. Попробуйте еще раз."
             )
         finally:
-            # Очищаем сессию
-            session['files'] = []
-            session['processing'] = False
+            # Удаляем только файлы этого задания: новые загрузки
+            # и другие задания пользователя не затрагиваются
+            for speculation in speculative.values():
+                speculation.discard()
+            workspace.release_sources()
+            await asyncio.to_thread(workspace.cleanup)
+            del self._workspaces[job.job_id]
+            del self._job_speculative[job.job_id]
+
+    def paths_in_use(self) -> Set[str]:
+        """Файлы и каталоги, которые нельзя удалять при очистке диска"""
+        paths = set()
+        inputs = [(session['files'], session['speculative'])
+                  for session in self.user_sessions.values()]
+        inputs.extend(self._queued_inputs.values())
+        # Каталог предобработки нужен, пока задание не забрало результат
+        inputs.extend(([], speculative)
+                      for speculative in self._job_speculative.values())
+        for files, speculative in inputs:
+            paths.update(record.path for record in files)
+            for speculation in speculative.values():
+                paths.update(speculation.workspace.paths_in_use())
+        for workspace in self._workspaces.values():
+            paths.update(workspace.paths_in_use())
+        return paths
+
+    async def _cancel_job(self, update: Update, user_id: int, job_id: str):
+        """Отменяет задание пользователя по кнопке"""
+        job = self.job_scheduler.get_job(job_id)
+        if job is None or job.user_id != user_id:
+            logger.info(
+                f"Задание {job_id} для отмены не найдено или уже завершено")
+            return
 
-    async def _process_files_with_progress(self, files: List[str], user_id: int, progress_message) -> Dict[str, Any]:
-        """Обрабатывает файлы с показом прогресса"""
-        total_files = len(files)
-        processed_files = []
-        errors = []
+        was_queued = job.status == JOB_QUEUED
+        self.job_scheduler.cancel(job_id)
 
-        for i, file_path in enumerate(files, 1):
-            try:
-                # Обновляем прогресс
-                progress = int((i - 1) / total_files * 100)
-                progress_bar = self._create_progress_bar(progress)
+        # Выполняемое задание само сообщит об отмене, а задание из очереди
+        # так и не запустилось - удаляем его файлы здесь
+        if was_queued:
+            inputs = self._queued_inputs.pop(job_id, None)
+            if inputs is not None:
+                self._discard_job_inputs(*inputs)
+            await update.callback_query.edit_message_text(
+                "⛔ Обработка отменена.")
 
-                # Исправляем имя файла для показа
-                display_name = self.file_handler._fix_filename_encoding(
-                    os.path.basename(file_path)
-                )
+    async def handle_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /status"""
+        user_id = update.effective_user.id
+        session = self._get_user_session(user_id)
+        jobs = self.job_scheduler.get_user_jobs(user_id)
 
-                await progress_message.edit_text(
-                    f"🔄 Обработка документов...\n\n"
-                    f"📄 Файл {i} из {total_files}: {display_name}\n"
-                    f"⏳ Прогресс: {progress}%\n"
-                    f"{progress_bar}"
-                )
+        if not jobs:
+            await update.message.reply_text(
+                f"ℹ️ Активных заданий нет.\n"
+                f"📁 Файлов в сессии: {len(session['files'])}"
+            )
+            return
 
-                # Обрабатываем файл
-                file_info = self.file_handler.get_file_info(file_path)
-                processed_file = await self.document_processor._process_file(file_path, file_info)
+        lines = ["📊 Ваши задания:", ""]
+        buttons = []
+        for job in jobs:
+            if job.status == JOB_QUEUED:
+                position = self.job_scheduler.position(job)
+                state = f"в очереди, позиция {position}"
+            else:
+                state = f"выполняется, {job.progress}%"
+            lines.append(f"• {job.job_id}: файлов {job.size}, {state}")
+            buttons.append([InlineKeyboardButton(
+                f"⛔ Отменить {job.job_id}",
+                callback_data=f"cancel_{job.job_id}")])
 
-                if processed_file:
-                    processed_files.append(processed_file)
-                else:
-                    # Исправляем имя файла для отчета об ошибке
-                    error_name = self.file_handler._fix_filename_encoding(
-                        os.path.basename(file_path)
-                    )
-                    errors.append(f"Не удалось обработать: {error_name}")
+        await update.message.reply_text(
+            "\n".join(lines),
+            reply_markup=InlineKeyboardMarkup(buttons)
+        )
 
-            except Exception as e:
-                logger.error(f"Ошибка обработки файла {file_path}: {e}")
-                # Исправляем имя файла для отчета об ошибке
-                error_name = self.file_handler._fix_filename_encoding(
-                    os.path.basename(file_path)
-                )
-                errors.append(f"Ошибка обработки {error_name}: {str(e)}")
+    async def _process_files_with_progress(self, files: List[FileRecord], user_id: int, progress_message,
+                                           duplicates: Optional[Dict[FileRecord, FileRecord]] = None,
+                                           job: Optional[Job] = None,
+                                           speculative: Optional[Dict[str, SpeculativeTask]] = None,
+                                           workspace: Optional[JobWorkspace] = None,
+                                           similar: Optional[Dict[FileRecord, FileRecord]] = None
+                                           ) -> Dict[str, Any]:
+        """Обрабатывает файлы с показом прогресса"""
+        duplicates = duplicates or {}
+        files = [f for f in files if f not in duplicates]
+        total_files = len(files)
+        processed_files = []
+        errors = []
+        reporter = ProgressReporter(progress_message)
+
+        async def update_progress(completed: int, total: int, record: FileRecord):
+            # Обновляем прогресс по мере завершения файлов
+            progress = int(completed / total * 100)
+            progress_bar = self._create_progress_bar(progress)
+            if job:
+                job.progress = progress
+
+            reporter.update(
+                f"🔄 Обработка документов...\n\n"
+                f"📄 Готово {completed} из {total}: {record.decoded_name}\n"
+                f"⏳ Прогресс: {progress}%\n"
+                f"{progress_bar}",
+                reply_markup=self._cancel_markup(job.job_id) if job else None
+            )
+
+        # Обрабатываем файлы параллельно с ограничением из конфигурации;
+        # файлы задания держатся в хранилище до создания архива
+        ref = f"job:{job.job_id}" if job else f"user:{user_id}"
+        try:
+            results = await self.document_processor.process_files_concurrently(
+                files, update_progress, speculative, ref, workspace)
+            # Последнее состояние должно дойти до следующих сообщений
+            await reporter.flush()
+        except BaseException:
+            reporter.cancel()
+            await self.document_processor.release_artifacts(ref)
+            raise
+
+        for result in results:
+            if result['success']:
+                # Результат наследует сведения исходного файла
+                processed_files.append(
+                    result['record'].with_path(result['processed_file']))
+            else:
+                errors.append(result['error'])
+
+        logger.info(
+            f"Обработано {len(processed_files)} из {total_files} файлов "
+            f"пользователя {user_id}")
 
         if not processed_files:
+            await self.document_processor.release_artifacts(ref)
             return {'success': False, 'error': 'Не удалось обработать ни одного файла'}
 
+        if workspace is not None:
+            # Результаты предобработки лежат в ее каталогах, которые
+            # удаляются вместе с ней; объединение страниц должно писать
+            # только в каталог задания
+            adopted = await asyncio.to_thread(
+                workspace.adopt, [record.path for record in processed_files])
+            for record in processed_files:
+                record.path = adopted[record.path]
+
         # Группируем и объединяем многостраничные документы
-        final_files = await self.document_processor._group_and_merge_pages(processed_files)
+        final_files = await self.document_processor._group_and_merge_pages(
+            processed_files, workspace)
 
-        # Создаем архив
-        archive_path = self.file_handler.create_archive(final_files, user_id)
+        # Создаем архивы в пределах лимита отправки
+        oversized: List[str] = []
+        try:
+            archive_stats = ArchiveStats()
+            archives = await self.file_handler.build_archives(
+                [record.path for record in final_files], user_id,
+                job.job_id if job else None, workspace, archive_stats,
+                oversized)
+            if job:
+                job.stats['archive'] = archive_stats
+        finally:
+            await self.document_processor.release_artifacts(ref)
 
         # Формируем опись
-        inventory = self.document_processor._create_inventory(final_files)
-
-        # Очищаем временные файлы
-        self.file_handler.cleanup_user_files(user_id)
+        inventory = self.document_processor._create_inventory(
+            final_files, duplicates, archives, similar, oversized)
 
         return {
             'success': True,
-            'archive_path': archive_path,
+            'archives': archives,
             'inventory': inventory,
             'errors': errors
         }
 
+    async def _register_files(self, session: Dict[str, Any], file_paths: List[str],
+                              original_name: Optional[str] = None
+                              ) -> List[FileRecord]:
+        """Добавляет файлы в сессию и вычисляет их отпечатки.
+
+        original_name - имя, под которым пользователь прислал документ
+        (для файлов архива и фото не передается).
+        """
+        records = [self.file_handler.create_record(file_path, original_name)
+                   for file_path in file_paths]
+        session['files'].extend(records)
+        if self.config.DUPLICATE_DETECTION:
+            for record in records:
+                await self.file_handler.fingerprint_record(record)
+
+        if self.config.SPECULATIVE_PROCESSING:
+            for record in records:
+                self._start_speculative(session, record)
+        return records
+
+    def _unregister_files(self, session: Dict[str, Any], records: List[FileRecord]):
+        """Убирает файлы из сессии и с диска вместе с их предобработкой"""
+        removed = set(records)
+        session['files'] = [r for r in session['files'] if r not in removed]
+        for record in removed:
+            speculation = session['speculative'].pop(record.path, None)
+            if speculation is not None:
+                speculation.discard()
+            try:
+                os.remove(record.path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл {record.path}: {e}")
+
+    def _session_bytes_left(self, session: Dict[str, Any]) -> int:
+        """Сколько байт еще можно добавить в сессию"""
+        return max(0, self.config.MAX_TOTAL_SIZE -
+                   sum(record.size for record in session['files']))
+
+    async def _reject_over_session_limit(self, update: Update,
+                                         session: Dict[str, Any],
+                                         file_size: int) -> bool:
+        """Отклоняет файл, который не помещается в общий лимит сессии"""
+        bytes_left = self._session_bytes_left(session)
+        if file_size <= bytes_left:
+            return False
+        await update.message.reply_text(
+            f"❌ Превышен общий лимит файлов: "
+            f"{self.config.MAX_TOTAL_SIZE / 1024 / 1024:.0f}MB\n"
+            f"Осталось места: {bytes_left / 1024 / 1024:.1f}MB\n\n"
+            f"Используйте /process для обработки уже загруженных файлов."
+        )
+        return True
+
+    def _start_speculative(self, session: Dict[str, Any], record: FileRecord):
+        """Запускает предобработку файла сразу после загрузки"""
+        speculative = session['speculative']
+        pending = sum(1 for speculation in speculative.values()
+                      if not speculation.task.done())
+        if pending >= self.config.SPECULATIVE_MAX_PER_USER:
+            logger.info(
+                f"Лимит предобработки исчерпан, файл {record.path} "
+                f"будет обработан после /process")
+            return
+
+        speculative[record.path] = self.document_processor.speculate(
+            record, session['user_id'], self._speculative_slots)
+
     def _create_progress_bar(self, percentage: int) -> str:
         """Создает текстовый прогресс-бар"""
         bar_length = 20
@@ -339,9 +671,10 @@ class BotHandler:
         document = update.message.document
 
         # Проверяем размер файла
-        if document.file_size > self.config.MAX_FILE_SIZE:
+        if document.file_size > self.config.MAX_DOWNLOAD_SIZE:
             await update.message.reply_text(
-                f"❌ Файл слишком большой! Максимальный размер: 50MB\n"
+                f"❌ Файл слишком большой! Максимальный размер: "
+                f"{self.config.MAX_DOWNLOAD_SIZE // 1024 // 1024}MB\n"
                 f"Размер вашего файла: {document.file_size / 1024 / 1024:.1f}MB"
             )
             return
@@ -361,53 +694,88 @@ class BotHandler:
             )
             return
 
-        try:
-            # Скачиваем файл
-            file_path = await self.file_handler.download_file(document, user_id)
+        # Архив проверяется по распакованному объему, остальные файлы - сразу
+        if file_ext != '.zip' and await self._reject_over_session_limit(
+                update, session, document.file_size):
+            return
 
+        try:
             # Если это ZIP архив, распаковываем его
             if file_ext == '.zip':
+                # Небольшой архив скачивается только в память
+                archive = await self.file_handler.download_archive(
+                    document, user_id)
+
                 # Показываем индикацию процесса распаковки
                 unpack_message = await update.message.reply_text(
                     f"📦 Распаковываю архив {document.file_name}...\n"
                     "⏳ Пожалуйста, подождите, это может занять некоторое время."
                 )
 
+                reporter = ProgressReporter(unpack_message)
+
                 async def update_progress(progress, file_name):
                     progress_bar = self._create_progress_bar(progress)
-                    await unpack_message.edit_text(
+                    reporter.update(
                         f"📦 Распаковываю архив {document.file_name}...\n"
                         f"📄 Файл: {os.path.basename(file_name)}\n"
                         f"⏳ Прогресс: {progress}%\n"
                         f"{progress_bar}"
                     )
 
+                extracted_files = []
                 try:
-                    extracted_files = await self.file_handler.extract_archive(
-                        file_path, user_id, update_progress)
+                    # Регистрируем файлы по мере распаковки: отпечатки и
+                    # предобработка первых файлов идут, пока остальные
+                    # еще извлекаются
+                    async for extracted_path in self.file_handler.iter_archive(
+                            archive, user_id, update_progress,
+                            max_bytes=self._session_bytes_left(session)):
+                        extracted_files.extend(
+                            await self._register_files(session, [extracted_path]))
 
                     if extracted_files:
-                        session['files'].extend(extracted_files)
                         files_count = len(extracted_files)
                         logger.info(
                             f"ZIP архив распакован: {files_count} файлов "
                             f"добавлено в сессию пользователя {user_id}")
                     else:
-                        await unpack_message.edit_text(
+                        await reporter.finish(
                             "⚠️ ZIP архив не содержит поддерживаемых файлов.\n"
                             f"Поддерживаемые форматы: {', '.join(self.config.SUPPORTED_DOCUMENT_FORMATS)}"
                         )
                         return
+                except ArchiveLimitError as e:
+                    logger.warning(
+                        f"Архив {document.file_name} пользователя {user_id} "
+                        f"отклонен: {e}")
+                    self._unregister_files(session, extracted_files)
+                    await reporter.finish(
+                        f"❌ Архив {document.file_name} отклонен.\n"
+                        f"{e}.\n\n"
+                        f"Общий лимит распакованных файлов: "
+                        f"{self.config.MAX_TOTAL_SIZE / 1024 / 1024:.0f}MB."
+                    )
+                    return
                 except Exception as e:
                     logger.error(f"Ошибка распаковки архива: {e}")
-                    await unpack_message.edit_text(
+                    # Архив добавляется целиком или не добавляется вовсе
+                    self._unregister_files(session, extracted_files)
+                    await reporter.finish(
                         f"❌ Ошибка при распаковке архива {document.file_name}.\n"
                         "Проверьте, что архив не поврежден и содержит поддерживаемые файлы."
                     )
                     return
+                finally:
+                    # Сам архив в сессию не входит
+                    if isinstance(archive, str) and os.path.exists(archive):
+                        os.remove(archive)
             else:
-                # Добавляем обычный файл в сессию пользователя
-                session['files'].append(file_path)
+                # Скачиваем файл и добавляем его в сессию пользователя
+                file_path = await self.file_handler.download_file(
+                    document, user_id)
+                await self._register_files(
+                    session, [file_path], document.file_name)
 
             # Определяем сообщение в зависимости от типа файла
             if file_ext == '.zip':
@@ -416,7 +784,7 @@ class BotHandler:
                     f"ZIP архив добавлен в сессию пользователя {user_id}: "
                     f"{document.file_name}, всего файлов: {total_files}")
                 # Финальное сообщение после распаковки
-                await unpack_message.edit_text(
+                await reporter.finish(
                     f"✅ ZIP архив распакован: {document.file_name}\n"
                     f"📁 Всего файлов: {total_files}\n\n"
                     f"Отправьте еще файлы или используйте /process для обработки."
@@ -494,19 +862,29 @@ class BotHandler:
         photo = update.message.photo[-1]  # Берем самое качественное фото
 
         # Проверяем размер файла
-        if photo.file_size > self.config.MAX_FILE_SIZE:
+        if photo.file_size > self.config.MAX_DOWNLOAD_SIZE:
             await update.message.reply_text(
-                f"❌ Фото слишком большое! Максимальный размер: 50MB\n"
+                f"❌ Фото слишком большое! Максимальный размер: "
+                f"{self.config.MAX_DOWNLOAD_SIZE // 1024 // 1024}MB\n"
                 f"Размер вашего фото: {photo.file_size / 1024 / 1024:.1f}MB"
             )
             return
 
+        # Фото из альбома собираем и обрабатываем одной пачкой
+        if update.message.media_group_id:
+            self._add_to_media_group(update, context, photo)
+            return
+
+        if await self._reject_over_session_limit(
+                update, session, photo.file_size or 0):
+            return
+
         try:
             # Скачиваем файл
             file_path = await self.file_handler.download_photo(photo, user_id)
 
             # Добавляем в сессию пользователя
-            session['files'].append(file_path)
+            await self._register_files(session, [file_path])
 
             # Всегда отправляем уведомление пользователю
             photo_status_message = (
@@ -514,31 +892,8 @@ class BotHandler:
                 f"📁 Всего файлов: {len(session['files'])}\n\n"
                 f"Отправьте еще файлы или используйте /process для обработки."
             )
-
-            try:
-                # Если это первый файл в сессии, просто отправляем сообщение
-                if (len(session['files']) == 1 or
-                        not session.get('last_message_id')):
-                    message = await update.message.reply_text(photo_status_message)
-                    session['last_message_id'] = message.message_id
-                else:
-                    # Пытаемся обновить предыдущее сообщение
-                    try:
-                        await context.bot.edit_message_text(
-                            photo_status_message,
-                            chat_id=user_id,
-                            message_id=session['last_message_id']
-                        )
-                    except Exception as e:
-                        # Если не удалось отредактировать, отправляем новое
-                        logger.warning(
-                            f"Не удалось отредактировать сообщение: {e}")
-                        message = await update.message.reply_text(photo_status_message)
-                        session['last_message_id'] = message.message_id
-            except Exception as e:
-                logger.error(f"Ошибка отправки статусного сообщения: {e}")
-                # В крайнем случае отправляем простое уведомление
-                await update.message.reply_text("✅ Фото добавлено в сессию")
+            await self._show_session_status(
+                update, context, session, photo_status_message)
 
         except Exception as e:
             logger.error(f"Ошибка обработки фото: {e}")
@@ -546,6 +901,184 @@ class BotHandler:
                 "❌ Произошла ошибка при обработке фотографии. Попробуйте еще раз."
             )
 
+    def _add_to_media_group(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            photo: PhotoSize):
+        """Добавляет фото в ожидающий альбом и запускает его сборку"""
+        key = (update.effective_user.id, update.message.media_group_id)
+        group = self._media_groups.get(key)
+        if group is None:
+            group = self._media_groups[key] = {
+                'update': update,
+                'photos': [],
+                'last_seen': 0.0,
+            }
+            task = asyncio.create_task(
+                self._flush_media_group_later(key, context))
+            # Держим ссылку, пока альбом не обработан
+            self._media_group_tasks.add(task)
+            task.add_done_callback(self._media_group_tasks.discard)
+
+        group['photos'].append(photo)
+        group['last_seen'] = time.monotonic()
+
+    async def _flush_media_group_later(self, key: Tuple[int, str],
+                                       context: ContextTypes.DEFAULT_TYPE):
+        """Дожидается всех фото альбома и добавляет их в сессию разом"""
+        group = self._media_groups[key]
+        # Telegram присылает фото альбома отдельными обновлениями подряд
+        while True:
+            delay = (group['last_seen'] + self.config.MEDIA_GROUP_WAIT -
+                     time.monotonic())
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        # Альбом меняет сессию, поэтому встает в очередь обновлений
+        # пользователя, как если бы пришел отдельным обновлением
+        processor = context.application.update_processor
+        if isinstance(processor, UserOrderedUpdateProcessor):
+            await processor.run_for_user(
+                key[0], self._flush_media_group(key, context))
+        else:
+            await self._flush_media_group(key, context)
+
+    async def _flush_media_group(self, key: Tuple[int, str],
+                                 context: ContextTypes.DEFAULT_TYPE):
+        """Добавляет собранный альбом в сессию пользователя"""
+        # Фото, пришедшие позже, соберутся в новую пачку
+        group = self._media_groups.pop(key)
+
+        user_id, media_group_id = key
+        update = group['update']
+        photos = group['photos']
+        session = self._get_user_session(user_id)
+
+        try:
+            album_size = sum(photo.file_size or 0 for photo in photos)
+            if await self._reject_over_session_limit(update, session, album_size):
+                return
+
+            # Скачиваем все фото альбома параллельно
+            results = await asyncio.gather(
+                *(self.file_handler.download_photo(photo, user_id)
+                  for photo in photos),
+                return_exceptions=True
+            )
+            file_paths = [r for r in results if not isinstance(r, BaseException)]
+            failed = len(results) - len(file_paths)
+            for error in results:
+                if isinstance(error, BaseException):
+                    logger.error(f"Ошибка скачивания фото из альбома: {error}")
+
+            if not file_paths:
+                await update.message.reply_text(
+                    "❌ Не удалось скачать фотографии альбома. Попробуйте еще раз."
+                )
+                return
+
+            await self._register_files(session, file_paths)
+            logger.info(
+                f"Альбом {media_group_id} добавлен в сессию пользователя "
+                f"{user_id}: {len(file_paths)} фото")
+
+            album_status_message = (
+                f"✅ Добавлено фото из альбома: {len(file_paths)}\n"
+                + (f"⚠️ Не удалось скачать: {failed}\n" if failed else "") +
+                f"📁 Всего файлов: {len(session['files'])}\n\n"
+                f"Отправьте еще файлы или используйте /process для обработки."
+            )
+            await self._show_session_status(
+                update, context, session, album_status_message)
+
+        except Exception as e:
+            logger.error(f"Ошибка обработки альбома {media_group_id}: {e}")
+            await update.message.reply_text(
+                "❌ Произошла ошибка при обработке фотографий. Попробуйте еще раз."
+            )
+
+    async def _show_session_status(self, update: Update,
+                                   context: ContextTypes.DEFAULT_TYPE,
+                                   session: Dict[str, Any], text: str):
+        """Показывает состояние сессии, обновляя предыдущее сообщение"""
+        user_id = update.effective_user.id
+        try:
+            # Если это первый файл в сессии, просто отправляем сообщение
+            if (len(session['files']) == 1 or
+                    not session.get('last_message_id')):
+                message = await update.message.reply_text(text)
+                session['last_message_id'] = message.message_id
+            else:
+                # Пытаемся обновить предыдущее сообщение
+                try:
+                    await context.bot.edit_message_text(
+                        text,
+                        chat_id=user_id,
+                        message_id=session['last_message_id']
+                    )
+                except Exception as e:
+                    # Если не удалось отредактировать, отправляем новое
+                    logger.warning(
+                        f"Не удалось отредактировать сообщение: {e}")
+                    message = await update.message.reply_text(text)
+                    session['last_message_id'] = message.message_id
+        except Exception as e:
+            logger.error(f"Ошибка отправки статусного сообщения: {e}")
+            # В крайнем случае отправляем простое уведомление
+            await update.message.reply_text("✅ Фото добавлено в сессию")
+
+    async def _send_archives(self, update: Update, archives: List[Dict[str, Any]]):
+        """Отправляет архивы результата, несколько частей - параллельно"""
+        if len(archives) == 1:
+            await self._send_archive(update, archives[0]['path'])
+            return
+
+        total = len(archives)
+        reporter = ProgressReporter(await update.callback_query.message.reply_text(
+            f"📤 Отправляю архивы: 0 из {total}"))
+        semaphore = asyncio.Semaphore(self.config.MAX_CONCURRENT_UPLOADS)
+        sent = 0
+
+        async def send(index: int, archive: Dict[str, Any]):
+            nonlocal sent
+            async with semaphore:
+                await self._send_archive(
+                    update, archive['path'],
+                    filename=f"обработанные_документы_часть_{index}.zip",
+                    caption=(f"✅ Архив {index} из {total}, "
+                             f"документов: {len(archive['files'])}"))
+            sent += 1
+            reporter.update(f"📤 Отправляю архивы: {sent} из {total}")
+
+        try:
+            await asyncio.gather(
+                *(send(index, archive)
+                  for index, archive in enumerate(archives, 1)))
+        except BaseException:
+            reporter.cancel()
+            raise
+        await reporter.finish(f"✅ Отправлено архивов: {total}")
+
+    async def _send_archive(self, update: Update, archive_path: str,
+                            filename: str = "обработанные_документы.zip",
+                            caption: str = "✅ Обработка завершена! Вот ваш архив с документами."):
+        """Отправляет архив: локальный сервер Bot API читает его с диска сам"""
+        send_options = dict(
+            filename=filename,
+            caption=caption,
+            read_timeout=60,
+            write_timeout=60,
+            connect_timeout=60
+        )
+        if self.config.TELEGRAM_LOCAL_MODE:
+            # В локальном режиме передается только путь (file://)
+            await update.callback_query.message.reply_document(
+                document=Path(os.path.abspath(archive_path)), **send_options)
+            return
+
+        with open(archive_path, 'rb') as archive:
+            await update.callback_query.message.reply_document(
+                document=archive, **send_options)
+
     async def _send_processing_result(self, update: Update, result: Dict[str, Any], user_id: int):
         """Отправка результата обработки пользователю"""
         try:
@@ -559,17 +1092,9 @@ class BotHandler:
                     parse_mode=ParseMode.MARKDOWN
                 )
 
-            # Отправляем архив с увеличенным таймаутом
-            if result.get('archive_path'):
-                with open(result['archive_path'], 'rb') as archive:
-                    await update.callback_query.message.reply_document(
-                        document=archive,
-                        filename=f"обработанные_документы.zip",
-                        caption="✅ Обработка завершена! Вот ваш архив с документами.",
-                        read_timeout=60,
-                        write_timeout=60,
-                        connect_timeout=60
-                    )
+            # Отправляем архивы с увеличенным таймаутом
+            if result.get('archives'):
+                await self._send_archives(update, result['archives'])
 
             # Отправляем отчет об ошибках
             if result.get('errors'):
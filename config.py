@@ -13,11 +13,70 @@ class Config:
             raise ValueError(
                 "TELEGRAM_TOKEN не установлен в переменных окружения")
 
+        # Собственный сервер Bot API (None - публичный api.telegram.org)
+        # Например: http://localhost:8081/bot
+        self.TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+        self.TELEGRAM_FILE_URL = os.getenv("TELEGRAM_FILE_URL")
+        if self.TELEGRAM_API_URL and not self.TELEGRAM_FILE_URL:
+            # http://host:8081/bot -> http://host:8081/file/bot
+            base, _, suffix = self.TELEGRAM_API_URL.rstrip('/').rpartition('/')
+            self.TELEGRAM_FILE_URL = f"{base}/file/{suffix}"
+        # Сервер запущен с --local: файлы читаются и пишутся по локальным путям
+        self.TELEGRAM_LOCAL_MODE = os.getenv(
+            "TELEGRAM_LOCAL_MODE", "").lower() in ("1", "true", "yes")
+
+        # Режим получения обновлений: polling или webhook
+        self.BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+        if self.BOT_MODE not in ("polling", "webhook"):
+            raise ValueError(
+                f"Неизвестный BOT_MODE: {self.BOT_MODE} "
+                f"(допустимо: polling, webhook)")
+        # Адрес и порт, на которых бот принимает webhook запросы
+        self.WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+        self.WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+        # Путь webhook на сервере бота
+        self.WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip('/')
+        # Публичный адрес, который регистрируется в Telegram
+        # (например https://bot.example.com/telegram)
+        self.WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+        # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+        self.WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+        # Сертификат и ключ TLS; без них TLS завершается на прокси
+        self.WEBHOOK_CERT = os.getenv("WEBHOOK_CERT")
+        self.WEBHOOK_KEY = os.getenv("WEBHOOK_KEY")
+        if self.BOT_MODE == "webhook" and not self.WEBHOOK_URL:
+            raise ValueError(
+                "WEBHOOK_URL не установлен для режима webhook")
+
         # Ограничения файлов
         # 50MB - максимальный размер файла в Telegram
         self.MAX_FILE_SIZE = 50 * 1024 * 1024
-        # 100MB - общий лимит для архива
+        # Публичный Bot API отдает боту файлы только до 20MB,
+        # локальный сервер - без ограничения
+        self.MAX_DOWNLOAD_SIZE = (
+            self.MAX_FILE_SIZE if self.TELEGRAM_LOCAL_MODE
+            else 20 * 1024 * 1024)
+        # Максимальный размер отправляемого файла: 50MB у публичного
+        # Bot API, 2000MB у локального сервера
+        self.MAX_UPLOAD_SIZE = (
+            2000 * 1024 * 1024 if self.TELEGRAM_LOCAL_MODE
+            else 50 * 1024 * 1024)
+        # Запас на заголовки ZIP при разбиении результата на части
+        self.ARCHIVE_PART_MARGIN = 1024 * 1024
+        # Фрагмент файла для оценки сжимаемости перед записью в архив
+        self.ARCHIVE_SAMPLE_SIZE = 64 * 1024
+        # Файлы, которые сжимаются меньше чем на 5%, пишутся без сжатия
+        self.ARCHIVE_MIN_SAVING = 0.05
+        # Частей архива, отправляемых одновременно
+        self.MAX_CONCURRENT_UPLOADS = 3
+        # 100MB - общий лимит для архива и всех файлов сессии
         self.MAX_TOTAL_SIZE = 100 * 1024 * 1024
+        # Максимум файлов в одном архиве
+        self.MAX_ARCHIVE_MEMBERS = 1000
+        # Максимальная степень сжатия файла в архиве
+        self.MAX_COMPRESSION_RATIO = 100
+        # Размер блока при распаковке файла из архива
+        self.ARCHIVE_CHUNK_SIZE = 1024 * 1024
 
         # Поддерживаемые форматы
         self.SUPPORTED_IMAGE_FORMATS = ['.jpg', '.jpeg', '.png']
@@ -52,3 +111,100 @@ class Config:
         self.MAX_CONCURRENT_FILES = 5
         # Время хранения временных файлов (1 час)
         self.CLEANUP_DELAY = 3600
+        # Сессия без активности дольше этого срока закрывается вместе
+        # с файлами, и они перестают быть защищены от очистки
+        self.SESSION_IDLE_TIMEOUT = self.CLEANUP_DELAY
+        # Промежуточные файлы заданий в памяти: каталог на tmpfs
+        # (пустая строка - только диск) и бюджет одного задания
+        self.WORKSPACE_RAM_DIR = os.getenv(
+            "WORKSPACE_RAM_DIR",
+            "/dev/shm/dockitbot" if os.path.isdir("/dev/shm") else "")
+        # 64MB - сверх этого промежуточные файлы переносятся на диск
+        self.WORKSPACE_RAM_BUDGET = 64 * 1024 * 1024
+        # Общий бюджет памяти всех заданий процесса
+        self.WORKSPACE_RAM_TOTAL_BUDGET = int(os.getenv(
+            "WORKSPACE_RAM_TOTAL_BUDGET", str(256 * 1024 * 1024)))
+        # 8MB - столько должно остаться свободным на tmpfs после записи
+        # (в Docker /dev/shm по умолчанию всего 64MB)
+        self.WORKSPACE_RAM_MIN_FREE = 8 * 1024 * 1024
+        # Интервал фоновой очистки диска (секунды)
+        self.JANITOR_INTERVAL = 600
+        # 10GB - предел для temp/, output/ и cache/ вместе
+        self.DISK_QUOTA = 10 * 1024 * 1024 * 1024
+        # 1GB - минимум свободного места на диске
+        self.DISK_MIN_FREE = 1024 * 1024 * 1024
+        # Файлы моложе этого возраста не удаляются досрочно (секунды)
+        self.DISK_EVICTION_MIN_AGE = 300
+        # Минимальный интервал между обновлениями сообщения с прогрессом
+        self.PROGRESS_UPDATE_INTERVAL = 2.0
+        # Обновлений Telegram, обрабатываемых одновременно
+        # (обновления одного пользователя всегда идут по очереди)
+        self.MAX_CONCURRENT_UPDATES = 16
+        # Максимум принятых, но еще не обработанных обновлений
+        self.MAX_PENDING_UPDATES = 256
+        # Пауза после последнего фото альбома перед его обработкой
+        self.MEDIA_GROUP_WAIT = 1.0
+
+        # Поиск дубликатов среди загруженных файлов
+        self.DUPLICATE_DETECTION = True
+        # Сторона перцептивного хэша изображения (16 -> 256 бит)
+        self.DUPLICATE_HASH_SIZE = 16
+        # Максимальное расстояние Хэмминга для почти одинаковых изображений.
+        # Разные страницы с одной версткой расходятся уже на 9-20 бит, поэтому
+        # похожие изображения только отмечаются в описи; пропускается лишь
+        # файл с тем же SHA-256, группой и номером страницы
+        self.DUPLICATE_MAX_DISTANCE = 6
+
+        # Скачивание файлов из Telegram
+        # Одновременных скачиваний на весь бот и на одного пользователя
+        self.MAX_CONCURRENT_DOWNLOADS = 8
+        self.MAX_CONCURRENT_DOWNLOADS_PER_USER = 3
+        # Попыток на файл, оборванный файл докачивается
+        self.DOWNLOAD_MAX_ATTEMPTS = 5
+        # Экспоненциальная задержка между попытками (секунды)
+        self.DOWNLOAD_BACKOFF_BASE = 1.0
+        self.DOWNLOAD_BACKOFF_MAX = 30.0
+        # Максимальная пауза в получении данных (секунды)
+        self.DOWNLOAD_READ_TIMEOUT = 60.0
+        self.DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+        # 8MB - файлы до этого размера скачиваются в память и пишутся
+        # на диск одним вызовом, без чтения обратно для отпечатка; на диск
+        # не попадают только такие ZIP архивы (0 - всегда скачивать на диск).
+        # Буфер живет только до записи: FileRecord и Page работают с путями
+        self.INGEST_MEMORY_THRESHOLD = 8 * 1024 * 1024
+
+        # Кэш скачанных файлов по file_unique_id
+        self.FILE_CACHE_ENABLED = True
+        self.FILE_CACHE_DIR = "cache/files"
+        # Запись живет сутки с последнего использования
+        self.FILE_CACHE_TTL = 24 * 3600
+        # 1GB - общий размер кэша
+        self.FILE_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+        # Хранилище исходников и результатов обработки по содержимому
+        self.BLOB_STORE_DIR = "cache/blobs"
+        # Сколько хранить файлы, на которые больше не ссылается ни одно задание
+        self.BLOB_STORE_RETENTION = 3600
+        # Манифест пишется на диск не чаще раза в столько секунд
+        self.BLOB_STORE_SAVE_INTERVAL = 5.0
+
+        # Пул процессов для декодирования изображений и записи PDF
+        self.CPU_POOL_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+        # Способ запуска процессов пула
+        self.CPU_POOL_START_METHOD = "spawn"
+
+        # Планировщик заданий
+        # Максимум одновременно выполняемых заданий всех пользователей
+        self.MAX_ACTIVE_JOBS = 3
+        # Задания до этого числа файлов идут по быстрой полосе
+        self.SMALL_JOB_MAX_FILES = 3
+        # Слоты, которые крупные задания не могут занять
+        self.FAST_LANE_RESERVED_SLOTS = 1
+
+        # Предобработка файлов сразу после загрузки (до команды /process)
+        self.SPECULATIVE_PROCESSING = False
+        # Одновременных предобработок на весь бот
+        self.SPECULATIVE_CONCURRENCY = 1
+        # Максимум незавершенных предобработок одного пользователя
+        self.SPECULATIVE_MAX_PER_USER = 10
@@ -0,0 +1,186 @@
+"""
+Пул процессов для CPU-тяжелых операций DocKitBot
+"""
+
+import abc
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from loguru import logger
+
+from config import Config
+
+
+class CpuTask(abc.ABC):
+    """Описание CPU-тяжелой операции для выполнения в пуле процессов.
+
+    Наследники хранят только picklable данные (пути, параметры, страницы)
+    и выполняют работу в методе run внутри процесса пула.
+    """
+
+    __slots__ = ()
+
+    @abc.abstractmethod
+    def run(self) -> Any:
+        """Выполняет операцию в процессе пула"""
+
+
+class TaskCancelled(Exception):
+    """Задача пула прервана: задание, для которого она работала, отменено"""
+
+
+class CancelToken:
+    """Флаг отмены задания, видимый процессам пула.
+
+    Отмена корутины не останавливает задачу, уже переданную в процесс
+    пула, поэтому задачи сами проверяют флаг перед началом работы и между
+    страницами (raise_if_cancelled). Флаг - файл во временном каталоге:
+    его видят процессы, запущенные через spawn, а проверка стоит один
+    stat. Файл удаляется, когда задание закрыло флаг и все его задачи
+    в пуле завершились.
+    """
+
+    __slots__ = ('path', '_running', '_closed', '_lock')
+
+    def __init__(self):
+        self.path = os.path.join(
+            tempfile.gettempdir(), f"dockit-cancel-{uuid.uuid4().hex}")
+        # Задачи пула, которые еще могут проверить флаг
+        self._running = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return os.path.exists(self.path)
+
+    def cancel(self):
+        """Просит задачи пула остановиться"""
+        with open(self.path, 'a'):
+            pass
+
+    def attach(self, future: Future):
+        """Держит флаг, пока задача future не завершится в пуле"""
+        with self._lock:
+            self._running += 1
+        future.add_done_callback(self._detach)
+
+    def _detach(self, future: Future):
+        # Вызывается из служебного потока пула
+        with self._lock:
+            self._running -= 1
+            if self._closed and not self._running:
+                self._remove()
+
+    def close(self):
+        """Задание завершилось: флаг больше не нужен после его задач"""
+        with self._lock:
+            self._closed = True
+            if not self._running:
+                self._remove()
+
+    def _remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+# Флаг отмены задания, в котором выполняется текущая корутина;
+# дочерние задачи asyncio получают его вместе с копией контекста
+_current_token: ContextVar[Optional[CancelToken]] = ContextVar(
+    'cpu_cancel_token', default=None)
+
+# Путь флага отмены задачи, которая выполняется в этом процессе пула
+_worker_cancel_path: Optional[str] = None
+
+
+def use_cancel_token(token: Optional[CancelToken]):
+    """Связывает задачи пула текущей корутины с флагом отмены"""
+    _current_token.set(token)
+
+
+def raise_if_cancelled():
+    """Прерывает задачу пула, если ее задание отменено"""
+    if _worker_cancel_path is not None and os.path.exists(_worker_cancel_path):
+        raise TaskCancelled()
+
+
+def _run_task(task: CpuTask, cancel_path: Optional[str] = None) -> Any:
+    """Точка входа задачи в процессе пула"""
+    global _worker_cancel_path
+    _worker_cancel_path = cancel_path
+    try:
+        # Задача могла ждать свободный процесс уже после отмены
+        raise_if_cancelled()
+        return task.run()
+    finally:
+        _worker_cancel_path = None
+
+
+class CpuPool:
+    """Общий пул процессов для декодирования, поворота и записи PDF"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.config = Config()
+        self.max_workers = max_workers or self.config.CPU_POOL_WORKERS
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Создает пул процессов при первом обращении"""
+        if self._executor is None:
+            # spawn: рабочие процессы не наследуют потоки и блокировки бота
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context(
+                    self.config.CPU_POOL_START_METHOD)
+            )
+            logger.info(
+                f"Пул процессов запущен: {self.max_workers} процессов")
+        return self._executor
+
+    async def run(self, task: CpuTask) -> Any:
+        """Выполняет задачу в пуле, не блокируя цикл событий.
+
+        Задача получает флаг отмены текущего задания (use_cancel_token).
+        """
+        token = _current_token.get()
+        try:
+            future = self._get_executor().submit(
+                _run_task, task, token.path if token is not None else None)
+            if token is not None:
+                token.attach(future)
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            # Процесс пула аварийно завершился - пересоздадим пул
+            logger.error(
+                f"Пул процессов поврежден при выполнении "
+                f"{type(task).__name__}, перезапускаем")
+            self.shutdown(wait=False)
+            raise
+
+    def shutdown(self, wait: bool = True):
+        """Останавливает пул процессов"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+            logger.info("Пул процессов остановлен")
+
+
+_shared_pool: Optional[CpuPool] = None
+
+
+def get_cpu_pool() -> CpuPool:
+    """Возвращает общий для всего бота пул процессов"""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = CpuPool()
+    return _shared_pool
@@ -4,16 +4,76 @@
 
 import asyncio
 import os
-import re
+import uuid
 from collections import defaultdict
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional
 
 from loguru import logger
 
 from config import Config
+from DocKitBot.blob_store import get_blob_store
 from DocKitBot.file_handler import FileHandler
-from DocKitBot.image_processor import ImageProcessor
+from DocKitBot.file_record import FileRecord
+from DocKitBot.image_processor import ImageProcessor, ocr_failed
+from DocKitBot.page import Page
 from DocKitBot.pdf_converter import PDFConverter
+from DocKitBot.workspace import JobWorkspace
+
+# Этап хранилища: исправленная ориентация и конвертация в PDF
+PROCESSED_STEP = 'processed-v1'
+
+
+class SpeculativeTask:
+    """Фоновая предобработка файла, запущенная до команды /process.
+
+    Предобработка работает со ссылкой на загрузку в собственном каталоге
+    (workspace) и держит файлы в хранилище под своей ссылкой ref, поэтому
+    ни загрузки пользователя, ни результаты других файлов она не
+    затрагивает. Каталог удаляется в discard, после того как задание
+    забрало результат к себе.
+    """
+
+    __slots__ = ('file_path', 'task', 'started', 'workspace', 'ref')
+
+    def __init__(self, file_path: str, workspace: JobWorkspace):
+        self.file_path = file_path
+        self.task: Optional[asyncio.Task] = None
+        # Обработка началась (получен слот низкого приоритета)
+        self.started = False
+        self.workspace = workspace
+        self.ref = f"spec:{workspace.user_id}:{workspace.job_id}"
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """Забирает результат предобработки.
+
+        Если предобработка еще не началась, она отменяется, и файл
+        обрабатывается в задании как обычно (возвращается None).
+        """
+        if not self.started:
+            self.task.cancel()
+            return None
+
+        await asyncio.wait([self.task])
+        if self.task.cancelled() or self.task.exception():
+            return None
+        return self.task.result()
+
+    def discard(self):
+        """Отменяет предобработку и удаляет ее каталог"""
+        if not self.task.done():
+            # Прерванная предобработка убирает за собой сама
+            self.task.cancel()
+            return
+        self.cleanup()
+
+    def cleanup(self):
+        """Удаляет каталог предобработки и освобождает ее файлы в хранилище"""
+        self.workspace.cleanup()
+        try:
+            get_blob_store().release(self.ref)
+        except OSError as e:
+            logger.warning(
+                f"Не удалось освободить файлы предобработки {self.ref}: {e}")
 
 
 class DocumentProcessor:
@@ -26,39 +86,47 @@ class DocumentProcessor:
     async def process_single_file(self, file_path: str, user_id: int) -> Dict[str, Any]:
         """Обрабатывает один файл"""
         try:
-            # Получаем информацию о файле
-            file_info = self.file_handler.get_file_info(file_path)
-            if not file_info:
+            # Имя файла разбирается и проверяется один раз, при создании записи
+            try:
+                record = self.file_handler.create_record(file_path)
+            except OSError:
                 return {'success': False, 'error': 'Не удалось получить информацию о файле'}
 
-            # Проверяем имя файла
-            validation = self.file_handler.validate_file_name(
-                file_info['name'])
+            validation = record.name_validation
             if not validation['valid']:
                 return {
                     'success': False,
                     'error': f"Некорректное имя файла: {'; '.join(validation['warnings'])}"
                 }
 
-            # Обрабатываем файл
-            processed_file = await self._process_file(file_path, file_info)
-
-            if not processed_file:
-                return {'success': False, 'error': 'Не удалось обработать файл'}
-
-            # Создаем архив с одним файлом
-            archive_path = self.file_handler.create_archive(
-                [processed_file], user_id)
-
-            # Формируем опись
-            inventory = self._create_inventory([processed_file])
-
-            # Очищаем временные файлы
-            self.file_handler.cleanup_user_files(user_id)
+            # Обрабатываем копию файла в каталоге задания: загрузки
+            # пользователя и другие задания не затрагиваются
+            job_id = f"single-{uuid.uuid4().hex[:8]}"
+            workspace = JobWorkspace(user_id, job_id)
+            try:
+                adopted = await asyncio.to_thread(workspace.adopt, [file_path])
+                processed_file = await self._process_file(
+                    record.with_path(adopted[file_path]), workspace)
+
+                if not processed_file:
+                    return {'success': False, 'error': 'Не удалось обработать файл'}
+
+                # Создаем архив с одним файлом
+                oversized: List[str] = []
+                archives = await self.file_handler.build_archives(
+                    [processed_file], user_id, job_id, oversized=oversized)
+
+                # Формируем опись
+                inventory = self._create_inventory(
+                    [self.file_handler.create_record(processed_file)],
+                    oversized=oversized)
+            finally:
+                # Удаляем только промежуточные файлы этого вызова
+                await asyncio.to_thread(workspace.cleanup)
 
             return {
                 'success': True,
-                'archive_path': archive_path,
+                'archives': archives,
                 'inventory': inventory,
                 'errors': validation.get('warnings', [])
             }
@@ -72,54 +140,64 @@ class DocumentProcessor:
         try:
             processed_files = []
             errors = []
-
-            # Обрабатываем каждый файл
-            for file_path in file_paths:
+            records = [self.file_handler.create_record(file_path)
+                       for file_path in file_paths]
+
+            # Отсеиваем дубликаты до начала обработки
+            duplicates, similar = {}, {}
+            if self.config.DUPLICATE_DETECTION:
+                for record in records:
+                    await self.file_handler.fingerprint_record(record)
+                duplicates, similar = self.file_handler.find_duplicates(records)
+                records = [r for r in records if r not in duplicates]
+
+            # Обрабатываем файлы параллельно, порядок результатов сохраняется.
+            # Работаем с копиями в каталоге задания: загрузки пользователя
+            # и другие задания не затрагиваются
+            batch_id = f"batch-{uuid.uuid4().hex[:8]}"
+            ref = f"batch:{user_id}:{batch_id}"
+            workspace = JobWorkspace(user_id, batch_id)
+            try:
+                adopted = await asyncio.to_thread(
+                    workspace.adopt, [record.path for record in records])
+                for record in records:
+                    record.path = adopted[record.path]
                 try:
-                    file_info = self.file_handler.get_file_info(file_path)
-                    if not file_info:
-                        errors.append(
-                            f"Не удалось получить информацию о файле: {file_path}")
-                        continue
-
-                    # Проверяем имя файла
-                    validation = self.file_handler.validate_file_name(
-                        file_info['name'])
-                    if validation['warnings']:
-                        errors.extend(validation['warnings'])
-
-                    # Обрабатываем файл
-                    processed_file = await self._process_file(file_path, file_info)
-                    if processed_file:
-                        processed_files.append(processed_file)
+                    results = await self.process_files_concurrently(
+                        records, ref=ref, workspace=workspace)
+                finally:
+                    await self.release_artifacts(ref)
+                for result in results:
+                    errors.extend(result['warnings'])
+                    if result['success']:
+                        processed_files.append(
+                            result['record'].with_path(result['processed_file']))
                     else:
-                        errors.append(
-                            f"Не удалось обработать файл: {file_info['name']}")
-
-                except Exception as e:
-                    logger.error(f"Ошибка обработки файла {file_path}: {e}")
-                    errors.append(
-                        f"Ошибка обработки {os.path.basename(file_path)}: {str(e)}")
+                        errors.append(result['error'])
 
-            if not processed_files:
-                return {'success': False, 'error': 'Не удалось обработать ни одного файла'}
+                if not processed_files:
+                    return {'success': False, 'error': 'Не удалось обработать ни одного файла'}
 
-            # Группируем и объединяем многостраничные документы
-            final_files = await self._group_and_merge_pages(processed_files)
+                # Группируем и объединяем многостраничные документы
+                final_files = await self._group_and_merge_pages(
+                    processed_files, workspace)
 
-            # Создаем архив
-            archive_path = self.file_handler.create_archive(
-                final_files, user_id)
+                # Создаем архивы в пределах лимита отправки
+                oversized: List[str] = []
+                archives = await self.file_handler.build_archives(
+                    [record.path for record in final_files], user_id, batch_id,
+                    oversized=oversized)
 
-            # Формируем опись
-            inventory = self._create_inventory(final_files)
-
-            # Очищаем временные файлы
-            self.file_handler.cleanup_user_files(user_id)
+                # Формируем опись
+                inventory = self._create_inventory(
+                    final_files, duplicates, archives, similar, oversized)
+            finally:
+                # Удаляем только промежуточные файлы этого вызова
+                await asyncio.to_thread(workspace.cleanup)
 
             return {
                 'success': True,
-                'archive_path': archive_path,
+                'archives': archives,
                 'inventory': inventory,
                 'errors': errors
             }
@@ -128,52 +206,251 @@ class DocumentProcessor:
             logger.error(f"Ошибка обработки множественных файлов: {e}")
             return {'success': False, 'error': str(e)}
 
-    async def _process_file(self, file_path: str, file_info: Dict[str, Any]) -> str:
-        """Обрабатывает один файл (поворот, конвертация)"""
+    async def process_files_concurrently(self, records: List[FileRecord],
+                                         progress_callback=None,
+                                         speculative: Optional[Dict[str, SpeculativeTask]] = None,
+                                         ref: Optional[str] = None,
+                                         workspace: Optional[JobWorkspace] = None
+                                         ) -> List[Dict[str, Any]]:
+        """Обрабатывает файлы параллельно, не более MAX_CONCURRENT_FILES сразу.
+
+        Результаты возвращаются в порядке входных файлов, ошибка одного
+        файла не влияет на остальные. progress_callback вызывается после
+        завершения каждого файла с числом готовых файлов, общим числом
+        и записью завершенного файла. Готовые результаты предобработки из
+        speculative используются вместо повторной обработки. Исходники и
+        результаты помещаются в хранилище под ссылкой ref, которую
+        вызывающий освобождает через release_artifacts. Результаты
+        размещаются в каталоге задания workspace, если он передан.
+        """
+        semaphore = asyncio.Semaphore(self.config.MAX_CONCURRENT_FILES)
+        speculative = speculative or {}
+        total_files = len(records)
+        completed = 0
+
+        async def process(record: FileRecord) -> Dict[str, Any]:
+            nonlocal completed
+            result = None
+            speculation = speculative.get(record.path)
+            if speculation is not None:
+                result = await speculation.claim()
+                if result is not None:
+                    # Предобработка работала с копией записи
+                    result = dict(result, record=record)
+
+            if result is None:
+                async with semaphore:
+                    result = await self._process_file_isolated(
+                        record, ref, workspace)
+
+            completed += 1
+            if progress_callback:
+                try:
+                    await progress_callback(completed, total_files, record)
+                except Exception as e:
+                    logger.warning(f"Ошибка обновления прогресса: {e}")
+            return result
+
+        return await asyncio.gather(
+            *(process(record) for record in records))
+
+    def speculate(self, record: FileRecord, user_id: int,
+                  slots: asyncio.Semaphore) -> SpeculativeTask:
+        """Запускает фоновую предобработку файла с низким приоритетом.
+
+        slots ограничивает число одновременных предобработок, чтобы они
+        не отнимали ресурсы у заданий, запущенных через /process.
+        """
+        workspace = JobWorkspace(user_id, f"spec-{uuid.uuid4().hex[:8]}")
+        speculation = SpeculativeTask(record.path, workspace)
+
+        async def run() -> Dict[str, Any]:
+            async with slots:
+                speculation.started = True
+                try:
+                    adopted = await asyncio.to_thread(
+                        workspace.adopt, [record.path])
+                    return await self._process_file_isolated(
+                        record.with_path(adopted[record.path]),
+                        speculation.ref, workspace)
+                except BaseException:
+                    speculation.cleanup()
+                    raise
+
+        speculation.task = asyncio.create_task(run())
+        return speculation
+
+    async def release_artifacts(self, ref: str):
+        """Освобождает ссылки задания в хранилище и собирает мусор"""
+        store = get_blob_store()
         try:
-            file_ext = file_info['extension']
+            await asyncio.to_thread(store.release, ref)
+            await asyncio.to_thread(store.gc)
+        except OSError as e:
+            logger.warning(f"Не удалось освободить файлы задания {ref}: {e}")
+
+    async def _process_file_isolated(self, record: FileRecord,
+                                     ref: Optional[str] = None,
+                                     workspace: Optional[JobWorkspace] = None
+                                     ) -> Dict[str, Any]:
+        """Обрабатывает один файл, превращая любую ошибку в результат"""
+        # Путь запоминаем сразу: задание может перенести запись в свой каталог
+        file_path = record.path
+        display_name = record.decoded_name
+        result = {
+            'success': False,
+            'file_path': file_path,
+            'record': record,
+            'processed_file': None,
+            'error': None,
+            'warnings': []
+        }
 
-            # Если это PDF, конвертируем в изображения для определения ориентации текста
+        try:
+            # Имя файла проверено при создании записи
+            result['warnings'] = list(record.name_validation['warnings'])
+
+            # Имя результата занимается один раз на запись: одноименные
+            # загрузки (Договор.jpg и Договор.png) не перезаписывают
+            # результаты друг друга
+            output_path = await asyncio.to_thread(
+                self._get_output_path, record)
+            processed_file = await self._process_file_stored(
+                record, ref, workspace, output_path)
+            if processed_file:
+                result['success'] = True
+                result['processed_file'] = processed_file
+            else:
+                self._release_output_path(record, output_path)
+                result['error'] = f"Не удалось обработать файл: {display_name}"
+
+        except Exception as e:
+            logger.error(f"Ошибка обработки файла {file_path}: {e}")
+            result['error'] = f"Ошибка обработки {display_name}: {str(e)}"
+
+        return result
+
+    async def _process_file_stored(self, record: FileRecord,
+                                   ref: Optional[str] = None,
+                                   workspace: Optional[JobWorkspace] = None,
+                                   output_path: Optional[str] = None
+                                   ) -> Optional[str]:
+        """Обрабатывает файл, если тот же контент еще не обрабатывался.
+
+        Хэш записи, посчитанный при приеме файла, избавляет от повторного
+        чтения уже известного хранилищу файла. output_path - путь
+        результата, уже занятый через _get_output_path.
+        """
+        file_path = record.path
+        if output_path is None:
+            output_path = self._get_output_path(record)
+        store = get_blob_store()
+        digest = None
+        known = None
+        if record.content_hash and record.content_hash.startswith('sha256:'):
+            known = record.content_hash[len('sha256:'):]
+        try:
+            digest = await asyncio.to_thread(store.put, file_path, ref, known)
+            derived = await asyncio.to_thread(
+                store.get_derived, digest, PROCESSED_STEP)
+            if derived:
+                target_path = output_path
+                if workspace is not None:
+                    target_path = workspace.place(
+                        target_path, store.blob_size(derived))
+                checked_out = await asyncio.to_thread(
+                    store.checkout, derived, target_path, ref)
+                if workspace is not None:
+                    target_path = await asyncio.to_thread(
+                        workspace.settle, target_path)
+                if checked_out:
+                    logger.info(
+                        f"Результат обработки взят из хранилища: {file_path}")
+                    return target_path
+        except OSError as e:
+            logger.warning(f"Хранилище недоступно для {file_path}: {e}")
+
+        outcome: Dict[str, Any] = {}
+        processed_file = await self._process_file(
+            record, workspace, outcome, output_path)
+        # Результат без проверенной ориентации в хранилище не попадает:
+        # повторная отправка файла должна снова пройти OCR
+        if processed_file and digest and outcome.get('complete'):
+            try:
+                await asyncio.to_thread(
+                    store.put_derived, digest, PROCESSED_STEP,
+                    processed_file, ref)
+            except OSError as e:
+                logger.warning(
+                    f"Не удалось сохранить результат {processed_file}: {e}")
+        return processed_file
+
+    def _get_output_path(self, record: FileRecord) -> str:
+        """Путь результата обработки: PDF исправляется на месте,
+        изображение превращается в PDF рядом с ним.
+
+        Имя PDF для изображения занимается на диске ("имя.pdf",
+        "имя (2).pdf", ...), поэтому результаты одноименных файлов и
+        соседние PDF не перезаписываются. Пустой файл-заглушка держит
+        имя, пока результат живет в памяти задания.
+        """
+        if record.file_type == '.pdf':
+            return record.path
+        return self.file_handler._reserve_path(
+            os.path.join(os.path.dirname(record.path), record.pdf_name))
+
+    def _release_output_path(self, record: FileRecord, output_path: str):
+        """Освобождает занятое имя, если результат так и не записан"""
+        if output_path == record.path:
+            return
+        try:
+            if os.path.getsize(output_path) == 0:
+                os.remove(output_path)
+        except OSError:
+            pass
+
+    async def _process_file(self, record: FileRecord,
+                            workspace: Optional[JobWorkspace] = None,
+                            outcome: Optional[Dict[str, Any]] = None,
+                            output_path: Optional[str] = None) -> str:
+        """Обрабатывает один файл (поворот, конвертация).
+
+        В outcome['complete'] записывается, прошли ли все этапы без
+        ошибок: только такой результат можно переиспользовать.
+        """
+        file_path = record.path
+        if outcome is None:
+            outcome = {}
+        outcome['complete'] = False
+        try:
+            file_ext = record.file_type
+
+            # Если это PDF, проверяем ориентацию текста каждой страницы
             if file_ext == '.pdf':
                 try:
-                    # Конвертируем PDF в изображения для анализа ориентации текста
-                    images = await self.pdf_converter.pdf_to_images(file_path)
-                    if not images:
-                        logger.warning(f"Не удалось конвертировать PDF в изображения: {file_path}")
+                    pages = await self.pdf_converter.pdf_to_pages(file_path)
+                    if not pages:
+                        logger.warning(f"Не удалось разбить PDF на страницы: {file_path}")
                         return file_path
 
-                    # Проверяем ориентацию текста каждой страницы
-                    corrected_images = []
-                    needs_correction = False
-
-                    for i, image_path in enumerate(images):
+                    for i, page in enumerate(pages):
                         # Определяем правильную ориентацию текста с помощью OCR
-                        corrected_image = await self.image_processor.correct_orientation(image_path)
-                        if corrected_image != image_path:
-                            needs_correction = True
+                        await self.image_processor.correct_page_orientation(page)
+                        # Пиксели больше не нужны: поворот пишется в /Rotate
+                        page.release()
+                        if page.rotation:
                             logger.info(f"Страница {i+1} требует исправления ориентации")
-                        corrected_images.append(corrected_image)
 
-                    if needs_correction:
-                        # Объединяем исправленные изображения обратно в PDF
-                        corrected_pdf = await self.pdf_converter.images_to_pdf(
-                            corrected_images,
-                            os.path.splitext(os.path.basename(file_path))[0]
-                        )
-
-                        # Очищаем временные изображения
-                        for img_path in images + corrected_images:
-                            if img_path != file_path and os.path.exists(img_path):
-                                os.remove(img_path)
+                    if any(page.rotation for page in pages):
+                        corrected_pdf = await self.pdf_converter.pages_to_pdf(
+                            pages, file_path, workspace)
 
                         logger.info(f"PDF ориентация текста исправлена: {file_path} -> {corrected_pdf}")
+                        outcome['complete'] = not ocr_failed(pages)
                         return corrected_pdf
                     else:
-                        # Очищаем временные изображения
-                        for img_path in images:
-                            if img_path != file_path and os.path.exists(img_path):
-                                os.remove(img_path)
                         logger.info(f"PDF ориентация текста корректна: {file_path}")
+                        outcome['complete'] = not ocr_failed(pages)
                         return file_path
 
                 except Exception as e:
@@ -182,26 +459,21 @@ class DocumentProcessor:
 
             # Если это изображение, обрабатываем
             if file_ext in self.config.SUPPORTED_IMAGE_FORMATS:
+                page = Page(file_path)
                 try:
-                    # Определяем и исправляем ориентацию с таймаутом
-                    corrected_image = await asyncio.wait_for(
-                        self.image_processor.correct_orientation(file_path),
-                        timeout=self.config.OCR_TIMEOUT
-                    )
-
-                    # Конвертируем в PDF
-                    pdf_path = await self.pdf_converter.image_to_pdf(
-                        corrected_image, file_info['name'])
-
-                    # Удаляем временное изображение
-                    if corrected_image != file_path:
-                        os.remove(corrected_image)
-
+                    # Ориентация определяется в том же процессе пула, который
+                    # пишет PDF: страница декодируется и кодируется один раз,
+                    # а пиксели не передаются между процессами. Таймаут OCR
+                    # ограничивает каждый вызов Tesseract
+                    if output_path is None:
+                        output_path = self._get_output_path(record)
+                    pdf_path = await self.pdf_converter.pages_to_pdf(
+                        [page], output_path,
+                        workspace, orient_timeout=self.config.OCR_TIMEOUT)
+                    outcome['complete'] = not ocr_failed([page])
                     return pdf_path
-                except asyncio.TimeoutError:
-                    logger.error(
-                        f"Таймаут при обработке изображения {file_path}")
-                    raise Exception("Timed out")
+                finally:
+                    page.release()
 
             return None
 
@@ -209,69 +481,63 @@ class DocumentProcessor:
             logger.error(f"Ошибка обработки файла {file_path}: {e}")
             return None
 
-    async def _group_and_merge_pages(self, processed_files: List[str]) -> List[str]:
+    async def _group_and_merge_pages(self, processed_files: List[FileRecord],
+                                     workspace: Optional[JobWorkspace] = None
+                                     ) -> List[FileRecord]:
         """Группирует и объединяет многостраничные документы"""
         try:
             logger.info(f"Начинаю группировку {len(processed_files)} файлов")
 
-            # Группируем файлы по базовому имени
-            file_groups = defaultdict(list)
+            # Группа и номер страницы определены при загрузке файла
+            file_groups: Dict[str, List[FileRecord]] = defaultdict(list)
 
-            for file_path in processed_files:
-                file_name = os.path.basename(file_path)
-                base_name, page_info = self._extract_base_name_and_page(
-                    file_name)
+            for record in processed_files:
                 logger.info(
-                    f"Файл: {file_name} -> базовое имя: '{base_name}', страница: {page_info}")
-                file_groups[base_name].append((file_path, page_info))
+                    f"Файл: {os.path.basename(record.path)} -> базовое имя: "
+                    f"'{record.group_key}', страница: {record.page_number}")
+                file_groups[record.group_key].append(record)
 
             logger.info(f"Найдено групп: {len(file_groups)}")
-            for base_name, files in file_groups.items():
-                logger.info(f"Группа '{base_name}': {len(files)} файлов")
+            for base_name, records in file_groups.items():
+                logger.info(f"Группа '{base_name}': {len(records)} файлов")
 
             final_files = []
 
-            for base_name, files_with_pages in file_groups.items():
-                if len(files_with_pages) == 1:
-                    # Одностраничный документ - обрабатываем ориентацию
-                    file_path = files_with_pages[0][0]
+            for base_name, records in file_groups.items():
+                if len(records) == 1:
+                    # Одностраничный документ - ориентация уже исправлена
+                    # в _process_file, повторно страницы не декодируем
                     logger.info(f"Одностраничный документ: {base_name}")
-
-                    # Обрабатываем ориентацию для одностраничного документа
-                    file_info = {
-                        'name': os.path.basename(file_path),
-                        'extension': os.path.splitext(file_path)[1]
-                    }
-                    processed_file = await self._process_file(file_path, file_info)
-                    if processed_file:
-                        final_files.append(processed_file)
-                    else:
-                        final_files.append(file_path)
+                    final_files.append(records[0])
                 else:
                     # Многостраничный документ
                     logger.info(
-                        f"Многостраничный документ: {base_name}, файлов: {len(files_with_pages)}")
+                        f"Многостраничный документ: {base_name}, файлов: {len(records)}")
                     # Сортируем по номеру страницы
-                    sorted_files = sorted(
-                        files_with_pages, key=lambda x: x[1] if x[1] else 0)
+                    sorted_records = sorted(
+                        records, key=lambda r: r.page_number or 0)
 
                     logger.info(f"Отсортированные файлы для {base_name}:")
-                    for file_path, page_num in sorted_files:
+                    for record in sorted_records:
                         logger.info(
-                            f"  Страница {page_num}: {os.path.basename(file_path)}")
+                            f"  Страница {record.page_number}: "
+                            f"{os.path.basename(record.path)}")
 
                     # Объединяем в один PDF
-                    file_paths = [f[0] for f in sorted_files]
-                    merged_pdf = await self.pdf_converter.merge_pdfs(file_paths, base_name)
+                    file_paths = [record.path for record in sorted_records]
+                    merged_pdf = await self.pdf_converter.merge_pdfs(
+                        file_paths, base_name, correct_orientation=False,
+                        workspace=workspace)
 
                     if merged_pdf:
                         logger.info(f"PDF объединен: {merged_pdf}")
-                        final_files.append(merged_pdf)
+                        final_files.append(
+                            self.file_handler.create_record(merged_pdf))
                     else:
                         # Если не удалось объединить, добавляем по отдельности
                         logger.warning(
                             f"Не удалось объединить PDF для {base_name}")
-                        final_files.extend(file_paths)
+                        final_files.extend(sorted_records)
 
             logger.info(f"Итоговое количество файлов: {len(final_files)}")
             return final_files
@@ -280,51 +546,58 @@ class DocumentProcessor:
             logger.error(f"Ошибка группировки файлов: {e}")
             return processed_files
 
-    def _extract_base_name_and_page(self, file_name: str) -> Tuple[str, int]:
-        """Извлекает базовое имя и номер страницы из имени файла"""
-        # Убираем расширение
-        name_without_ext = os.path.splitext(file_name)[0]
-        logger.info(f"Анализирую имя файла: '{name_without_ext}'")
-
-        # Ищем паттерны страниц
-        for pattern in self.config.PAGE_PATTERNS:
-            logger.info(
-                f"Проверяю паттерн '{pattern}' для '{name_without_ext}'")
-            match = re.search(pattern, name_without_ext, re.IGNORECASE)
-            if match:
-                # Извлекаем номер страницы
-                page_text = match.group()
-                logger.info(f"Найдено совпадение: '{page_text}'")
-                page_number = re.search(r'\d+', page_text)
-                if page_number:
-                    page_num = int(page_number.group())
-                    # Убираем информацию о странице из имени
-                    base_name = re.sub(
-                        pattern, '', name_without_ext, flags=re.IGNORECASE).strip()
-                    logger.info(
-                        f"Найден паттерн '{pattern}': страница {page_num}, базовое имя: '{base_name}'")
-                    return base_name, page_num
-                else:
-                    logger.warning(
-                        f"Не удалось извлечь номер страницы из '{page_text}'")
-            else:
-                logger.info(f"Паттерн '{pattern}' не подошел")
-
-        # Если страница не найдена
-        logger.info(f"Страница не найдена, базовое имя: '{name_without_ext}'")
-        return name_without_ext, None
-
-    def _create_inventory(self, files: List[str]) -> str:
-        """Создает опись документов"""
+    def _create_inventory(self, files: List[FileRecord],
+                          duplicates: Optional[Dict[FileRecord, FileRecord]] = None,
+                          archives: Optional[List[Dict[str, Any]]] = None,
+                          similar: Optional[Dict[FileRecord, FileRecord]] = None,
+                          oversized: Optional[List[str]] = None) -> str:
+        """Создает опись документов.
+
+        Если результат разбит на несколько архивов, документы
+        перечисляются по частям, в которые они попали. Возможные
+        дубликаты обработаны и попали в результат, опись лишь
+        предупреждает о них. Документы из oversized (пути) больше
+        лимита отправки: они перечисляются отдельно как не отправленные.
+        """
         inventory = "📋 **Опись документов:**\n\n"
-
-        for i, file_path in enumerate(files, 1):
-            file_name = os.path.basename(file_path)
-            # Исправляем кодировку файла для правильного отображения
-            fixed_file_name = self.file_handler._fix_filename_encoding(
-                file_name)
-            # Убираем расширение для отображения
-            display_name = os.path.splitext(fixed_file_name)[0]
-            inventory += f"{i}. {display_name}.pdf\n"
+        oversized = set(oversized or [])
+        too_large = [record for record in files if record.path in oversized]
+        files = [record for record in files if record.path not in oversized]
+
+        if archives and len(archives) > 1:
+            # Архивы перечисляют пути, сведения о файлах берем из записей
+            records = {record.path: record for record in files}
+            sections = [(f"📦 **Архив {index} из {len(archives)}:**\n",
+                         [records[file_path] for file_path in archive['files']])
+                        for index, archive in enumerate(archives, 1)]
+        else:
+            sections = [('', files)]
+
+        number = 0
+        for header, section_files in sections:
+            if header:
+                inventory += ("\n" if number else "") + header
+            for record in section_files:
+                number += 1
+                inventory += f"{number}. {record.display_name}.pdf\n"
+
+        if duplicates:
+            inventory += "\n🔁 **Пропущены дубликаты:**\n"
+            for duplicate, original in duplicates.items():
+                inventory += (f"• {duplicate.decoded_name} "
+                              f"(копия {original.decoded_name})\n")
+
+        if too_large:
+            limit = self.config.MAX_UPLOAD_SIZE / 1024 / 1024
+            inventory += (f"\n🚫 **Не отправлены: больше лимита Telegram "
+                          f"{limit:.0f}MB:**\n")
+            for record in too_large:
+                inventory += f"• {record.display_name}.pdf\n"
+
+        if similar:
+            inventory += "\n⚠️ **Возможные дубликаты (включены в результат):**\n"
+            for record, original in similar.items():
+                inventory += (f"• {record.decoded_name} "
+                              f"(похож на {original.decoded_name})\n")
 
         return inventory
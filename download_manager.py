@@ -0,0 +1,225 @@
+"""
+Менеджер скачивания файлов из Telegram для DocKitBot
+"""
+
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import (AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple,
+                    Union)
+
+import httpx
+from loguru import logger
+
+from config import Config
+
+# Ответы сервера, после которых имеет смысл повторить запрос
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    """Файл не удалось скачать"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class DownloadStats:
+    """Итоги одного скачивания"""
+
+    __slots__ = ('file_path', 'bytes', 'resumed_bytes', 'attempts',
+                 'elapsed')
+
+    def __init__(self, file_path: Optional[str] = None):
+        # None - файл скачан в память
+        self.file_path = file_path
+        # Всего байт в скачанном файле
+        self.bytes = 0
+        # Байт, докачанных по Range вместо повторного скачивания
+        self.resumed_bytes = 0
+        self.attempts = 0
+        self.elapsed = 0.0
+
+    def __repr__(self) -> str:
+        speed = self.bytes / self.elapsed / 1024 / 1024 if self.elapsed else 0
+        return (f"{self.bytes / 1024 / 1024:.1f}MB за {self.elapsed:.1f} с "
+                f"({speed:.1f}MB/с), попыток: {self.attempts}, "
+                f"докачано: {self.resumed_bytes / 1024 / 1024:.1f}MB")
+
+
+class DownloadManager:
+    """Общий для бота пул HTTP соединений для скачивания файлов.
+
+    Ограничивает число одновременных скачиваний всего бота и одного
+    пользователя, повторяет неудачные попытки с экспоненциальной
+    задержкой и докачивает оборванные файлы через Range запросы.
+    """
+
+    def __init__(self):
+        self.config = Config()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots = asyncio.Semaphore(self.config.MAX_CONCURRENT_DOWNLOADS)
+        self._user_slots: Dict[int, asyncio.Semaphore] = {}
+        # Скачивания пользователя, которые держат или ждут его семафор
+        self._user_waiters: Dict[int, int] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Создает HTTP клиент при первом обращении"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.config.MAX_CONCURRENT_DOWNLOADS,
+                    max_keepalive_connections=self.config.MAX_CONCURRENT_DOWNLOADS,
+                    keepalive_expiry=60.0
+                ),
+                # Ограничиваем паузы между данными, а не время всего файла
+                timeout=httpx.Timeout(
+                    self.config.DOWNLOAD_READ_TIMEOUT, connect=10.0,
+                    pool=None),
+                follow_redirects=True
+            )
+        return self._client
+
+    async def download(self, url: str, file_path: str,
+                       user_id: int) -> DownloadStats:
+        """Скачивает файл по URL с повторами и докачкой"""
+        async with self._user_slot(user_id), self._slots:
+            stats = DownloadStats(file_path)
+            started = time.monotonic()
+            part_path = f"{file_path}.part"
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+            try:
+                await self._with_retries(
+                    lambda: self._download_attempt(url, part_path, stats),
+                    os.path.basename(file_path), stats)
+                os.replace(part_path, file_path)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+
+            stats.bytes = os.path.getsize(file_path)
+            stats.elapsed = time.monotonic() - started
+            return stats
+
+    async def download_to_memory(self, url: str, user_id: int,
+                                 name: str = "файла"
+                                 ) -> Tuple[bytearray, DownloadStats]:
+        """Скачивает небольшой файл в буфер, без промежуточного .part файла"""
+        async with self._user_slot(user_id), self._slots:
+            stats = DownloadStats()
+            started = time.monotonic()
+            buffer = bytearray()
+            await self._with_retries(
+                lambda: self._download_attempt(url, buffer, stats),
+                name, stats)
+            stats.bytes = len(buffer)
+            stats.elapsed = time.monotonic() - started
+            return buffer, stats
+
+    @asynccontextmanager
+    async def _user_slot(self, user_id: int) -> AsyncIterator[None]:
+        """Слот скачивания пользователя; семафор живет, пока он нужен"""
+        semaphore = self._user_slots.setdefault(
+            user_id,
+            asyncio.Semaphore(self.config.MAX_CONCURRENT_DOWNLOADS_PER_USER))
+        self._user_waiters[user_id] = self._user_waiters.get(user_id, 0) + 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._user_waiters[user_id] -= 1
+            if not self._user_waiters[user_id]:
+                del self._user_waiters[user_id]
+                del self._user_slots[user_id]
+
+    async def _with_retries(self, attempt: Callable[[], Awaitable[None]],
+                            name: str, stats: DownloadStats):
+        """Повторяет попытку скачивания с экспоненциальной задержкой"""
+        while True:
+            stats.attempts += 1
+            try:
+                await attempt()
+                return
+            except (httpx.TransportError, DownloadError) as e:
+                if (isinstance(e, DownloadError) and not e.retryable or
+                        stats.attempts >= self.config.DOWNLOAD_MAX_ATTEMPTS):
+                    raise
+                delay = self._backoff_delay(stats.attempts)
+                logger.warning(
+                    f"Попытка {stats.attempts} скачивания {name} неудачна: "
+                    f"{type(e).__name__}: {e}. "
+                    f"Повторяем через {delay:.1f} с")
+                await asyncio.sleep(delay)
+
+    async def _download_attempt(self, url: str, target: Union[str, bytearray],
+                                stats: DownloadStats):
+        """Одна попытка: продолжает с уже полученного места, если можно.
+
+        target - путь к .part файлу или буфер в памяти.
+        """
+        in_memory = isinstance(target, bytearray)
+        if in_memory:
+            offset = len(target)
+        else:
+            offset = os.path.getsize(target) if os.path.exists(target) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        async with self._get_client().stream(
+                'GET', url, headers=headers) as response:
+            if response.status_code == 416 and offset:
+                # Сервер считает, что файл уже получен целиком
+                return
+            # В URL файла есть токен бота, поэтому в ошибку его не включаем
+            if response.status_code >= 400:
+                raise DownloadError(
+                    f"HTTP {response.status_code}",
+                    retryable=response.status_code in RETRYABLE_STATUS_CODES)
+
+            resume = offset and response.status_code == 206
+            if resume:
+                stats.resumed_bytes += int(
+                    response.headers.get('Content-Length', 0))
+
+            if in_memory:
+                if not resume:
+                    # Range не поддерживается - начинаем заново
+                    del target[:]
+                async for chunk in response.aiter_bytes(
+                        self.config.DOWNLOAD_CHUNK_SIZE):
+                    target.extend(chunk)
+                return
+
+            # Без докачки ответ содержит файл целиком - пишем заново
+            with open(target, 'ab' if resume else 'wb') as part_file:
+                async for chunk in response.aiter_bytes(
+                        self.config.DOWNLOAD_CHUNK_SIZE):
+                    part_file.write(chunk)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным случайным разбросом"""
+        ceiling = min(self.config.DOWNLOAD_BACKOFF_MAX,
+                      self.config.DOWNLOAD_BACKOFF_BASE * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    async def close(self):
+        """Закрывает соединения пула"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_shared_manager: Optional[DownloadManager] = None
+
+
+def get_download_manager() -> DownloadManager:
+    """Возвращает общий для всего бота менеджер скачивания"""
+    global _shared_manager
+    if _shared_manager is None:
+        _shared_manager = DownloadManager()
+    return _shared_manager
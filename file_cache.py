@@ -0,0 +1,182 @@
+"""
+Кэш скачанных из Telegram файлов для DocKitBot
+"""
+
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from loguru import logger
+
+from config import Config
+
+
+def link_file(source_path: str, target_path: str):
+    """Создает жесткую ссылку на файл (копия - запасной вариант)"""
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        # Другая файловая система или ссылки не поддерживаются
+        shutil.copyfile(source_path, target_path)
+
+
+class FileCache:
+    """Индекс file_unique_id -> файл на диске.
+
+    Telegram сохраняет file_unique_id при пересылке и повторной отправке,
+    поэтому повторная загрузка того же файла превращается в жесткую ссылку
+    без обращения к сети. Записи живут FILE_CACHE_TTL секунд с последнего
+    использования, при превышении FILE_CACHE_MAX_SIZE вытесняются давно
+    не использованные. Индекс восстанавливается по каталогу кэша.
+    Методы можно вызывать из потоков (asyncio.to_thread).
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.config = Config()
+        self.cache_dir = cache_dir or self.config.FILE_CACHE_DIR
+        # file_unique_id -> (размер, время последнего использования),
+        # от давно использованных к недавним
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._total_size = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Восстанавливает индекс по файлам в каталоге кэша"""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for used_at, name, size in sorted(entries):
+            self._entries[name] = (size, used_at)
+            self._total_size += size
+        self._evict()
+
+    def _path(self, file_unique_id: str) -> str:
+        return os.path.join(self.cache_dir, file_unique_id)
+
+    def get(self, file_unique_id: str, target_path: str) -> bool:
+        """Связывает файл из кэша с target_path, если он там есть"""
+        if not self.config.FILE_CACHE_ENABLED or not file_unique_id:
+            return False
+        with self._lock:
+            return self._get(file_unique_id, target_path)
+
+    def _get(self, file_unique_id: str, target_path: str) -> bool:
+        self._load()
+
+        entry = self._entries.get(file_unique_id)
+        if entry is None:
+            return False
+
+        size, used_at = entry
+        cached_path = self._path(file_unique_id)
+        if (time.time() - used_at > self.config.FILE_CACHE_TTL or
+                not os.path.exists(cached_path)):
+            self._remove(file_unique_id)
+            return False
+
+        try:
+            link_file(cached_path, target_path)
+        except OSError as e:
+            logger.warning(f"Не удалось взять файл из кэша: {e}")
+            self._remove(file_unique_id)
+            return False
+
+        # Отмечаем использование, в том числе для восстановления индекса
+        now = time.time()
+        os.utime(cached_path, (now, now))
+        self._entries[file_unique_id] = (size, now)
+        self._entries.move_to_end(file_unique_id)
+        logger.info(f"Файл {file_unique_id} взят из кэша без скачивания")
+        return True
+
+    def put(self, file_unique_id: str, file_path: str):
+        """Запоминает скачанный файл под его file_unique_id"""
+        if not self.config.FILE_CACHE_ENABLED or not file_unique_id:
+            return
+        with self._lock:
+            self._put(file_unique_id, file_path)
+
+    def _put(self, file_unique_id: str, file_path: str):
+        self._load()
+
+        try:
+            size = os.path.getsize(file_path)
+            if size > self.config.FILE_CACHE_MAX_SIZE:
+                return
+            if file_unique_id in self._entries:
+                self._remove(file_unique_id)
+            link_file(file_path, self._path(file_unique_id))
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить файл в кэш: {e}")
+            return
+
+        self._entries[file_unique_id] = (size, time.time())
+        self._total_size += size
+        self._evict()
+
+    @property
+    def total_size(self) -> int:
+        """Размер всех файлов кэша"""
+        with self._lock:
+            self._load()
+            return self._total_size
+
+    def trim(self, max_size: Optional[int] = None) -> int:
+        """Удаляет устаревшие записи и сжимает кэш до max_size байт.
+
+        Возвращает число освобожденных байт.
+        """
+        with self._lock:
+            self._load()
+            size_before = self._total_size
+            self._evict(max_size)
+            return size_before - self._total_size
+
+    def _evict(self, max_size: Optional[int] = None):
+        """Удаляет устаревшие записи и лишние по размеру"""
+        if max_size is None:
+            max_size = self.config.FILE_CACHE_MAX_SIZE
+        now = time.time()
+        while self._entries:
+            file_unique_id, (size, used_at) = next(iter(self._entries.items()))
+            if (now - used_at <= self.config.FILE_CACHE_TTL and
+                    self._total_size <= max_size):
+                break
+            self._remove(file_unique_id)
+
+    def _remove(self, file_unique_id: str):
+        size, _ = self._entries.pop(file_unique_id)
+        self._total_size -= size
+        try:
+            os.remove(self._path(file_unique_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(
+                f"Не удалось удалить файл кэша {file_unique_id}: {e}")
+
+
+_shared_cache: Optional[FileCache] = None
+
+
+def get_file_cache() -> FileCache:
+    """Возвращает общий для всего бота кэш файлов"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = FileCache()
+    return _shared_cache
@@ -3,20 +3,71 @@
 """
 
 import asyncio
+import hashlib
+import io
 import os
 import shutil
+import time
+import uuid
 import zipfile
-from typing import Any, Dict, List
+import zlib
+from typing import (Any, AsyncIterator, BinaryIO, Dict, List, Optional,
+                    Tuple, Union)
 
 from loguru import logger
+from PIL import Image, ImageChops, ImageOps
 from telegram import Document, PhotoSize
 
 from config import Config
+from DocKitBot.download_manager import get_download_manager
+from DocKitBot.file_cache import get_file_cache, link_file
+from DocKitBot.file_record import (FileRecord, compile_page_patterns,
+                                   pdf_file_name, split_page_info)
+from DocKitBot.filename_encoding import fix_filename_encoding
+from DocKitBot.workspace import JobWorkspace, is_out_of_space
+
+
+class ArchiveLimitError(ValueError):
+    """Архив превышает допустимый размер, число файлов или степень сжатия"""
+
+
+class ArchiveStats:
+    """Итоги создания архивов результата"""
+
+    __slots__ = ('members', 'stored', 'deflated', 'input_bytes',
+                 'output_bytes', 'elapsed')
+
+    def __init__(self):
+        self.members = 0
+        # Файлы, записанные без сжатия и со сжатием
+        self.stored = 0
+        self.deflated = 0
+        # Размер документов и их размер внутри архивов
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.elapsed = 0.0
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.input_bytes - self.output_bytes
+
+    def __repr__(self) -> str:
+        return (f"архив: файлов {self.members} (без сжатия {self.stored}, "
+                f"сжато {self.deflated}), сэкономлено "
+                f"{self.saved_bytes / 1024 / 1024:.1f}MB за "
+                f"{self.elapsed:.2f} с")
+
+
+def _format_mb(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f}MB"
 
 
 class FileHandler:
     def __init__(self):
         self.config = Config()
+        self.page_patterns = compile_page_patterns(self.config.PAGE_PATTERNS)
+        # Отпечатки, посчитанные по файлу в памяти до записи на диск
+        self._ingest_fingerprints: Dict[str, Tuple[str, Optional[int]]] = {}
 
     async def download_file(self, document: Document, user_id: int) -> str:
         """Скачивает файл из Telegram и возвращает путь к нему"""
@@ -31,28 +82,16 @@ class FileHandler:
             # Дополнительно пытаемся исправить кодировку
             original_name = self._fix_filename_encoding(original_name)
 
-            # Скачиваем файл с повторными попытками
-            file_path = os.path.join(user_temp_dir, original_name)
-            file = await document.get_file()
-
-            # Повторяем до 3 раз при сетевых ошибках
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    await asyncio.wait_for(
-                        file.download_to_drive(file_path),
-                        timeout=120.0  # Увеличиваем таймаут до 2 минут
-                    )
-                    break  # Успешно скачали
-                except (Exception) as retry_error:
-                    if attempt == max_retries - 1:  # Последняя попытка
-                        raise retry_error
-                    # Логируем попытку и ждем перед повтором
-                    logger.warning(
-                        f"Попытка {attempt + 1} неудачна: {retry_error}. "
-                        f"Повторяем через 2 секунды..."
-                    )
-                    await asyncio.sleep(2)
+            # Скачиваем файл с повторными попытками и докачкой;
+            # одноименная загрузка не должна затереть предыдущую
+            file_path = self._reserve_path(
+                os.path.join(user_temp_dir, original_name))
+            try:
+                await self._fetch_file(document, file_path, user_id)
+            except BaseException:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                raise
 
             logger.info(f"Файл скачан: {file_path}")
             return file_path
@@ -72,31 +111,21 @@ class FileHandler:
             user_temp_dir = os.path.join(self.config.TEMP_DIR, str(user_id))
             os.makedirs(user_temp_dir, exist_ok=True)
 
-            # Генерируем имя файла
-            file_name = f"photo_{user_id}_{photo.file_id}.jpg"
-            file_path = os.path.join(user_temp_dir, file_name)
-
-            # Скачиваем фото с повторными попытками
-            file = await photo.get_file()
-
-            # Повторяем до 3 раз при сетевых ошибках
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    await asyncio.wait_for(
-                        file.download_to_drive(file_path),
-                        timeout=120.0  # Увеличиваем таймаут до 2 минут
-                    )
-                    break  # Успешно скачали
-                except (Exception) as retry_error:
-                    if attempt == max_retries - 1:  # Последняя попытка
-                        raise retry_error
-                    # Логируем попытку и ждем перед повтором
-                    logger.warning(
-                        f"Попытка {attempt + 1} скачивания фото неудачна: "
-                        f"{retry_error}. Повторяем через 2 секунды..."
-                    )
-                    await asyncio.sleep(2)
+            # Генерируем имя файла: file_id меняется при каждой отправке,
+            # file_unique_id - нет
+            file_name = f"photo_{user_id}_{photo.file_unique_id}.jpg"
+            # То же фото, присланное повторно, не должно затереть файл,
+            # который уже в сессии или в обработке
+            file_path = self._reserve_path(
+                os.path.join(user_temp_dir, file_name))
+
+            # Скачиваем фото с повторными попытками и докачкой
+            try:
+                await self._fetch_file(photo, file_path, user_id)
+            except BaseException:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                raise
 
             logger.info(f"Фото скачано: {file_path}")
             return file_path
@@ -109,116 +138,514 @@ class FileHandler:
             )
             raise
 
-    async def extract_archive(self, archive_path: str, user_id: int,
-                              progress_callback=None) -> List[str]:
+    def _reserve_path(self, file_path: str) -> str:
+        """Занимает свободное имя файла: "имя.pdf", "имя (2).pdf", ..."""
+        base, extension = os.path.splitext(file_path)
+        candidate = file_path
+        index = 1
+        while True:
+            try:
+                # O_EXCL гарантирует, что параллельная загрузка
+                # не получит то же имя
+                os.close(os.open(
+                    candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return candidate
+            except FileExistsError:
+                index += 1
+                candidate = f"{base} ({index}){extension}"
+
+    async def download_archive(self, document: Document,
+                               user_id: int) -> Union[str, BinaryIO]:
+        """Скачивает ZIP архив: небольшой - только в память, иначе на диск.
+
+        Архив нужен лишь для распаковки, поэтому в память попадает
+        архив до INGEST_MEMORY_THRESHOLD байт, и на диск пишутся только
+        извлеченные файлы.
+        """
+        if not self._fits_in_memory(document):
+            return await self.download_file(document, user_id)
+
+        user_temp_dir = os.path.join(self.config.TEMP_DIR, str(user_id))
+        os.makedirs(user_temp_dir, exist_ok=True)
+        file_path = self._reserve_path(os.path.join(
+            user_temp_dir, document.file_name or "archive.zip"))
+        try:
+            data = await self._fetch_file(
+                document, file_path, user_id, persist=False)
+        except BaseException:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+
+        if data is None:
+            # Архив взят из кэша или у локального сервера Bot API
+            return file_path
+        os.remove(file_path)
+        logger.info(
+            f"Архив {document.file_name} скачан в память: {len(data)} байт")
+        return io.BytesIO(data)
+
+    def _fits_in_memory(self, media: Union[Document, PhotoSize]) -> bool:
+        """Файл достаточно мал, чтобы скачать его в память"""
+        return bool(media.file_size and
+                    media.file_size <= self.config.INGEST_MEMORY_THRESHOLD)
+
+    async def _fetch_file(self, media: Union[Document, PhotoSize],
+                          file_path: str, user_id: int,
+                          persist: bool = True) -> Optional[bytearray]:
+        """Получает файл Telegram: из кэша, локально через ссылку или по сети.
+
+        Небольшие файлы скачиваются в память и записываются на диск одним
+        вызовом; их отпечаток считается по буферу, без чтения с диска.
+        Документы и фото на диск попадают всегда: сессия, каталог задания
+        и пул процессов работают с путями. Только архивы (persist=False)
+        распаковываются прямо из памяти и на диск не пишутся.
+        Возвращает содержимое, если файл скачивался в память.
+        """
+        # Отпечаток прежнего файла с этим именем больше не действителен
+        self._ingest_fingerprints.pop(file_path, None)
+
+        # Повторно присланный файл берем из кэша без запросов к Telegram
+        cache = get_file_cache()
+        if await asyncio.to_thread(cache.get, media.file_unique_id, file_path):
+            return None
+
+        file = await media.get_file()
+        local_path = file.file_path
+        data = None
+        if (self.config.TELEGRAM_LOCAL_MODE and local_path and
+                os.path.isabs(local_path) and os.path.exists(local_path)):
+            # Локальный сервер Bot API уже сохранил файл на этот диск
+            await asyncio.to_thread(link_file, local_path, file_path)
+        elif self._fits_in_memory(media):
+            data, stats = await get_download_manager().download_to_memory(
+                file.file_path, user_id, os.path.basename(file_path))
+            logger.debug(
+                f"Скачивание {os.path.basename(file_path)} в память: {stats}")
+            if not persist:
+                return data
+            await asyncio.to_thread(self._persist_upload, data, file_path)
+        else:
+            stats = await get_download_manager().download(
+                file.file_path, file_path, user_id)
+            logger.debug(f"Скачивание {os.path.basename(file_path)}: {stats}")
+
+        await asyncio.to_thread(cache.put, media.file_unique_id, file_path)
+        return data
+
+    def _persist_upload(self, data: bytearray, file_path: str):
+        """Записывает скачанный в память файл и считает его отпечаток"""
+        temp_path = f"{file_path}.part"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, file_path)
+
+        if self.config.DUPLICATE_DETECTION:
+            try:
+                self._ingest_fingerprints[file_path] = \
+                    self._compute_fingerprint(file_path, data)
+            except Exception as e:
+                # Отпечаток посчитается по файлу при регистрации
+                logger.debug(f"Отпечаток {file_path} из памяти не получен: {e}")
+
+    async def extract_archive(self, archive_path: Union[str, BinaryIO],
+                              user_id: int,
+                              progress_callback=None,
+                              max_bytes: Optional[int] = None) -> List[str]:
         """Распаковывает архив и возвращает список путей к файлам"""
+        extracted_files = [
+            extracted_path async for extracted_path in self.iter_archive(
+                archive_path, user_id, progress_callback, max_bytes)
+        ]
+        logger.info(f"Архив распакован: {len(extracted_files)} файлов")
+        return extracted_files
+
+    async def iter_archive(self, archive_path: Union[str, BinaryIO], user_id: int,
+                           progress_callback=None,
+                           max_bytes: Optional[int] = None) -> AsyncIterator[str]:
+        """Распаковывает архив в фоне и отдает файлы по мере извлечения.
+
+        Извлечение идет в отдельном потоке и опережает потребителя, поэтому
+        обработка первых файлов начинается, пока остальные еще распаковываются.
+        archive_path - путь к архиву или архив в памяти (download_archive).
+        max_bytes ограничивает объем распакованных данных (по умолчанию
+        MAX_TOTAL_SIZE); при превышении лимитов бросается ArchiveLimitError.
+        """
+        if max_bytes is None:
+            max_bytes = self.config.MAX_TOTAL_SIZE
+
+        queue: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.create_task(self._extract_members(
+            archive_path, user_id, queue, progress_callback, max_bytes))
+
+        try:
+            while True:
+                extracted_path = await queue.get()
+                if extracted_path is None:
+                    break
+                yield extracted_path
+
+            # Пробрасываем ошибку распаковки, если она была
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+
+    async def _extract_members(self, archive_path: Union[str, BinaryIO],
+                               user_id: int,
+                               queue: asyncio.Queue, progress_callback=None,
+                               max_bytes: Optional[int] = None):
+        """Извлекает поддерживаемые файлы архива и кладет пути в очередь"""
         try:
+            # Свой каталог у каждого архива: одноименные файлы разных
+            # архивов не пересекаются с файлами сессии и заданий
             extract_dir = os.path.join(
-                self.config.TEMP_DIR, str(user_id), "extracted")
+                self.config.TEMP_DIR, str(user_id), "extracted",
+                uuid.uuid4().hex[:8])
             os.makedirs(extract_dir, exist_ok=True)
-            extracted_files = []
-
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                file_list = zip_ref.namelist()
-                total_files = len([f for f in file_list
-                                  if not f.endswith('/') and
-                                  not f.startswith('__MACOSX/')])
-                processed_count = 0
 
-                for file_name in file_list:
-                    if (file_name.endswith('/') or
-                            file_name.startswith('__MACOSX/')):
-                        continue
+            try:
+                zip_ref = await asyncio.to_thread(
+                    zipfile.ZipFile, archive_path, 'r')
+            except zipfile.BadZipFile:
+                raise ValueError("Поврежденный или неподдерживаемый архив")
 
-                    file_ext = os.path.splitext(file_name)[1].lower()
-                    # Поддерживаем и документы, и изображения
-                    supported_formats = (
-                        self.config.SUPPORTED_DOCUMENT_FORMATS +
-                        self.config.SUPPORTED_IMAGE_FORMATS)
+            try:
+                members = [info for info in zip_ref.infolist()
+                           if not info.is_dir() and
+                           not info.filename.startswith('__MACOSX/')]
+                total_files = len(members)
+                # Поддерживаем и документы, и изображения
+                supported_formats = (
+                    self.config.SUPPORTED_DOCUMENT_FORMATS +
+                    self.config.SUPPORTED_IMAGE_FORMATS)
+
+                supported = []
+                for info in members:
+                    file_ext = os.path.splitext(info.filename)[1].lower()
                     if file_ext not in supported_formats:
                         logger.warning(
                             f"Неподдерживаемый формат в архиве: "
-                            f"{file_name}")
+                            f"{info.filename}")
                         continue
+                    supported.append(info)
+
+                # Проверяем заголовки до того, как что-либо попадет на диск
+                self._check_archive_limits(total_files, supported, max_bytes)
+
+                remaining = max_bytes
+                processed_count = 0
+                for info in supported:
 
                     # Обновляем прогресс
                     processed_count += 1
                     progress = int((processed_count / total_files) * 100)
                     if progress_callback:
-                        await progress_callback(progress, file_name)
-
-                    # Извлекаем файл
-                    zip_ref.extract(file_name, extract_dir)
-                    extracted_path = os.path.join(extract_dir, file_name)
-
-                    # Исправляем кодировку и нормализуем имя
-                    fixed_name = self._fix_filename_encoding(file_name)
-                    fixed_name = self._restore_file_name(fixed_name)
-
-                    if fixed_name != file_name:
-                        # Создаем новый путь с исправленным именем
-                        fixed_path = os.path.join(extract_dir, fixed_name)
-
-                        # Создаем директории для нового пути, если нужно
-                        fixed_dir = os.path.dirname(fixed_path)
-                        if fixed_dir and not os.path.exists(fixed_dir):
-                            os.makedirs(fixed_dir, exist_ok=True)
-
-                        # Переименовываем файл, если новый путь не существует
-                        if not os.path.exists(fixed_path):
-                            try:
-                                os.rename(extracted_path, fixed_path)
-                                extracted_path = fixed_path
-                            except OSError as e:
-                                msg = (
-                                    "Не удалось переименовать файл "
-                                    f"{extracted_path} -> {fixed_path}: {e}"
-                                )
-                                logger.warning(msg)
-                                # Если переименование не удалось,
-                                # используем исходный путь
-                                pass
-
-                    extracted_files.append(extracted_path)
-
-            logger.info(f"Архив распакован: {len(extracted_files)} файлов")
-            return extracted_files
-        except zipfile.BadZipFile:
-            raise ValueError("Поврежденный или неподдерживаемый архив")
+                        await progress_callback(progress, info.filename)
+
+                    # Извлекаем файл вне цикла событий
+                    extracted_path, written = await asyncio.to_thread(
+                        self._extract_member, zip_ref, info, extract_dir,
+                        remaining)
+                    remaining -= written
+                    await queue.put(extracted_path)
+            finally:
+                zip_ref.close()
+
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Ошибка распаковки архива: {e}")
             raise
-
-    def create_archive(self, files: List[str], user_id: int) -> str:
-        """Создает архив из обработанных файлов"""
+        finally:
+            # Сигнал потребителю об окончании архива
+            queue.put_nowait(None)
+
+    def _check_archive_limits(self, total_files: int,
+                              members: List[zipfile.ZipInfo], max_bytes: int):
+        """Проверяет архив по заголовкам ZipInfo до распаковки"""
+        if total_files > self.config.MAX_ARCHIVE_MEMBERS:
+            raise ArchiveLimitError(
+                f"В архиве слишком много файлов: {total_files}, "
+                f"максимум {self.config.MAX_ARCHIVE_MEMBERS}")
+
+        declared_size = sum(info.file_size for info in members)
+        if declared_size > max_bytes:
+            raise ArchiveLimitError(
+                f"Архив слишком большой после распаковки: "
+                f"{_format_mb(declared_size)}, доступно {_format_mb(max_bytes)}")
+
+        for info in members:
+            if (info.file_size >
+                    max(info.compress_size, 1) * self.config.MAX_COMPRESSION_RATIO):
+                raise ArchiveLimitError(
+                    f"Подозрительно сильное сжатие файла {info.filename} "
+                    f"в архиве")
+
+    def _extract_member(self, zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo,
+                        extract_dir: str, max_bytes: int) -> Tuple[str, int]:
+        """Извлекает один файл архива и исправляет его имя.
+
+        Данные копируются блоками с подсчетом байт: заголовкам архива
+        не доверяем, и распаковка прерывается, как только файл выходит
+        за свой заявленный размер, степень сжатия или оставшийся лимит.
+        Возвращает путь к файлу и число записанных байт.
+        """
+        # Очищаем путь так же, как ZipFile.extract: без "..", дисков и корня
+        file_name = '/'.join(self._safe_parts(info.filename))
+
+        # Имя исправляем до записи: файл сразу получает итоговый путь
+        fixed_name = self._fix_filename_encoding(file_name)
+        fixed_name = self._restore_file_name(fixed_name)
+        parts = self._safe_parts(fixed_name) or self._safe_parts(file_name)
+        target_path = os.path.join(extract_dir, *parts)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        # O_EXCL: одноименные файлы архива получают "имя (2)", а не
+        # перезаписывают друг друга
+        extracted_path = self._reserve_path(target_path)
+        part_path = f"{extracted_path}.part"
+
+        limit = min(
+            info.file_size, max_bytes,
+            max(info.compress_size, 1) * self.config.MAX_COMPRESSION_RATIO)
+        written = 0
         try:
-            # Создаем папку для выходных файлов
-            output_dir = os.path.join(self.config.OUTPUT_DIR, str(user_id))
-            os.makedirs(output_dir, exist_ok=True)
+            with zip_ref.open(info) as source, \
+                    open(part_path, 'xb') as target:
+                while True:
+                    chunk = source.read(self.config.ARCHIVE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > limit:
+                        raise ArchiveLimitError(
+                            f"Файл {info.filename} в архиве превышает "
+                            f"допустимый размер")
+                    target.write(chunk)
+            # Файл появляется под своим именем только целиком
+            os.replace(part_path, extracted_path)
+        except BaseException:
+            # Недописанный файл не должен остаться на диске
+            for path in (part_path, extracted_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        return extracted_path, written
+
+    def _safe_parts(self, name: str) -> List[str]:
+        """Части пути внутри архива без "..", дисков и корня"""
+        name = name.replace('/', os.path.sep)
+        if os.path.altsep:
+            name = name.replace(os.path.altsep, os.path.sep)
+        name = os.path.splitdrive(name)[1]
+        return [part for part in name.split(os.path.sep)
+                if part not in ('', os.path.curdir, os.path.pardir)]
+
+    def plan_archives(self, files: List[str],
+                      oversized: Optional[List[str]] = None
+                      ) -> List[List[str]]:
+        """Разбивает файлы на части, каждая из которых пройдет лимит отправки.
+
+        Документы не разрезаются и сохраняют порядок. Размер части
+        оценивается по размерам файлов с запасом на заголовки ZIP
+        (сжатие PDF и JPEG почти ничего не дает). Документ, который сам
+        не проходит лимит, ни в одну часть не попадает: Telegram его все
+        равно не примет. Такие документы добавляются в oversized.
+        """
+        part_limit = (self.config.MAX_UPLOAD_SIZE -
+                      self.config.ARCHIVE_PART_MARGIN)
+        parts: List[List[str]] = []
+        current: List[str] = []
+        current_size = 0
+
+        for file_path in files:
+            if not os.path.exists(file_path):
+                continue
+            clean_name = self._clean_final_filename(
+                os.path.basename(file_path))
+            # Локальный и центральный заголовки ZIP с именем файла
+            entry_size = (os.path.getsize(file_path) + 128 +
+                          2 * len(clean_name.encode('utf-8')))
+            if entry_size > part_limit:
+                logger.warning(
+                    f"Документ {file_path} больше лимита отправки "
+                    f"({entry_size} байт) и не будет отправлен")
+                if oversized is not None:
+                    oversized.append(file_path)
+                continue
 
+            if current and current_size + entry_size > part_limit:
+                parts.append(current)
+                current, current_size = [], 0
+            current.append(file_path)
+            current_size += entry_size
+
+        if current:
+            parts.append(current)
+        return parts
+
+    async def build_archives(self, files: List[str], user_id: int,
+                             job_id: Optional[str] = None,
+                             workspace: Optional[JobWorkspace] = None,
+                             stats: Optional[ArchiveStats] = None,
+                             oversized: Optional[List[str]] = None
+                             ) -> List[Dict[str, Any]]:
+        """Создает архивы результата в отдельном потоке (см. create_archives)"""
+        return await asyncio.to_thread(
+            self.create_archives, files, user_id, job_id, workspace, stats,
+            oversized)
+
+    def create_archives(self, files: List[str], user_id: int,
+                        job_id: Optional[str] = None,
+                        workspace: Optional[JobWorkspace] = None,
+                        stats: Optional[ArchiveStats] = None,
+                        oversized: Optional[List[str]] = None
+                        ) -> List[Dict[str, Any]]:
+        """Создает один или несколько архивов в пределах лимита отправки.
+
+        Возвращает части в виде {'path': путь к архиву, 'files': документы}.
+        Имена архивов включают job_id, чтобы задания не затирали друг друга.
+        С workspace архивы живут в каталоге задания до его очистки.
+        Документы больше лимита отправки в архивы не входят и
+        перечисляются в oversized (см. plan_archives).
+        """
+        base_name = f"processed_documents_{user_id}"
+        if job_id:
+            base_name = f"{base_name}_{job_id}"
+
+        parts = self.plan_archives(files, oversized)
+        if not parts:
+            return []
+        if len(parts) == 1:
+            return [{'path': self.create_archive(
+                        parts[0], user_id, f"{base_name}.zip", workspace,
+                        stats),
+                     'files': parts[0]}]
+
+        logger.info(
+            f"Результат пользователя {user_id} разбит на {len(parts)} архивов")
+        return [
+            {'path': self.create_archive(
+                part_files, user_id,
+                f"{base_name}_part{index}.zip", workspace, stats),
+             'files': part_files}
+            for index, part_files in enumerate(parts, 1)
+        ]
+
+    def create_archive(self, files: List[str], user_id: int,
+                       archive_name: Optional[str] = None,
+                       workspace: Optional[JobWorkspace] = None,
+                       stats: Optional[ArchiveStats] = None) -> str:
+        """Создает архив из обработанных файлов.
+
+        Метод сжатия выбирается для каждого файла: уже сжатые PDF и JPEG
+        записываются без сжатия (ZIP_STORED), остальные - ZIP_DEFLATED.
+        """
+        stats = stats or ArchiveStats()
+        started = time.monotonic()
+        part_path = None
+        archive_path = None
+        try:
             # Путь к итоговому архиву
+            output_dir = os.path.join(self.config.OUTPUT_DIR, str(user_id))
             archive_path = os.path.join(
-                output_dir, f"processed_documents_{user_id}.zip")
-
-            with zipfile.ZipFile(
-                    archive_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
-                for file_path in files:
-                    if os.path.exists(file_path):
-                        # Добавляем файл в архив с очищенным именем
-                        file_name = os.path.basename(file_path)
-                        # Очищаем имя файла от лишних символов
-                        clean_name = self._clean_final_filename(file_name)
-                        # Используем UTF-8 кодировку для имен файлов в архиве
-                        zip_ref.write(file_path, clean_name.encode(
-                            'utf-8').decode('utf-8'))
+                output_dir,
+                archive_name or f"processed_documents_{user_id}.zip")
+            # Локальный сервер Bot API читает архив сам, ему нужен output/
+            if workspace is not None and not self.config.TELEGRAM_LOCAL_MODE:
+                archive_path = workspace.place(archive_path, sum(
+                    os.path.getsize(file_path) for file_path in files
+                    if os.path.exists(file_path)))
+            else:
+                # Создаем папку для выходных файлов
+                os.makedirs(output_dir, exist_ok=True)
+
+            # Пишем во временный файл: недописанный архив никогда не
+            # окажется под итоговым именем
+            part_path = f"{archive_path}.part"
+            try:
+                archive_stats = self._write_archive(files, part_path)
+            except OSError as e:
+                disk_path = (workspace.spill(archive_path)
+                             if workspace is not None and is_out_of_space(e)
+                             else None)
+                if disk_path is None:
+                    raise
+                # В памяти не хватило места - пишем архив на диск
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                archive_path = disk_path
+                part_path = f"{archive_path}.part"
+                archive_stats = self._write_archive(files, part_path)
+            stats.members += archive_stats.members
+            stats.input_bytes += archive_stats.input_bytes
+            stats.output_bytes += archive_stats.output_bytes
+            stats.stored += archive_stats.stored
+            stats.deflated += archive_stats.deflated
+            os.replace(part_path, archive_path)
+            stats.elapsed += time.monotonic() - started
+            if workspace is not None:
+                archive_path = workspace.settle(archive_path)
 
             logger.info(f"Архив создан: {archive_path}")
             return archive_path
 
         except Exception as e:
             logger.error(f"Ошибка создания архива: {e}")
+            if part_path and os.path.exists(part_path):
+                os.remove(part_path)
+            if workspace is not None and archive_path:
+                workspace.settle(archive_path)
             raise
 
+    def _write_archive(self, files: List[str], part_path: str) -> ArchiveStats:
+        """Записывает ZIP архив файлов в part_path"""
+        stats = ArchiveStats()
+        with zipfile.ZipFile(
+                part_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            for file_path in files:
+                if os.path.exists(file_path):
+                    # Добавляем файл в архив с очищенным именем
+                    file_name = os.path.basename(file_path)
+                    # Очищаем имя файла от лишних символов
+                    clean_name = self._clean_final_filename(file_name)
+                    compress_type = self._choose_compression(file_path)
+                    # Используем UTF-8 кодировку для имен файлов в архиве
+                    zip_ref.write(file_path, clean_name.encode(
+                        'utf-8').decode('utf-8'),
+                        compress_type=compress_type)
+
+                    info = zip_ref.infolist()[-1]
+                    stats.members += 1
+                    stats.input_bytes += info.file_size
+                    stats.output_bytes += info.compress_size
+                    if compress_type == zipfile.ZIP_STORED:
+                        stats.stored += 1
+                    else:
+                        stats.deflated += 1
+        return stats
+
+    def _choose_compression(self, file_path: str) -> int:
+        """Сжимает пробный фрагмент файла и выбирает метод сжатия"""
+        try:
+            with open(file_path, 'rb') as file:
+                # Фрагмент из середины: у PDF начало - несжатые заголовки
+                size = os.fstat(file.fileno()).st_size
+                sample_size = self.config.ARCHIVE_SAMPLE_SIZE
+                file.seek(max(0, size // 2 - sample_size // 2))
+                sample = file.read(sample_size)
+        except OSError:
+            return zipfile.ZIP_DEFLATED
+        if not sample:
+            return zipfile.ZIP_STORED
+
+        compressed = len(zlib.compress(sample, 1))
+        saving = 1 - compressed / len(sample)
+        if saving < self.config.ARCHIVE_MIN_SAVING:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
     def cleanup_user_files(self, user_id: int):
         """Очищает временные файлы пользователя"""
         try:
@@ -244,198 +671,147 @@ class FileHandler:
                 f"Ошибка получения информации о файле {file_path}: {e}")
             return {}
 
-    def _fix_filename_encoding(self, file_name: str) -> str:
-        """Исправляет кодировку имени файла из ZIP архива или Telegram"""
-        try:
-            # Сначала пробуем системное исправление кодировки
-            if self._contains_mojibake(file_name):
-                # Пробуем разные кодировки для исправления
-                fixed_name = self._try_decode_with_encodings(file_name)
-                if fixed_name != file_name:
-                    logger.info(
-                        f"Исправлено кодировкой: {file_name} -> {fixed_name}")
-                    return fixed_name
-
-            # Если системное исправление не помогло, используем словарь замен
-            return self._apply_replacement_fixes(file_name)
-
-        except Exception as e:
-            logger.warning(
-                f"Ошибка исправления кодировки файла {file_name}: {e}")
-            return file_name
-
-    def _contains_mojibake(self, text: str) -> bool:
-        """Проверяет, содержит ли текст кракозябры"""
-        # Проверяем наличие типичных символов кракозябр
-        mojibake_chars = [
-            '╨', '╤', '╠', '╡', '╛', '╜', '╝',
-            '╞', '╟', '╢', '╣', '╚', '╔', '╦', '╩', '╬',
-            '╨₧', '╤é', '╤ç', '╨╡', '╤â', '╨┐', '╨╛', '╨▓',
-            '╨░', '╨╜', '╨╕', '╨╗', '╨╢', '╨▒', '╨┤', '╨╝',
-            '╨╣', '╨║', '╨│', '╨╖', '╨╪', '╨Ю', '╨Я', '╨Ъ',
-            '╨Ы', '╨Ь', '╨Э', '╨Ч', '╨Ш', '╨Щ', 'Γäû',
-            # Дополнительные символы кракозябр
-            '╤Ç', '╤ü', '╤ï', '╤à', '╤ì', '╤ë', '╤î', '╤ù',
-            '╤ê', '╤¢', '╤ä', '╤Å', '╨ƒ'
-        ]
-        return any(char in text for char in mojibake_chars)
-
-    def _try_decode_with_encodings(self, text: str) -> str:
-        """Пробует исправить кодировку разными способами"""
-        # Сначала пробуем прямое декодирование из разных кодировок
-        direct_encodings = [
-            'cp866',      # Русская DOS
-            'windows-1251',  # Русская Windows
-            'cp1252',     # Западноевропейская
-            'iso-8859-1',  # Latin-1
-            'cp437',      # OEM US
-            'cp850',      # OEM Multilingual
-        ]
-
-        for encoding in direct_encodings:
-            try:
-                # Пробуем декодировать напрямую
-                decoded = text.encode('latin1').decode(encoding)
-                # Проверяем, что получилась читаемая строка с кириллицей
-                if any('А' <= ch <= 'я' or ch == 'ё' for ch in decoded):
-                    return decoded
-            except Exception:
-                continue
-
-        # Пробуем двойное декодирование для сложных случаев
-        double_encodings = [
-            ('utf-8', 'cp1252'),
-            ('utf-8', 'iso-8859-1'),
-            ('windows-1251', 'cp1252'),
-            ('cp866', 'cp1252'),
-        ]
-
-        for first_enc, second_enc in double_encodings:
+    def create_record(self, file_path: str,
+                      original_name: Optional[str] = None) -> FileRecord:
+        """Разбирает имя загруженного файла один раз для всех этапов"""
+        file_name = os.path.basename(file_path)
+        file_type = os.path.splitext(file_name)[1].lower()
+        # Изображение попадет в результат как PDF: группа, страница
+        # и имя в описи берутся из имени, которое получит PDF
+        pdf_name = (file_name if file_type == '.pdf'
+                    else pdf_file_name(file_name, self.page_patterns))
+        group_key, page_number = split_page_info(pdf_name, self.page_patterns)
+        return FileRecord(
+            path=file_path,
+            original_name=original_name or file_name,
+            decoded_name=self._fix_filename_encoding(file_name),
+            display_name=os.path.splitext(
+                self._fix_filename_encoding(pdf_name))[0],
+            page_number=page_number,
+            group_key=group_key,
+            size=os.path.getsize(file_path),
+            file_type=file_type,
+            pdf_name=pdf_name,
+            name_validation=self.validate_file_name(file_name))
+
+    async def fingerprint_record(self, record: FileRecord):
+        """Вычисляет отпечатки файла записи для поиска дубликатов"""
+        fingerprint = self._ingest_fingerprints.pop(record.path, None)
+        if fingerprint is None:
             try:
-                # Двойное декодирование
-                step1 = text.encode(second_enc).decode(first_enc)
-                if any('А' <= ch <= 'я' or ch == 'ё' for ch in step1):
-                    return step1
-            except Exception:
+                fingerprint = await asyncio.to_thread(
+                    self._compute_fingerprint, record.path)
+            except Exception as e:
+                logger.warning(
+                    f"Не удалось вычислить отпечаток файла {record.path}: {e}")
+                return
+        record.content_hash, record.image_hash = fingerprint
+
+    def _compute_fingerprint(self, file_path: str,
+                             data: Optional[bytes] = None
+                             ) -> Tuple[str, Optional[int]]:
+        """SHA-256 содержимого и перцептивный хэш, если это изображение.
+
+        data - содержимое файла, если оно уже есть в памяти.
+        """
+        if data is not None:
+            content_hash = f"sha256:{hashlib.sha256(data).hexdigest()}"
+        else:
+            sha256 = hashlib.sha256()
+            with open(file_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                    sha256.update(chunk)
+            content_hash = f"sha256:{sha256.hexdigest()}"
+
+        image_hash = None
+        file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext in self.config.SUPPORTED_IMAGE_FORMATS:
+            source = io.BytesIO(data) if data is not None else file_path
+            image_hash = self._compute_dhash(source)
+        return content_hash, image_hash
+
+    def _compute_dhash(self, source: Union[str, BinaryIO]) -> int:
+        """Вычисляет разностный хэш (dHash) по уменьшенной серой копии"""
+        size = self.config.DUPLICATE_HASH_SIZE
+        with Image.open(source) as img:
+            # JPEG сразу декодируется в уменьшенном масштабе
+            img.draft('L', (size * 4, size * 4))
+            # Фото из Telegram уже повернуто, а оригинал из ZIP - нет
+            img = ImageOps.exif_transpose(img)
+            gray = img.convert('L').resize(
+                (size + 1, size), Image.Resampling.BOX)
+
+        # Сравниваем соседние пиксели целыми строками средствами Pillow;
+        # небольшой порог гасит шум пересжатия на белом фоне
+        left = gray.crop((0, 0, size, size))
+        right = gray.crop((1, 0, size + 1, size))
+        bits = ImageChops.subtract(right, left).point(
+            lambda value: 255 if value > 2 else 0)
+        bits = bits.convert('1', dither=Image.Dither.NONE)
+        return int.from_bytes(bits.tobytes(), 'big')
+
+    def find_duplicates(self, records: List[FileRecord]
+                        ) -> Tuple[Dict[FileRecord, FileRecord],
+                                   Dict[FileRecord, FileRecord]]:
+        """Находит повторно загруженные файлы.
+
+        Возвращает два словаря {файл: оригинал}. В первом - точные копии:
+        тот же SHA-256 при той же группе и номере страницы, их можно не
+        обрабатывать. Во втором - возможные дубликаты: совпадает только
+        содержимое или только изображение похоже на оригинал. Они
+        обрабатываются как обычно и лишь отмечаются в описи: разные
+        страницы с одинаковой версткой дают близкие перцептивные хэши.
+        """
+        duplicates = {}
+        similar = {}
+        seen: List[FileRecord] = []
+
+        for record in records:
+            if not record.content_hash:
                 continue
 
-        return text
-
-    def _apply_replacement_fixes(self, file_name: str) -> str:
-        """Применяет словарь замен для исправления кракозябр"""
-        # Специальные замены для часто встречающихся проблем
-        replacements = {
-            '╨í╨ó╨í': 'СТС',
-            '╨ó╤Ç╨░╨╜╤ü╨┐╨╛╤Ç╤é╨╜╨░╤Å': 'Транспортная',
-            '╨╜╨░╨║╨╗╨░╨┤╨╜╨░╤Å': 'накладная',
-            '╨ö╨╛╨│╨╛╨▓╨╛╤Ç': 'Договор',
-            '╨╛╨║╨░╨╖╨░╨╜╨╕╤Å': 'оказания',
-            '╤Ä╤Ç╨╕╨┤╨╕╤ç╨╡╤ü╨║╨╕╤à': 'юридических',
-            '╤â╤ü╨╗╤â╨│': 'услуг',
-            '╨Æ╨╛╨┤╨╕╤é╨╡╨╗╤î╤ü╨╛╨╡': 'Водительское',
-            '╤â╨┤╨╛╤ü╤é╨╛╨▓╨╡╤Ç╨╡╨╜╨╕╨╡': 'удостоверение',
-            '╨ƒ╨╗╨░╤é╨╡╨╢╨╜╨╛╨╡': 'Платежное',
-            '╨┐╨╛╤Ç╤â╤ç╨╡╨╜╨╕╨╡': 'поручение',
-            '╨ù╨░╤Å╨▓╨║╨░': 'Заявка',
-            '╤ü╤é╤Ç': 'стр',
-            '╤ü': 'с',
-            '╨│': 'г',
-            '╨╛╤é': 'от',
-            'Γäû': '№',
-            # Добавляем новые замены для конкретных кракозябр
-            '╨ó╤Ç╤â╨┤╨╛╨▓╨╛╨╕╠å': 'Трудовой',
-            '╨┤╨╛г╨╛╨▓╨╛╤Ç': 'договор',
-            '╨Æ╨╛╨┤╨╕╤é╨╡╨╗╤î': 'Водитель',
-            '╤ü╨║╨╛╨╡': 'ское',
-            '╨Æ╨╛╨┤╨╕╤é╨╡╨╗╤îс╨║╨╛╨╡': 'Водительское',
-            'Водительс╨║╨╛╨╡': 'Водительское',
-            '╨║╨╛╨╡': 'кое',
-            # Новые замены для конкретной кракозябры
-            '╨₧╤é╤ç╨╡╤é': 'Отчет',
-            '╨₧╤é╨▓╨╡╤é': 'Ответ',
-            '╨₧╤é╨▓╨╡╤é╤ç': 'Ответ',
-            '╨í╤ç╨╡╤é': 'Счет',
-            '╨í': 'С',
-            '╤å': 'ц',
-            '╨ƒ╨╛╤ç╤é╨╛╨▓╨░╤Å': 'Почтовая',
-            '╨║╨▓╨╕╤é╨░╨╜╤å╨╕╤Å': 'квитанция',
-            '╨ƒ╨╗╨░╤é╨╡╨╢╨╜╨╛╨╡ ╨┐╨╛╤ç╨╡╨╜╨╕╨╡': 'Платежное поручение',
-            '╨┐╨╛╤ç╨╡╨╜╨╕╨╡': 'поручение',
-            '╨ó╨╛╨▓╨░╤Ç╨╜╨╛-╤é╤Ç╨░╨╜╤ü╨┐╨╛╤Ç╤é╨╜╨░╤Å': 'Товарно-транспортная',
-            '╨ó╨╛╨▓╨░╤Ç╨╜╨╛': 'Товарно',
-            '╨ó': 'Т',
-            '╨╛╨▒': 'об',
-            'отс╨╗╨╡╨╢╨╕╨▓╨░╨╜╨╕╨╕': 'отслеживании',
-            '╨┐╨╛╤ç╤é╨╛╨▓╨╛г╨╛': 'почтового',
-            'от╨┐╤Ç╨░╨▓╨╗╨╡╨╜╨╕╤Å': 'отправления',
-            '╨ó╤Ç╨░╨╜с╨┐╤Çот╨╜╨░╤Å': 'Транспортная',
-            # Дополнительные замены для улучшения качества
-            '╨╛╨▒ отс╨╗╨╡╨╢╨╕╨▓╨░╨╜╨╕╨╕': 'об отслеживании',
-            '╨┐╨╛╤ç╤é╨╛╨▓╨╛г╨╛ от╨┐╤Ç╨░╨▓╨╗╨╡╨╜╨╕╤Å': 'почтового отправления',
-            # Замены для отдельных символов
-            '╨₧': 'О',
-            '╤é': 'т',
-            '╤ç': 'ч',
-            '╨╡': 'е',
-            '╤â': 'у',
-            '╨┐': 'п',
-            '╨╛': 'о',
-            '╨▓': 'в',
-            '╨░': 'а',
-            '╨╜': 'н',
-            '╨╕': 'и',
-            '╨╗': 'л',
-            '╨╢': 'ж',
-            '╨▒': 'б',
-            '╨┤': 'д',
-            '╨╝': 'м',
-            '╨╣': 'й',
-            '╨║': 'к',
-            '╨│': 'г',
-            '╨╖': 'з',
-            '╨╪': 'М',
-            '╨Ю': 'Ю',
-            '╨Я': 'Я',
-            '╨Ъ': 'Ъ',
-            '╨Ы': 'Ы',
-            '╨Ь': 'Ь',
-            '╨Э': 'Э',
-            '╨Ч': 'Ч',
-            '╨Ш': 'Ш',
-            '╨Щ': 'Щ',
-            # Дополнительные замены для конкретных кракозябр из логов
-            '╨¥': 'Н',
-            '╤Å': 'я',
-            # Дополнительные замены для 'Платежное поручение'
-            '╨ƒ╨╗╨░╤é╨╡╨╢╨╜╨╛╨╡ ╨┐╨╛╤Ç╤â╤ç╨╡╨╜╨╕╨╡': 'Платежное поручение',
-            '╨ƒ╨╗╨░╤é╨╡╨╢╨╜╨╛╨╡': 'Платежное',
-            '╨┐╨╛╤Ç╤â╤ç╨╡╨╜╨╕╨╡': 'поручение',
-            '╤Ç': 'р',
-            '╤ü': 'с',
-            '╤ï': 'ф',
-            '╤à': 'х',
-            '╤ì': 'ц',
-            '╤ë': 'щ',
-            '╤î': 'ъ',
-            '╤ù': 'ы',
-            '╤ç': 'ч',
-            '╤ê': 'ш',
-            '╤ë': 'щ',
-            '╤¢': 'ь',
-            '╤ì': 'ц',
-            '╤ä': 'ю',
-            '╤Å': 'я',
-        }
-
-        fixed_name = file_name
-        for wrong, correct in replacements.items():
-            fixed_name = fixed_name.replace(wrong, correct)
-
-        # Если были замены, логируем
-        if fixed_name != file_name:
-            logger.info(f"Исправлено заменами: {file_name} -> {fixed_name}")
+            original = None
+            possible = None
+            for seen_record in seen:
+                same_place = (seen_record.group_key == record.group_key and
+                              seen_record.page_number == record.page_number)
+                if seen_record.content_hash == record.content_hash:
+                    if same_place:
+                        original = seen_record
+                        break
+                    possible = possible or seen_record
+                elif (same_place and self._is_similar_image(
+                        record.image_hash, seen_record.image_hash)):
+                    possible = possible or seen_record
+
+            if original is not None:
+                duplicates[record] = original
+                logger.info(
+                    f"Найден дубликат: {record.path} -> {original.path}")
+            else:
+                seen.append(record)
+                if possible is not None:
+                    similar[record] = possible
+                    logger.info(
+                        f"Возможный дубликат: {record.path} -> {possible.path}")
+
+        return duplicates, similar
+
+    def _is_similar_image(self, image_hash: Optional[int],
+                          other_hash: Optional[int]) -> bool:
+        """Перцептивные хэши двух изображений почти совпадают"""
+        if image_hash is None or other_hash is None:
+            return False
+        # Почти пустые страницы (обороты, чистые листы) дают одинаковый
+        # хэш, поэтому похожими их не считаем
+        if image_hash.bit_count() < self.config.DUPLICATE_HASH_SIZE:
+            return False
+        distance = (image_hash ^ other_hash).bit_count()
+        return distance <= self.config.DUPLICATE_MAX_DISTANCE
 
-        return fixed_name
+    def _fix_filename_encoding(self, file_name: str) -> str:
+        """Исправляет кодировку имени файла из ZIP архива или Telegram"""
+        return fix_filename_encoding(file_name)
 
     def _restore_file_name(self, file_name: str) -> str:
         """Восстанавливает оригинальное имя файла,
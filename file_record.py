@@ -0,0 +1,102 @@
+"""
+Сведения о загруженных файлах для DocKitBot
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+
+class FileRecord:
+    """Файл сессии и все, что бот знает о его имени и содержимом.
+
+    Создается один раз при загрузке (FileHandler.create_record), дальше
+    этапы обработки берут имена, номер страницы и группу отсюда, а не
+    разбирают имя файла заново. Содержимое файла запись не хранит: файлы
+    сессии ждут /process неограниченно долго, а буферы всех ожидающих
+    загрузок в памяти не ограничены ничем. Этапы читают файл по path,
+    в каталоге задания - с tmpfs (WORKSPACE_RAM_DIR).
+    """
+
+    __slots__ = ('path', 'original_name', 'decoded_name', 'display_name',
+                 'page_number', 'group_key', 'size', 'file_type',
+                 'pdf_name', 'name_validation', 'content_hash', 'image_hash')
+
+    def __init__(self, path: str, original_name: str, decoded_name: str,
+                 display_name: str, page_number: Optional[int],
+                 group_key: str, size: int, file_type: str, pdf_name: str,
+                 name_validation: Dict[str, Any],
+                 content_hash: Optional[str] = None,
+                 image_hash: Optional[int] = None):
+        # Текущий путь: меняется, когда файл переходит в каталог задания
+        self.path = path
+        # Имя, под которым файл прислал пользователь
+        self.original_name = original_name
+        # Имя файла с исправленной кодировкой - для списков и сообщений
+        self.decoded_name = decoded_name
+        # Имя документа в описи (без расширения, результат всегда PDF)
+        self.display_name = display_name
+        # Номер страницы и имя документа, в который страница объединяется
+        self.page_number = page_number
+        self.group_key = group_key
+        self.size = size
+        # Расширение в нижнем регистре: '.pdf', '.jpg', ...
+        self.file_type = file_type
+        # Имя результата обработки: PDF сохраняет имя, изображение
+        # получает имя PDF с номером страницы в конце
+        self.pdf_name = pdf_name
+        # Проверка имени файла (FileHandler.validate_file_name)
+        self.name_validation = name_validation
+        # Отпечатки для поиска дубликатов (см. FileHandler.fingerprint_record):
+        # SHA-256 содержимого и перцептивный хэш изображения
+        self.content_hash = content_hash
+        self.image_hash = image_hash
+
+    def with_path(self, path: str) -> 'FileRecord':
+        """Те же сведения для результата обработки, лежащего по path"""
+        return FileRecord(
+            path, self.original_name, self.decoded_name, self.display_name,
+            self.page_number, self.group_key, self.size, self.file_type,
+            self.pdf_name, self.name_validation, self.content_hash,
+            self.image_hash)
+
+    def __repr__(self) -> str:
+        return f"FileRecord({self.path!r}, страница {self.page_number})"
+
+
+def compile_page_patterns(patterns: List[str]) -> List[Pattern]:
+    """Компилирует PAGE_PATTERNS из конфигурации"""
+    return [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+
+
+def split_page_info(file_name: str, patterns: List[Pattern]
+                    ) -> Tuple[str, Optional[int]]:
+    """Базовое имя документа и номер страницы из имени файла"""
+    name = os.path.splitext(file_name)[0]
+    for pattern in patterns:
+        match = pattern.search(name)
+        if match:
+            page_number = re.search(r'\d+', match.group())
+            if page_number:
+                return pattern.sub('', name).strip(), int(page_number.group())
+    return name, None
+
+
+def pdf_file_name(file_name: str, patterns: List[Pattern]) -> str:
+    """Имя PDF для файла: номер страницы переносится в конец имени"""
+    name = os.path.splitext(file_name)[0]
+    page_info = None
+    for pattern in patterns:
+        match = pattern.search(name)
+        if match:
+            page_info = match.group()
+            break
+
+    # Убираем маркеры страниц для базового имени
+    for pattern in patterns:
+        name = pattern.sub('', name)
+
+    clean_name = name.strip()
+    if page_info:
+        clean_name = f"{clean_name} {page_info}"
+    return f"{clean_name}.pdf"
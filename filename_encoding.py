@@ -0,0 +1,210 @@
+"""
+Исправление кодировки имен файлов для DocKitBot
+"""
+
+import re
+from functools import lru_cache
+
+from loguru import logger
+
+# Сколько исправленных имен помнить: одно имя проверяется на каждом
+# этапе (загрузка, прогресс, опись, ошибки)
+FILENAME_CACHE_SIZE = 4096
+
+# Кракозябры: UTF-8 кириллица, прочитанная как cp437 (╨, ╤ и соседние
+# символы псевдографики) и знак номера
+MOJIBAKE_MARKERS = re.compile('[╨╤╠╡╛╜╝╞╟╢╣╚╔╦╩╬]|Γäû')
+
+# Кириллица в результате декодирования
+CYRILLIC = re.compile('[А-яё]')
+
+# Кодировки для прямого декодирования
+DIRECT_ENCODINGS = (
+    'cp866',      # Русская DOS
+    'windows-1251',  # Русская Windows
+    'cp1252',     # Западноевропейская
+    'iso-8859-1',  # Latin-1
+    'cp437',      # OEM US
+    'cp850',      # OEM Multilingual
+)
+
+# Двойное декодирование для сложных случаев: (во что, из чего)
+DOUBLE_ENCODINGS = (
+    # Имя в UTF-8, прочитанное как cp437 (ZIP без флага UTF-8) - именно
+    # такие кракозябры ищет MOJIBAKE_MARKERS
+    ('utf-8', 'cp437'),
+    ('utf-8', 'cp1252'),
+    ('utf-8', 'iso-8859-1'),
+    ('windows-1251', 'cp1252'),
+    ('cp866', 'cp1252'),
+)
+
+# Словарь замен для часто встречающихся кракозябр
+MOJIBAKE_REPLACEMENTS = {
+    '╨í╨ó╨í': 'СТС',
+    '╨ó╤Ç╨░╨╜╤ü╨┐╨╛╤Ç╤é╨╜╨░╤Å': 'Транспортная',
+    '╨╜╨░╨║╨╗╨░╨┤╨╜╨░╤Å': 'накладная',
+    '╨ö╨╛╨│╨╛╨▓╨╛╤Ç': 'Договор',
+    '╨╛╨║╨░╨╖╨░╨╜╨╕╤Å': 'оказания',
+    '╤Ä╤Ç╨╕╨┤╨╕╤ç╨╡╤ü╨║╨╕╤à': 'юридических',
+    '╤â╤ü╨╗╤â╨│': 'услуг',
+    '╨Æ╨╛╨┤╨╕╤é╨╡╨╗╤î╤ü╨╛╨╡': 'Водительское',
+    '╤â╨┤╨╛╤ü╤é╨╛╨▓╨╡╤Ç╨╡╨╜╨╕╨╡': 'удостоверение',
+    '╨ƒ╨╗╨░╤é╨╡╨╢╨╜╨╛╨╡': 'Платежное',
+    '╨┐╨╛╤Ç╤â╤ç╨╡╨╜╨╕╨╡': 'поручение',
+    '╨ù╨░╤Å╨▓╨║╨░': 'Заявка',
+    '╤ü╤é╤Ç': 'стр',
+    '╤ü': 'с',
+    '╨│': 'г',
+    '╨╛╤é': 'от',
+    'Γäû': '№',
+    # Добавляем новые замены для конкретных кракозябр
+    '╨ó╤Ç╤â╨┤╨╛╨▓╨╛╨╕╠å': 'Трудовой',
+    '╨┤╨╛г╨╛╨▓╨╛╤Ç': 'договор',
+    '╨Æ╨╛╨┤╨╕╤é╨╡╨╗╤î': 'Водитель',
+    '╤ü╨║╨╛╨╡': 'ское',
+    '╨Æ╨╛╨┤╨╕╤é╨╡╨╗╤îс╨║╨╛╨╡': 'Водительское',
+    'Водительс╨║╨╛╨╡': 'Водительское',
+    '╨║╨╛╨╡': 'кое',
+    # Новые замены для конкретной кракозябры
+    '╨₧╤é╤ç╨╡╤é': 'Отчет',
+    '╨₧╤é╨▓╨╡╤é': 'Ответ',
+    '╨₧╤é╨▓╨╡╤é╤ç': 'Ответч',
+    '╨í╤ç╨╡╤é': 'Счет',
+    '╨í': 'С',
+    '╤å': 'ц',
+    '╨ƒ╨╛╤ç╤é╨╛╨▓╨░╤Å': 'Почтовая',
+    '╨║╨▓╨╕╤é╨░╨╜╤å╨╕╤Å': 'квитанция',
+    '╨ƒ╨╗╨░╤é╨╡╨╢╨╜╨╛╨╡ ╨┐╨╛╤ç╨╡╨╜╨╕╨╡': 'Платежное поручение',
+    '╨┐╨╛╤ç╨╡╨╜╨╕╨╡': 'поручение',
+    '╨ó╨╛╨▓╨░╤Ç╨╜╨╛-╤é╤Ç╨░╨╜╤ü╨┐╨╛╤Ç╤é╨╜╨░╤Å': 'Товарно-транспортная',
+    '╨ó╨╛╨▓╨░╤Ç╨╜╨╛': 'Товарно',
+    '╨ó': 'Т',
+    '╨╛╨▒': 'об',
+    'отс╨╗╨╡╨╢╨╕╨▓╨░╨╜╨╕╨╕': 'отслеживании',
+    '╨┐╨╛╤ç╤é╨╛╨▓╨╛г╨╛': 'почтового',
+    'от╨┐╤Ç╨░╨▓╨╗╨╡╨╜╨╕╤Å': 'отправления',
+    '╨ó╤Ç╨░╨╜с╨┐╤Çот╨╜╨░╤Å': 'Транспортная',
+    # Дополнительные замены для улучшения качества
+    '╨╛╨▒ отс╨╗╨╡╨╢╨╕╨▓╨░╨╜╨╕╨╕': 'об отслеживании',
+    '╨┐╨╛╤ç╤é╨╛╨▓╨╛г╨╛ от╨┐╤Ç╨░╨▓╨╗╨╡╨╜╨╕╤Å': 'почтового отправления',
+    # Замены для отдельных символов
+    '╨₧': 'О',
+    '╤é': 'т',
+    '╤ç': 'ч',
+    '╨╡': 'е',
+    '╤â': 'у',
+    '╨┐': 'п',
+    '╨╛': 'о',
+    '╨▓': 'в',
+    '╨░': 'а',
+    '╨╜': 'н',
+    '╨╕': 'и',
+    '╨╗': 'л',
+    '╨╢': 'ж',
+    '╨▒': 'б',
+    '╨┤': 'д',
+    '╨╝': 'м',
+    '╨╣': 'й',
+    '╨║': 'к',
+    '╨╖': 'з',
+    '╨╪': 'М',
+    '╨Ю': 'Ю',
+    '╨Я': 'Я',
+    '╨Ъ': 'Ъ',
+    '╨Ы': 'Ы',
+    '╨Ь': 'Ь',
+    '╨Э': 'Э',
+    '╨Ч': 'Ч',
+    '╨Ш': 'Ш',
+    '╨Щ': 'Щ',
+    # Дополнительные замены для конкретных кракозябр из логов
+    '╨¥': 'Н',
+    '╤Å': 'я',
+    # Дополнительные замены для 'Платежное поручение'
+    '╨ƒ╨╗╨░╤é╨╡╨╢╨╜╨╛╨╡ ╨┐╨╛╤Ç╤â╤ç╨╡╨╜╨╕╨╡': 'Платежное поручение',
+    # Замены для отдельных символов
+    '╤Ç': 'р',
+    '╤ï': 'ф',
+    '╤à': 'х',
+    '╤ì': 'ц',
+    '╤ë': 'щ',
+    '╤î': 'ъ',
+    '╤ù': 'ы',
+    '╤ê': 'ш',
+    '╤¢': 'ь',
+    '╤ä': 'ю',
+}
+
+# Все замены за один проход: при нескольких совпадениях в одной позиции
+# альтернатива длиннее стоит раньше и выигрывает, поэтому целые слова
+# заменяются раньше отдельных букв
+MOJIBAKE_PATTERN = re.compile('|'.join(
+    re.escape(wrong) for wrong in
+    sorted(MOJIBAKE_REPLACEMENTS, key=len, reverse=True)))
+
+
+def contains_mojibake(text: str) -> bool:
+    """Проверяет, содержит ли текст кракозябры"""
+    return MOJIBAKE_MARKERS.search(text) is not None
+
+
+def try_decode_with_encodings(text: str) -> str:
+    """Пробует исправить кодировку разными способами"""
+    for encoding in DIRECT_ENCODINGS:
+        try:
+            decoded = text.encode('latin1').decode(encoding)
+        except UnicodeError:
+            continue
+        # Проверяем, что получилась читаемая строка с кириллицей
+        if CYRILLIC.search(decoded):
+            return decoded
+
+    for first_enc, second_enc in DOUBLE_ENCODINGS:
+        try:
+            decoded = text.encode(second_enc).decode(first_enc)
+        except UnicodeError:
+            continue
+        if CYRILLIC.search(decoded):
+            return decoded
+
+    return text
+
+
+def apply_replacement_fixes(file_name: str) -> str:
+    """Применяет словарь замен для исправления кракозябр"""
+    if not contains_mojibake(file_name):
+        return file_name
+    fixed_name = MOJIBAKE_PATTERN.sub(
+        lambda match: MOJIBAKE_REPLACEMENTS[match.group()], file_name)
+
+    # Если были замены, логируем
+    if fixed_name != file_name:
+        logger.info(f"Исправлено заменами: {file_name} -> {fixed_name}")
+
+    return fixed_name
+
+
+@lru_cache(maxsize=FILENAME_CACHE_SIZE)
+def fix_filename_encoding(file_name: str) -> str:
+    """Исправляет кодировку имени файла из ZIP архива или Telegram.
+
+    Результат запоминается: повторные вызовы для того же имени
+    не декодируют и не пишут в лог заново.
+    """
+    try:
+        if not contains_mojibake(file_name):
+            return file_name
+
+        # Сначала пробуем системное исправление кодировки
+        fixed_name = try_decode_with_encodings(file_name)
+        if fixed_name != file_name:
+            logger.info(f"Исправлено кодировкой: {file_name} -> {fixed_name}")
+            return fixed_name
+
+        # Если системное исправление не помогло, используем словарь замен
+        return apply_replacement_fixes(file_name)
+
+    except Exception as e:
+        logger.warning(f"Ошибка исправления кодировки файла {file_name}: {e}")
+        return file_name
@@ -5,13 +5,18 @@
 import asyncio
 import os
 import re
-from typing import Optional
+from typing import List, Optional
 
 import pytesseract
 from loguru import logger
-from PIL import Image
+from PIL import Image, ImageEnhance
 
 from config import Config
+from DocKitBot.cpu_pool import CpuTask, get_cpu_pool
+from DocKitBot.page import Page, load_page, materialize_page
+
+# Отметка в provenance страницы: OCR не смог определить ориентацию
+OCR_FAILED = 'ocr:failed'
 
 
 class ImageProcessor:
@@ -20,175 +25,51 @@ class ImageProcessor:
 
     async def correct_orientation(self, image_path: str) -> str:
         """Определяет и исправляет ориентацию изображения"""
+        page = Page(image_path)
         try:
-            # Открываем изображение
-            with Image.open(image_path) as img:
-                # Проверяем EXIF данные для ориентации
-                exif_orientation = self._get_exif_orientation(img)
-
-                # Если EXIF показывает правильную ориентацию (1), доверяем ему
-                if exif_orientation == 1:
-                    logger.info(
-                        f"EXIF показывает правильную ориентацию для {image_path}")
-                    return image_path
+            await self.correct_page_orientation(page)
+            if not page.rotation:
+                return image_path
 
-                # Определяем текущую ориентацию с помощью OCR
-                current_orientation = await self._detect_orientation(img)
+            # Сохраняем исправленное изображение
+            corrected_path = self._get_corrected_path(image_path)
+            await materialize_page(
+                page, corrected_path, quality=95, optimize=True)
 
-                # Если ориентация правильная, возвращаем исходный файл
-                if current_orientation == 0:
-                    logger.info(
-                        f"OCR подтвердил правильную ориентацию для {image_path}")
-                    return image_path
-
-                # Поворачиваем изображение
-                rotated_img = img.rotate(-current_orientation, expand=True)
-
-                # Сохраняем исправленное изображение
-                corrected_path = self._get_corrected_path(image_path)
-                rotated_img.save(corrected_path, quality=95, optimize=True)
-
-                logger.info(
-                    f"Ориентация исправлена: {image_path} -> {corrected_path}"
-                    f", поворот: {current_orientation}°")
-                return corrected_path
+            logger.info(
+                f"Ориентация исправлена: {image_path} -> {corrected_path}"
+                f", поворот: {page.rotation}°")
+            return corrected_path
 
         except Exception as e:
             logger.error(f"Ошибка исправления ориентации {image_path}: {e}")
             return image_path
+        finally:
+            page.release()
 
-    async def _detect_orientation(self, img: Image.Image) -> int:
-        """Определяет ориентацию изображения с помощью OCR"""
+    async def correct_page_orientation(self, page: Page) -> Page:
+        """Определяет ориентацию страницы и запоминает нужный поворот"""
         try:
-            # Конвертируем в RGB если нужно
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-
-            # Получаем размеры изображения
-            width, height = img.size
+            if not page.is_pdf_page:
+                # Читаем только заголовок файла, пиксели не декодируются
+                page.open()
 
-            # Если изображение слишком маленькое, пропускаем OCR
-            if width < 100 or height < 100:
-                logger.warning("Изображение слишком маленькое для OCR")
-                return 0
-
-            # Пробуем определить ориентацию с помощью Tesseract
-            try:
-                # Настройки OCR для лучшего определения ориентации
-                # Пробуем разные языки для определения ориентации
-                try:
-                    custom_config = r'--oem 3 --psm 0 -l rus+eng'
-                    osd = await asyncio.wait_for(
-                        asyncio.to_thread(
-                            pytesseract.image_to_osd, img,
-                            config=custom_config),
-                        timeout=self.config.OCR_TIMEOUT
-                    )
-                except Exception:
-                    try:
-                        custom_config = r'--oem 3 --psm 0 -l eng'
-                        osd = await asyncio.wait_for(
-                            asyncio.to_thread(
-                                pytesseract.image_to_osd, img,
-                                config=custom_config),
-                            timeout=self.config.OCR_TIMEOUT
-                        )
-                    except Exception:
-                        # Если языковые модели не работают, пробуем без них
-                        custom_config = r'--oem 3 --psm 0'
-                        osd = await asyncio.wait_for(
-                            asyncio.to_thread(
-                                pytesseract.image_to_osd, img,
-                                config=custom_config),
-                            timeout=self.config.OCR_TIMEOUT
-                        )
-
-                # Извлекаем угол поворота
-                rotate_match = re.search(r'Rotate: (\d+)', osd)
-                if rotate_match:
-                    angle = int(rotate_match.group(1))
+                # Если EXIF показывает правильную ориентацию (1), доверяем ему
+                if page.exif_orientation == 1:
                     logger.info(
-                        f"OCR определил угол поворота: {angle} градусов")
-                    return angle
-                else:
-                    logger.warning("OCR не смог определить угол поворота")
-                    return 0
-
-            except Exception as ocr_error:
-                logger.warning(
-                    f"OCR не смог определить ориентацию: {ocr_error}")
-
-                # Пробуем эвристический метод
-                return await self._heuristic_orientation_detection(img)
-
-        except Exception as e:
-            logger.error(f"Ошибка определения ориентации: {e}")
-            return 0
+                        f"EXIF показывает правильную ориентацию для {page.source}")
+                    return page
 
-    async def _heuristic_orientation_detection(self, img: Image.Image) -> int:
-        """Эвристический метод определения ориентации"""
-        try:
-            width, height = img.size
-
-            # Если изображение квадратное, не поворачиваем
-            if abs(width - height) < min(width, height) * 0.1:
-                return 0
-
-            # Пробуем OCR на повернутых версиях изображения
-            angles_to_try = [90, 180, 270]
-            best_angle = 0
-            best_confidence = 0
-
-            for angle in angles_to_try:
-                try:
-                    rotated = img.rotate(angle, expand=True)
-
-                    # Пробуем распознать текст с таймаутом
-                    text = await asyncio.wait_for(
-                        asyncio.to_thread(
-                            pytesseract.image_to_string,
-                            rotated,
-                            lang='rus',
-                            config='--oem 3 --psm 6'
-                        ),
-                        timeout=30  # Короткий таймаут для эвристики
-                    )
-
-                    # Простая оценка качества распознавания
-                    # Считаем количество букв и цифр
-                    confidence = len([c for c in text if c.isalnum()])
-
-                    if confidence > best_confidence:
-                        best_confidence = confidence
-                        best_angle = angle
-
-                except Exception:
-                    continue
-
-            # Если нашли достаточно текста, возвращаем лучший угол
-            if best_confidence > 10:
-                logger.info(
-                    f"Эвристический метод определил угол: {best_angle}")
-                return best_angle
-
-            return 0
+            # Декодирование и OCR выполняются в пуле процессов,
+            # в цикл событий возвращается только найденный поворот
+            page.adopt(await get_cpu_pool().run(
+                OrientPageTask(page, self.config.OCR_TIMEOUT)))
 
         except Exception as e:
-            logger.error(f"Ошибка эвристического определения ориентации: {e}")
-            return 0
-
-    def _get_exif_orientation(self, img: Image.Image) -> Optional[int]:
-        """Получает ориентацию из EXIF данных"""
-        try:
-            if hasattr(img, '_getexif') and img._getexif() is not None:
-                exif = img._getexif()
-                if exif is not None:
-                    # EXIF tag для ориентации
-                    orientation_tag = 274
-                    return exif.get(orientation_tag, 1)
-        except Exception as e:
-            logger.debug(f"Ошибка получения EXIF ориентации: {e}")
-        return None
+            logger.error(
+                f"Ошибка определения ориентации {page.source}: {e}")
+            page.provenance.append(OCR_FAILED)
+        return page
 
     def _get_corrected_path(self, original_path: str) -> str:
         """Генерирует путь для исправленного изображения"""
@@ -224,26 +105,33 @@ class ImageProcessor:
 
     async def optimize_image(self, image_path: str) -> str:
         """Оптимизирует изображение для лучшего OCR"""
+        page = Page(image_path)
         try:
-            with Image.open(image_path) as img:
-                # Конвертируем в RGB
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-
-                # Увеличиваем контрастность для лучшего OCR
-                from PIL import ImageEnhance
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.5)  # Увеличиваем контрастность на 50%
-
-                # Сохраняем оптимизированное изображение
-                optimized_path = self._get_optimized_path(image_path)
-                img.save(optimized_path, quality=95, optimize=True)
+            await self.optimize_page(page)
 
-                return optimized_path
+            # Сохраняем оптимизированное изображение
+            optimized_path = self._get_optimized_path(image_path)
+            return await materialize_page(
+                page, optimized_path, quality=95, optimize=True)
 
         except Exception as e:
             logger.error(f"Ошибка оптимизации изображения {image_path}: {e}")
             return image_path
+        finally:
+            page.release()
+
+    async def optimize_page(self, page: Page) -> Page:
+        """Оптимизирует страницу для лучшего OCR без записи на диск"""
+        img = await load_page(page)
+        # Конвертируем в RGB
+        if img.mode != 'RGB':
+            img = await asyncio.to_thread(img.convert, 'RGB')
+
+        # Увеличиваем контрастность для лучшего OCR
+        enhancer = ImageEnhance.Contrast(img)
+        page.update(await asyncio.to_thread(enhancer.enhance, 1.5),
+                    'contrast:1.5')
+        return page
 
     def _get_optimized_path(self, original_path: str) -> str:
         """Генерирует путь для оптимизированного изображения"""
@@ -253,3 +141,162 @@ class ImageProcessor:
 
         optimized_filename = f"{name}_optimized{ext}"
         return os.path.join(directory, optimized_filename)
+
+
+class OrientPageTask(CpuTask):
+    """Определяет ориентацию страницы в процессе пула"""
+
+    __slots__ = ('page', 'timeout')
+
+    def __init__(self, page: Page, timeout: float):
+        self.page = page
+        self.timeout = timeout
+
+    def run(self) -> Page:
+        # Пиксели остаются в процессе пула, обратно уходит только поворот
+        orient_page(self.page, self.timeout)
+        self.page.release()
+        return self.page
+
+
+def orient_page(page: Page, timeout: float) -> Page:
+    """Определяет ориентацию страницы и запоминает поворот.
+
+    Блокирующая, выполняется в процессе пула.
+    """
+    if not page.is_pdf_page:
+        page.open()
+        if page.exif_orientation == 1:
+            logger.info(
+                f"EXIF показывает правильную ориентацию для {page.source}")
+            return page
+
+    # Определяем текущую ориентацию с помощью OCR
+    current_orientation = detect_orientation(page.image, timeout)
+    if current_orientation is None:
+        # Страница остается как есть, но такой результат не окончательный
+        page.provenance.append(OCR_FAILED)
+        return page
+
+    # Если ориентация правильная, поворот не нужен
+    if current_orientation == 0:
+        logger.info(f"OCR подтвердил правильную ориентацию для {page.source}")
+        return page
+
+    # Запоминаем поворот, он будет применен при записи страницы
+    page.rotate(current_orientation, 'ocr')
+    return page
+
+
+def ocr_failed(pages: List[Page]) -> bool:
+    """OCR не определил ориентацию хотя бы одной страницы"""
+    return any(OCR_FAILED in page.provenance for page in pages)
+
+
+def detect_orientation(img: Image.Image, timeout: float) -> Optional[int]:
+    """Определяет ориентацию изображения с помощью OCR.
+
+    Возвращает угол поворота или None, если OCR не отработал.
+    """
+    try:
+        # Конвертируем в RGB если нужно
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # Получаем размеры изображения
+        width, height = img.size
+
+        # Если изображение слишком маленькое, пропускаем OCR
+        if width < 100 or height < 100:
+            logger.warning("Изображение слишком маленькое для OCR")
+            return 0
+
+        # Пробуем определить ориентацию с помощью Tesseract
+        try:
+            # Пробуем разные языки для определения ориентации;
+            # если языковые модели не работают, пробуем без них
+            configs = (r'--oem 3 --psm 0 -l rus+eng',
+                       r'--oem 3 --psm 0 -l eng',
+                       r'--oem 3 --psm 0')
+            for index, custom_config in enumerate(configs):
+                try:
+                    osd = pytesseract.image_to_osd(
+                        img, config=custom_config, timeout=timeout)
+                    break
+                except Exception:
+                    if index == len(configs) - 1:
+                        raise
+
+            # Извлекаем угол поворота
+            rotate_match = re.search(r'Rotate: (\d+)', osd)
+            if rotate_match:
+                angle = int(rotate_match.group(1))
+                logger.info(f"OCR определил угол поворота: {angle} градусов")
+                return angle
+            else:
+                logger.warning("OCR не смог определить угол поворота")
+                return None
+
+        except Exception as ocr_error:
+            logger.warning(f"OCR не смог определить ориентацию: {ocr_error}")
+
+            # Пробуем эвристический метод
+            return heuristic_orientation_detection(img)
+
+    except Exception as e:
+        logger.error(f"Ошибка определения ориентации: {e}")
+        return None
+
+
+def heuristic_orientation_detection(img: Image.Image) -> Optional[int]:
+    """Эвристический метод определения ориентации.
+
+    Возвращает None, если ни одно распознавание не удалось.
+    """
+    try:
+        width, height = img.size
+
+        # Если изображение квадратное, не поворачиваем
+        if abs(width - height) < min(width, height) * 0.1:
+            return 0
+
+        # Пробуем OCR на повернутых версиях изображения
+        angles_to_try = [90, 180, 270]
+        best_angle = 0
+        best_confidence = 0
+        recognized = False
+
+        for angle in angles_to_try:
+            try:
+                rotated = img.rotate(angle, expand=True)
+
+                # Короткий таймаут для эвристики
+                text = pytesseract.image_to_string(
+                    rotated, lang='rus', config='--oem 3 --psm 6',
+                    timeout=30)
+
+                # Простая оценка качества распознавания
+                # Считаем количество букв и цифр
+                confidence = len([c for c in text if c.isalnum()])
+                recognized = True
+
+                if confidence > best_confidence:
+                    best_confidence = confidence
+                    best_angle = angle
+
+            except Exception:
+                continue
+
+        if not recognized:
+            return None
+
+        # Если нашли достаточно текста, возвращаем лучший угол
+        if best_confidence > 10:
+            logger.info(f"Эвристический метод определил угол: {best_angle}")
+            return best_angle
+
+        return 0
+
+    except Exception as e:
+        logger.error(f"Ошибка эвристического определения ориентации: {e}")
+        return None
@@ -0,0 +1,244 @@
+"""
+Фоновая очистка диска для DocKitBot
+"""
+
+import asyncio
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from config import Config
+from DocKitBot.blob_store import get_blob_store
+from DocKitBot.file_cache import get_file_cache
+
+
+class JanitorStats:
+    """Сколько удалено за все время работы бота"""
+
+    __slots__ = ('sweeps', 'removed_files', 'reclaimed_bytes',
+                 'quota_evictions', 'last_sweep_at')
+
+    def __init__(self):
+        self.sweeps = 0
+        self.removed_files = 0
+        # Освобожденные байты по областям: temp, output, cache, blobs
+        self.reclaimed_bytes: Dict[str, int] = {
+            'temp': 0, 'output': 0, 'cache': 0, 'blobs': 0}
+        # Удалено досрочно из-за квоты или нехватки места
+        self.quota_evictions = 0
+        self.last_sweep_at: Optional[float] = None
+
+    def __repr__(self) -> str:
+        areas = ", ".join(f"{area}: {size / 1024 / 1024:.1f}MB"
+                          for area, size in self.reclaimed_bytes.items())
+        return (f"проходов: {self.sweeps}, файлов удалено: "
+                f"{self.removed_files} ({areas}), "
+                f"по квоте: {self.quota_evictions}")
+
+
+class DiskJanitor:
+    """Периодически удаляет то, что бот оставил на диске.
+
+    Файлы temp/ и output/ старше CLEANUP_DELAY удаляются, если ими
+    не пользуется сессия или выполняемое задание (in_use возвращает
+    такие пути и каталоги). Кэш скачиваний и хранилище по содержимому
+    чистятся по своим срокам. Если temp/, output/ и cache/ вместе
+    превышают DISK_QUOTA или свободного места меньше DISK_MIN_FREE,
+    неиспользуемые файлы удаляются досрочно, начиная с самых старых.
+    """
+
+    def __init__(self, in_use: Optional[Callable[[], Set[str]]] = None,
+                 before_sweep: Optional[Callable[[], Any]] = None):
+        self.config = Config()
+        self.in_use = in_use or set
+        # Вызывается в цикле событий перед каждым проходом (например,
+        # закрывает устаревшие сессии, чтобы их файлы не защищались)
+        self.before_sweep = before_sweep
+        self.stats = JanitorStats()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запускает периодическую очистку в цикле событий"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает периодическую очистку"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # Пути в работе собираем в цикле событий, удаляем в потоке
+                if self.before_sweep is not None:
+                    self.before_sweep()
+                protected = self._protected_paths()
+                await asyncio.to_thread(self.sweep, protected)
+            except Exception as e:
+                logger.error(f"Ошибка очистки диска: {e}")
+            await asyncio.sleep(self.config.JANITOR_INTERVAL)
+
+    def _protected_paths(self) -> Set[str]:
+        return {os.path.abspath(path) for path in self.in_use()}
+
+    def sweep(self, protected: Optional[Set[str]] = None) -> int:
+        """Один проход очистки, возвращает число освобожденных байт"""
+        if protected is None:
+            protected = self._protected_paths()
+        reclaimed = 0
+        deadline = time.time() - self.config.CLEANUP_DELAY
+
+        # Устаревшие рабочие файлы (на диске и в памяти) и архивы
+        areas = [('temp', self.config.TEMP_DIR),
+                 ('output', self.config.OUTPUT_DIR)]
+        if self.config.WORKSPACE_RAM_DIR:
+            areas.append(('temp', self.config.WORKSPACE_RAM_DIR))
+        for area, root in areas:
+            for changed_at, file_path, size in self._candidates(root, protected):
+                if changed_at < deadline:
+                    reclaimed += self._remove(area, file_path, size)
+            self._prune_empty_dirs(root, deadline)
+
+        # Кэш скачиваний и хранилище по содержимому - по своим срокам
+        reclaimed += self._account('cache', get_file_cache().trim())
+        reclaimed += self._account('blobs', get_blob_store().gc())
+
+        reclaimed += self._enforce_quota(protected)
+
+        self.stats.sweeps += 1
+        self.stats.last_sweep_at = time.time()
+        if reclaimed:
+            logger.info(
+                f"Очистка диска: освобождено {reclaimed / 1024 / 1024:.1f}MB; "
+                f"всего {self.stats}")
+        return reclaimed
+
+    def _enforce_quota(self, protected: Set[str]) -> int:
+        """Досрочно удаляет самые старые файлы при нехватке места"""
+        candidates: List[Tuple[float, str, str, int]] = []
+        used = 0
+        for area, root in (('temp', self.config.TEMP_DIR),
+                           ('output', self.config.OUTPUT_DIR)):
+            for changed_at, file_path, size in self._candidates(root, protected):
+                candidates.append((changed_at, area, file_path, size))
+            used += self._disk_usage(root)
+        cache_dir = os.path.dirname(self.config.FILE_CACHE_DIR.rstrip('/'))
+        used += self._disk_usage(cache_dir)
+
+        os.makedirs(self.config.TEMP_DIR, exist_ok=True)
+        free = shutil.disk_usage(self.config.TEMP_DIR).free
+        excess = max(used - self.config.DISK_QUOTA,
+                     self.config.DISK_MIN_FREE - free)
+        if excess <= 0:
+            return 0
+
+        logger.warning(
+            f"Мало места на диске: занято {used / 1024 / 1024:.0f}MB, "
+            f"свободно {free / 1024 / 1024:.0f}MB, нужно освободить "
+            f"{excess / 1024 / 1024:.0f}MB")
+
+        # Сначала файлы хранилища без ссылок, не дожидаясь срока хранения
+        reclaimed = self._account('blobs', get_blob_store().gc(retention=0))
+
+        # Только что созданные файлы могут ждать регистрации или отправки
+        newest = time.time() - self.config.DISK_EVICTION_MIN_AGE
+        for changed_at, area, file_path, size in sorted(candidates):
+            if reclaimed >= excess or changed_at > newest:
+                break
+            freed = self._remove(area, file_path, size)
+            if freed:
+                self.stats.quota_evictions += 1
+            reclaimed += freed
+
+        if reclaimed < excess:
+            # Остаток забираем у кэша скачиваний
+            cache = get_file_cache()
+            target = max(0, cache.total_size - (excess - reclaimed))
+            reclaimed += self._account('cache', cache.trim(target))
+
+        if reclaimed < excess:
+            logger.error(
+                f"Не удалось освободить достаточно места: "
+                f"освобождено {reclaimed / 1024 / 1024:.0f}MB из "
+                f"{excess / 1024 / 1024:.0f}MB")
+        return reclaimed
+
+    def _candidates(self, root: str, protected: Set[str]
+                    ) -> List[Tuple[float, str, int]]:
+        """Файлы под root, которые можно удалить: (изменен, путь, размер)"""
+        candidates = []
+        for dir_path, dir_names, file_names in os.walk(root):
+            # Каталоги выполняемых заданий не трогаем целиком
+            dir_names[:] = [
+                name for name in dir_names
+                if os.path.abspath(os.path.join(dir_path, name)) not in protected]
+            for name in file_names:
+                file_path = os.path.join(dir_path, name)
+                if os.path.abspath(file_path) in protected:
+                    continue
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                # ctime меняется и при создании жесткой ссылки: файл,
+                # только что взятый из кэша, не считается старым
+                candidates.append((max(stat.st_mtime, stat.st_ctime),
+                                   file_path, self._reclaimable(stat)))
+        return candidates
+
+    def _reclaimable(self, stat: os.stat_result) -> int:
+        """Сколько места освободит удаление файла"""
+        # Жесткие ссылки из кэша и хранилища продолжают занимать место
+        return stat.st_size if stat.st_nlink <= 1 else 0
+
+    def _disk_usage(self, root: str) -> int:
+        """Место, занятое файлами под root (жесткие ссылки - один раз)"""
+        seen = set()
+        total = 0
+        for dir_path, _, file_names in os.walk(root):
+            for name in file_names:
+                try:
+                    stat = os.stat(os.path.join(dir_path, name))
+                except OSError:
+                    continue
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    total += stat.st_size
+        return total
+
+    def _remove(self, area: str, file_path: str, size: int) -> int:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            logger.warning(f"Не удалось удалить файл {file_path}: {e}")
+            return 0
+        self.stats.removed_files += 1
+        return self._account(area, size)
+
+    def _account(self, area: str, size: int) -> int:
+        self.stats.reclaimed_bytes[area] += size
+        return size
+
+    def _prune_empty_dirs(self, root: str, deadline: float):
+        """Удаляет давно не менявшиеся пустые каталоги под root"""
+        for dir_path, _, _ in os.walk(root, topdown=False):
+            if os.path.abspath(dir_path) == os.path.abspath(root):
+                continue
+            try:
+                # Свежий пустой каталог может ждать скачиваемый файл
+                if os.stat(dir_path).st_mtime < deadline:
+                    os.rmdir(dir_path)
+            except OSError:
+                # Каталог не пуст или уже удален
+                pass
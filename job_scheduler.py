@@ -0,0 +1,290 @@
+"""
+Планировщик заданий на обработку для DocKitBot
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import (Any, Awaitable, Callable, Deque, Dict, List, Optional,
+                    Set)
+
+from loguru import logger
+
+from config import Config
+from DocKitBot.cpu_pool import CancelToken, use_cancel_token
+
+# Статусы задания
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+
+def new_job_id() -> str:
+    """Идентификатор нового задания"""
+    return uuid.uuid4().hex[:8]
+
+
+class Job:
+    """Задание на обработку файлов одного пользователя"""
+
+    __slots__ = ('job_id', 'user_id', 'size', 'run', 'status', 'created_at',
+                 'started_at', 'finished_at', 'task', 'on_queue_update',
+                 'queue_position', 'progress', 'stats', 'cancel_token')
+
+    def __init__(self, user_id: int, size: int,
+                 run: Callable[[], Awaitable[Any]],
+                 on_queue_update: Optional[Callable[[int], Awaitable[None]]] = None,
+                 job_id: Optional[str] = None):
+        self.job_id = job_id or new_job_id()
+        self.user_id = user_id
+        # Размер задания в файлах
+        self.size = size
+        # Фабрика корутины, выполняющей задание
+        self.run = run
+        self.status = JOB_QUEUED
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Вызывается с новой позицией в очереди, пока задание ждет
+        self.on_queue_update = on_queue_update
+        # Последняя позиция в очереди, о которой узнал пользователь
+        self.queue_position = 0
+        # Процент выполнения, который обновляет само задание
+        self.progress = 0
+        # Показатели этапов, которые записывает само задание
+        self.stats: Dict[str, Any] = {}
+        # Останавливает задачи задания, уже переданные в пул процессов
+        self.cancel_token = CancelToken()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    def __repr__(self) -> str:
+        return (f"Job({self.job_id}, user={self.user_id}, "
+                f"size={self.size}, status={self.status})")
+
+
+class JobScheduler:
+    """Глобальная очередь заданий со справедливым распределением.
+
+    Задания пользователей чередуются по кругу, поэтому большой архив
+    одного пользователя не задерживает остальных. Небольшие задания идут
+    по быстрой полосе, для которой зарезервирована часть общего бюджета
+    исполнителей.
+    """
+
+    def __init__(self):
+        self.config = Config()
+        self._fast_lane: Deque[Job] = deque()
+        # Очереди обычных заданий по пользователям в порядке обхода
+        self._user_queues: 'OrderedDict[int, Deque[Job]]' = OrderedDict()
+        self._running: Dict[str, Job] = {}
+        # Все незавершенные задания по идентификатору
+        self._jobs: Dict[str, Job] = {}
+        # Незавершенные уведомления о позиции в очереди
+        self._notify_tasks: Set[asyncio.Task] = set()
+
+    def submit(self, user_id: int, size: int,
+               run: Callable[[], Awaitable[Any]],
+               on_queue_update: Optional[Callable[[int], Awaitable[None]]] = None,
+               job_id: Optional[str] = None) -> Job:
+        """Ставит задание в очередь и запускает его, когда подойдет черед.
+
+        job_id задают заранее, если сообщение о задании (например, с
+        кнопкой отмены) отправляется до постановки в очередь.
+        """
+        job = Job(user_id, size, run, on_queue_update, job_id)
+        self._jobs[job.job_id] = job
+        if self._is_small(job):
+            self._fast_lane.append(job)
+        else:
+            self._user_queues.setdefault(user_id, deque()).append(job)
+
+        logger.info(
+            f"Задание {job.job_id} пользователя {user_id} поставлено "
+            f"в очередь: {size} файлов")
+        self._dispatch()
+        # Начальную позицию показывает тот, кто поставил задание
+        job.queue_position = self.position(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        """Возвращает незавершенное задание по идентификатору"""
+        return self._jobs.get(job_id)
+
+    def get_user_jobs(self, user_id: int) -> List[Job]:
+        """Незавершенные задания пользователя в порядке постановки"""
+        return [job for job in self._jobs.values() if job.user_id == user_id]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Отменяет задание: из очереди убирает, выполняемое прерывает.
+
+        Выполняемое задание получает CancelledError в ближайшей точке
+        ожидания и само освобождает свои ресурсы, а его задачи в пуле
+        процессов останавливаются на границе страниц.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+
+        if job.status == JOB_QUEUED:
+            if job in self._fast_lane:
+                self._fast_lane.remove(job)
+            else:
+                queue = self._user_queues.get(job.user_id)
+                if queue is not None:
+                    queue.remove(job)
+                    if not queue:
+                        del self._user_queues[job.user_id]
+            job.status = JOB_CANCELLED
+            job.finished_at = time.monotonic()
+            del self._jobs[job_id]
+            self._notify_queue()
+        elif job.task is not None:
+            job.cancel_token.cancel()
+            job.task.cancel()
+
+        logger.info(f"Задание {job_id} пользователя {job.user_id} отменено")
+        return job
+
+    def position(self, job: Job) -> int:
+        """Позиция задания в очереди (0 - задание уже выполняется)"""
+        if job.status != JOB_QUEUED:
+            return 0
+        for index, queued in enumerate(self._dispatch_order(), 1):
+            if queued is job:
+                return index
+        return 0
+
+    def _is_small(self, job: Job) -> bool:
+        return job.size <= self.config.SMALL_JOB_MAX_FILES
+
+    def _dispatch_order(self) -> List[Job]:
+        """Порядок, в котором ожидающие задания будут запущены"""
+        order = list(self._fast_lane)
+
+        # Повторяем выбор _next_job на копии очередей
+        queues = OrderedDict(
+            (user_id, deque(queue))
+            for user_id, queue in self._user_queues.items())
+        running = self._running_per_user()
+        while queues:
+            order.append(self._pop_fair(queues, running))
+        return order
+
+    def _running_per_user(self) -> Dict[int, int]:
+        running: Dict[int, int] = {}
+        for job in self._running.values():
+            running[job.user_id] = running.get(job.user_id, 0) + 1
+        return running
+
+    def _pop_fair(self, queues: 'OrderedDict[int, Deque[Job]]',
+                  running: Dict[int, int]) -> Job:
+        """Забирает задание пользователя, у которого меньше всего запущено.
+
+        При равенстве побеждает тот, кто раньше в круге обхода; после
+        выбора пользователь уходит в конец круга.
+        """
+        user_id = min(queues, key=lambda user: running.get(user, 0))
+        queue = queues.pop(user_id)
+        job = queue.popleft()
+        if queue:
+            queues[user_id] = queue
+        running[user_id] = running.get(user_id, 0) + 1
+        return job
+
+    def _next_job(self) -> Optional[Job]:
+        """Выбирает следующее задание с учетом бюджета исполнителей"""
+        if len(self._running) >= self.config.MAX_ACTIVE_JOBS:
+            return None
+
+        if self._fast_lane:
+            return self._fast_lane.popleft()
+
+        # Крупные задания не занимают слоты, зарезервированные
+        # для быстрой полосы
+        regular_budget = max(
+            1, self.config.MAX_ACTIVE_JOBS -
+            self.config.FAST_LANE_RESERVED_SLOTS)
+        regular_running = sum(
+            1 for job in self._running.values() if not self._is_small(job))
+        if regular_running >= regular_budget:
+            return None
+
+        if not self._user_queues:
+            return None
+        return self._pop_fair(self._user_queues, self._running_per_user())
+
+    def _dispatch(self):
+        """Запускает ожидающие задания, пока позволяет бюджет"""
+        started = False
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            self._start(job)
+            started = True
+
+        if started:
+            self._notify_queue()
+
+    def _start(self, job: Job):
+        job.status = JOB_RUNNING
+        job.started_at = time.monotonic()
+        self._running[job.job_id] = job
+        logger.info(
+            f"Задание {job.job_id} пользователя {job.user_id} запущено "
+            f"после {job.started_at - job.created_at:.1f} с ожидания")
+        job.task = asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: Job):
+        # Задачи пула, запущенные заданием, видят его флаг отмены
+        use_cancel_token(job.cancel_token)
+        try:
+            await job.run()
+            job.status = JOB_DONE
+        except asyncio.CancelledError:
+            job.status = JOB_CANCELLED
+        except Exception as e:
+            job.status = JOB_FAILED
+            logger.error(f"Задание {job.job_id} завершилось с ошибкой: {e}")
+        finally:
+            job.cancel_token.close()
+            job.finished_at = time.monotonic()
+            logger.info(
+                f"Задание {job.job_id} завершено ({job.status}) за "
+                f"{job.finished_at - job.started_at:.1f} с"
+                + (f": {job.stats}" if job.stats else ""))
+            self._running.pop(job.job_id, None)
+            self._jobs.pop(job.job_id, None)
+            self._dispatch()
+
+    def _notify_queue(self):
+        """Сообщает ожидающим заданиям их новые позиции.
+
+        Сообщение редактируется только у заданий, чья позиция изменилась,
+        чтобы не упираться в ограничения Telegram на частоту запросов.
+        """
+        for index, job in enumerate(self._dispatch_order(), 1):
+            if not job.on_queue_update or job.queue_position == index:
+                continue
+            job.queue_position = index
+            task = asyncio.create_task(self._safe_queue_update(job, index))
+            # Держим ссылку, пока уведомление не отправлено
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+
+    async def _safe_queue_update(self, job: Job, position: int):
+        # Позиция могла снова измениться или задание уже запустилось
+        if job.status != JOB_QUEUED or job.queue_position != position:
+            return
+        try:
+            await job.on_queue_update(position)
+        except Exception as e:
+            logger.warning(
+                f"Не удалось обновить позицию задания {job.job_id}: {e}")
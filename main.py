@@ -3,6 +3,7 @@
 DocKitBot - Telegram бот для обработки юридических документов
 """
 
+import asyncio
 import os
 
 from dotenv import load_dotenv
@@ -12,19 +13,23 @@ from telegram.ext import (Application, CallbackQueryHandler, CommandHandler,
                           MessageHandler, filters)
 
 from config import Config
+from DocKitBot.blob_store import get_blob_store
 from DocKitBot.bot_handler import BotHandler
+from DocKitBot.cpu_pool import get_cpu_pool
+from DocKitBot.download_manager import get_download_manager
+from DocKitBot.janitor import DiskJanitor
+from DocKitBot.update_processor import UserOrderedUpdateProcessor
 
 # Загружаем переменные окружения
 load_dotenv()
 
-# Настройка логирования
-logger.add("logs/bot.log", rotation="1 day", retention="7 days", level="INFO")
-
 
 class DocKitBot:
     def __init__(self):
         self.config = Config()
         self.bot_handler = BotHandler()
+        self.janitor = DiskJanitor(self.bot_handler.paths_in_use,
+                                   self.bot_handler.expire_idle_sessions)
 
     async def start_command(self, update: Update, context):
         """Обработчик команды /start"""
@@ -46,30 +51,97 @@ class DocKitBot:
         """Обработчик команды /process"""
         await self.bot_handler.handle_process(update, context)
 
+    async def handle_status(self, update: Update, context):
+        """Обработчик команды /status"""
+        await self.bot_handler.handle_status(update, context)
+
     async def handle_callback(self, update: Update, context):
         """Обработчик callback кнопок"""
         await self.bot_handler.handle_callback(update, context)
 
-    def run(self):
-        """Запуск бота"""
-        # Создаем папки для логов и временных файлов
-        os.makedirs("logs", exist_ok=True)
-        os.makedirs("temp", exist_ok=True)
-        os.makedirs("output", exist_ok=True)
-
-        # Инициализируем приложение
-        application = Application.builder().token(self.config.TELEGRAM_TOKEN).build()
+    async def on_startup(self, application: Application):
+        """Запуск фоновых задач после инициализации бота"""
+        self.janitor.start()
+
+    async def on_shutdown(self, application: Application):
+        """Освобождение ресурсов при остановке бота"""
+        await self.janitor.stop()
+        logger.info(f"Очистка диска за время работы: {self.janitor.stats}")
+        get_cpu_pool().shutdown()
+        await get_download_manager().close()
+        await asyncio.to_thread(get_blob_store().flush)
+
+    def build_application(self) -> Application:
+        """Создает приложение с обработчиками, общими для всех режимов"""
+        builder = (
+            Application.builder()
+            .token(self.config.TELEGRAM_TOKEN)
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            # Разные пользователи обслуживаются параллельно
+            .concurrent_updates(UserOrderedUpdateProcessor())
+        )
+        if self.config.TELEGRAM_API_URL:
+            # Собственный сервер Bot API: файлы до 2000MB и без лишних копий
+            builder = (
+                builder
+                .base_url(self.config.TELEGRAM_API_URL)
+                .base_file_url(self.config.TELEGRAM_FILE_URL)
+                .local_mode(self.config.TELEGRAM_LOCAL_MODE)
+            )
+            logger.info(
+                f"Используется сервер Bot API: {self.config.TELEGRAM_API_URL}"
+                f" (локальный режим: {self.config.TELEGRAM_LOCAL_MODE})")
+        application = builder.build()
 
         # Добавляем обработчики
         application.add_handler(CommandHandler("start", self.start_command))
         application.add_handler(CommandHandler("help", self.help_command))
         application.add_handler(CommandHandler("process", self.handle_process))
+        application.add_handler(CommandHandler("status", self.handle_status))
         application.add_handler(MessageHandler(
             filters.Document.ALL, self.handle_document))
         application.add_handler(MessageHandler(
             filters.PHOTO, self.handle_photo))
         application.add_handler(CallbackQueryHandler(self.handle_callback))
 
+        return application
+
+    def run(self):
+        """Запуск бота"""
+        # Создаем папки для логов и временных файлов
+        os.makedirs("logs", exist_ok=True)
+        os.makedirs("temp", exist_ok=True)
+        os.makedirs("output", exist_ok=True)
+
+        # Файл лога подключается только в основном процессе: процессы пула
+        # (spawn) заново импортируют этот модуль и не должны добавлять
+        # собственный обработчик ротации того же файла
+        logger.add("logs/bot.log", rotation="1 day", retention="7 days",
+                   level="INFO")
+
+        # Инициализируем приложение
+        application = self.build_application()
+
+        if self.config.BOT_MODE == "webhook":
+            logger.info(
+                f"Бот запущен в режиме webhook: "
+                f"{self.config.WEBHOOK_LISTEN}:{self.config.WEBHOOK_PORT}"
+                f"/{self.config.WEBHOOK_PATH}")
+
+            # Запускаем веб-сервер и регистрируем webhook в Telegram
+            application.run_webhook(
+                listen=self.config.WEBHOOK_LISTEN,
+                port=self.config.WEBHOOK_PORT,
+                url_path=self.config.WEBHOOK_PATH,
+                webhook_url=self.config.WEBHOOK_URL,
+                secret_token=self.config.WEBHOOK_SECRET_TOKEN,
+                cert=self.config.WEBHOOK_CERT,
+                key=self.config.WEBHOOK_KEY,
+                allowed_updates=Update.ALL_TYPES
+            )
+            return
+
         logger.info("Бот запущен")
 
         # Запускаем бота
@@ -0,0 +1,225 @@
+"""
+Модель страницы документа для DocKitBot
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from PIL import Image
+
+from DocKitBot.cpu_pool import CpuTask, get_cpu_pool
+
+# EXIF tag для ориентации
+EXIF_ORIENTATION_TAG = 274
+
+# Масштаб рендеринга страниц PDF (2x zoom для лучшего качества)
+PDF_RENDER_ZOOM = 2.0
+
+
+class Page:
+    """Страница документа, которую этапы обработки передают друг другу.
+
+    Пиксели декодируются лениво и не более одного раза, поворот
+    накапливается и применяется только при записи результата на диск.
+    """
+
+    __slots__ = ('source', 'page_index', 'name', 'rotation',
+                 'exif_orientation', 'provenance', '_image', '_edited')
+
+    def __init__(self, source: str, name: Optional[str] = None,
+                 page_index: Optional[int] = None):
+        # Путь к исходному файлу (изображению или PDF)
+        self.source = source
+        # Номер страницы внутри PDF (None для изображений)
+        self.page_index = page_index
+        # Имя документа, к которому относится страница
+        self.name = name or os.path.basename(source)
+        # Отложенный поворот по часовой стрелке в градусах
+        self.rotation = 0
+        # Ориентация из EXIF (None, если EXIF отсутствует)
+        self.exif_orientation: Optional[int] = None
+        # История операций над страницей
+        self.provenance: List[str] = []
+        self._image: Optional[Image.Image] = None
+        # Пиксели изменены этапом обработки и не восстанавливаются из source
+        self._edited = False
+
+    def __repr__(self) -> str:
+        index = '' if self.page_index is None else f"#{self.page_index + 1}"
+        return (f"Page({self.source}{index}, rotation={self.rotation}, "
+                f"loaded={self.is_loaded})")
+
+    @property
+    def is_pdf_page(self) -> bool:
+        """Страница взята из PDF документа"""
+        return self.page_index is not None
+
+    @property
+    def is_loaded(self) -> bool:
+        """Пиксели страницы уже декодированы"""
+        return (self._image is not None and
+                not getattr(self._image, 'tile', None))
+
+    def open(self) -> Image.Image:
+        """Открывает источник, не декодируя пиксели изображения"""
+        if self._image is None:
+            if self.is_pdf_page:
+                self._image = render_pdf_page(self.source, self.page_index)
+                self.provenance.append(f"render:{self.page_index + 1}")
+            else:
+                self._image = Image.open(self.source)
+                self.exif_orientation = get_exif_orientation(self._image)
+        return self._image
+
+    @property
+    def image(self) -> Image.Image:
+        """Декодированные пиксели страницы (декодируются один раз)"""
+        img = self.open()
+        img.load()
+        return img
+
+    def rotate(self, angle: int, reason: str = 'rotate'):
+        """Добавляет отложенный поворот по часовой стрелке"""
+        angle %= 360
+        if angle:
+            self.rotation = (self.rotation + angle) % 360
+            self.provenance.append(f"{reason}:{angle}")
+
+    def update(self, image: Image.Image, step: str):
+        """Заменяет пиксели страницы результатом этапа обработки"""
+        if self._image is not None and self._image is not image:
+            self._image.close()
+        self._image = image
+        self._edited = True
+        self.provenance.append(step)
+
+    def render(self) -> Image.Image:
+        """Возвращает RGB изображение с примененным поворотом"""
+        img = self.image
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if self.rotation:
+            img = img.rotate(-self.rotation, expand=True)
+        return img
+
+    def materialize(self, path: str, format: Optional[str] = None,
+                    **params: Any) -> str:
+        """Записывает страницу на диск (единственное кодирование)"""
+        self.render().save(path, format, **params)
+        self.provenance.append(f"save:{os.path.basename(path)}")
+        logger.debug(f"Страница записана: {path} ({self.provenance})")
+        return path
+
+    def release(self):
+        """Освобождает декодированные пиксели"""
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+        self._edited = False
+
+    def adopt(self, other: 'Page'):
+        """Принимает состояние копии страницы, вернувшейся из пула"""
+        if self._image is not None and self._image is not other._image:
+            self._image.close()
+        self._image = other._image
+        self._edited = other._edited
+        self.rotation = other.rotation
+        self.exif_orientation = other.exif_orientation
+        self.provenance = other.provenance
+
+    def __getstate__(self):
+        # Пиксели, которые можно получить из source, между процессами
+        # не передаются: получатель декодирует источник сам. Измененные
+        # пиксели передаются базовым Image: подклассы форматов (например
+        # PngImageFile) после unpickle неполноценны
+        state = {slot: getattr(self, slot) for slot in self.__slots__}
+        if not (self._edited and self.is_loaded):
+            state['_image'] = None
+            state['_edited'] = False
+        elif type(self._image) is not Image.Image:
+            state['_image'] = self._image.copy()
+        return state
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+
+class MaterializePageTask(CpuTask):
+    """Записывает страницу на диск в процессе пула"""
+
+    __slots__ = ('page', 'path', 'format', 'params')
+
+    def __init__(self, page: Page, path: str, format: Optional[str] = None,
+                 params: Optional[Dict[str, Any]] = None):
+        self.page = page
+        self.path = path
+        self.format = format
+        self.params = params or {}
+
+    def run(self) -> str:
+        return self.page.materialize(self.path, self.format, **self.params)
+
+
+async def load_page(page: Page) -> Image.Image:
+    """Декодирует страницу для обработки в цикле событий.
+
+    Пиксели нужны в этом процессе, поэтому декодирование идет в потоке:
+    через пул они прошли бы лишний раз при передаче обратно.
+    """
+    if not page.is_loaded:
+        # Рендеринг страницы PDF тоже выполняется в потоке
+        await asyncio.to_thread(lambda: page.image)
+    return page.image
+
+
+async def materialize_page(page: Page, path: str, format: Optional[str] = None,
+                           **params: Any) -> str:
+    """Записывает страницу на диск в пуле процессов"""
+    await get_cpu_pool().run(MaterializePageTask(page, path, format, params))
+    page.provenance.append(f"save:{os.path.basename(path)}")
+    return path
+
+
+def get_exif_orientation(img: Image.Image) -> Optional[int]:
+    """Получает ориентацию из EXIF данных"""
+    try:
+        if hasattr(img, '_getexif') and img._getexif() is not None:
+            exif = img._getexif()
+            if exif is not None:
+                return exif.get(EXIF_ORIENTATION_TAG, 1)
+    except Exception as e:
+        logger.debug(f"Ошибка получения EXIF ориентации: {e}")
+    return None
+
+
+def render_pdf_page(pdf_path: str, page_index: int) -> Image.Image:
+    """Рендерит страницу PDF в изображение в памяти"""
+    try:
+        import fitz  # PyMuPDF
+
+        with fitz.open(pdf_path) as doc:
+            page = doc.load_page(page_index)
+            pix = page.get_pixmap(
+                matrix=fitz.Matrix(PDF_RENDER_ZOOM, PDF_RENDER_ZOOM))
+            return Image.frombytes(
+                'RGB', (pix.width, pix.height), pix.samples)
+
+    except ImportError:
+        logger.warning("PyMuPDF не установлен, используем fallback метод")
+        try:
+            from pdf2image import convert_from_path
+        except ImportError:
+            raise RuntimeError(
+                "pdf2image не установлен, невозможно конвертировать "
+                "PDF в изображения")
+
+        images = convert_from_path(
+            pdf_path, dpi=300,
+            first_page=page_index + 1, last_page=page_index + 1)
+        if not images:
+            raise ValueError(
+                f"Страница {page_index + 1} не найдена в {pdf_path}")
+        return images[0]
@@ -2,132 +2,161 @@
 Конвертер PDF для DocKitBot
 """
 
+import asyncio
 import os
 import re
+import uuid
+from contextlib import ExitStack
 from typing import List, Optional
 
 from loguru import logger
-from PIL import Image
 from PyPDF2 import PdfReader, PdfWriter
 
 from config import Config
+from DocKitBot.cpu_pool import CpuTask, get_cpu_pool, raise_if_cancelled
+from DocKitBot.file_record import compile_page_patterns, pdf_file_name
+from DocKitBot.image_processor import orient_page
+from DocKitBot.page import Page, materialize_page
+from DocKitBot.workspace import JobWorkspace, is_out_of_space
 
 
 class PDFConverter:
     def __init__(self):
         self.config = Config()
+        self.page_patterns = compile_page_patterns(self.config.PAGE_PATTERNS)
 
     async def image_to_pdf(self, image_path: str, original_name: str) -> Optional[str]:
         """Конвертирует изображение в PDF"""
+        page = Page(image_path, original_name)
+        try:
+            # Генерируем имя для PDF
+            pdf_name = self._get_pdf_name(original_name)
+            pdf_path = os.path.join(os.path.dirname(image_path), pdf_name)
+
+            return await self.pages_to_pdf([page], pdf_path)
+        finally:
+            page.release()
+
+    async def pages_to_pdf(self, pages: List[Page], pdf_path: str,
+                           workspace: Optional[JobWorkspace] = None,
+                           orient_timeout: Optional[float] = None) -> Optional[str]:
+        """Записывает страницы в PDF, кодируя каждую страницу не более одного раза.
+
+        С workspace результат размещается в каталоге задания (в памяти,
+        пока хватает бюджета) под тем же относительным именем. С
+        orient_timeout ориентация страниц-изображений определяется OCR
+        в том же процессе пула перед записью, и каждая страница
+        декодируется только один раз.
+        """
+        if not pages:
+            return None
+        if workspace is not None:
+            pdf_path = workspace.place(
+                pdf_path, self._estimate_pdf_size(pages))
+        # Уникальное временное имя: файлы обрабатываются параллельно
+        temp_path = f"{pdf_path}.{uuid.uuid4().hex[:8]}.part"
         try:
-            # Открываем изображение
-            with Image.open(image_path) as img:
-                # Конвертируем в RGB если нужно
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-
-                # Генерируем имя для PDF
-                pdf_name = self._get_pdf_name(original_name)
-                pdf_path = os.path.join(os.path.dirname(image_path), pdf_name)
-
-                # Сохраняем как PDF
-                img.save(pdf_path, 'PDF', resolution=300.0)
 
-                logger.info(f"Изображение конвертировано в PDF: {pdf_path}")
-                return pdf_path
+            if all(page.is_pdf_page for page in pages):
+                # Для копирования страниц PDF пиксели не нужны,
+                # не передаем их в пул
+                for page in pages:
+                    page.release()
+
+            # Кодирование выполняется в пуле процессов
+            try:
+                written = await get_cpu_pool().run(
+                    WritePagesPdfTask(pages, temp_path, orient_timeout))
+            except OSError as e:
+                disk_path = (workspace.spill(pdf_path)
+                             if workspace is not None and is_out_of_space(e)
+                             else None)
+                if disk_path is None:
+                    raise
+                # В памяти не хватило места - пишем на диск
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                pdf_path = disk_path
+                temp_path = f"{pdf_path}.{uuid.uuid4().hex[:8]}.part"
+                written = await get_cpu_pool().run(
+                    WritePagesPdfTask(pages, temp_path, orient_timeout))
+            # Пиксели страниц в этом процессе не меняются, переносим
+            # только найденный в пуле поворот
+            for page, written_page in zip(pages, written):
+                page.rotation = written_page.rotation
+                page.provenance = written_page.provenance
+
+            # Источник мог совпадать с результатом, поэтому пишем через замену
+            os.replace(temp_path, pdf_path)
+            if workspace is not None:
+                pdf_path = await asyncio.to_thread(workspace.settle, pdf_path)
+            for page in pages:
+                page.provenance.append(f"pdf:{os.path.basename(pdf_path)}")
+
+            logger.info(
+                f"Страницы записаны в PDF: {pdf_path} ({len(pages)} стр.)")
+            return pdf_path
 
         except Exception as e:
-            logger.error(
-                f"Ошибка конвертации изображения в PDF {image_path}: {e}")
+            logger.error(f"Ошибка записи страниц в PDF {pdf_path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if workspace is not None:
+                workspace.settle(pdf_path)
             return None
 
-    async def merge_pdfs(self, pdf_paths: List[str], base_name: str) -> Optional[str]:
+    def _estimate_pdf_size(self, pages: List[Page]) -> int:
+        """Оценка размера PDF по размерам исходных файлов страниц"""
+        size = 0
+        for source in {page.source for page in pages}:
+            try:
+                size += os.path.getsize(source)
+            except OSError:
+                pass
+        return size
+
+    async def merge_pdfs(self, pdf_paths: List[str], base_name: str,
+                         correct_orientation: bool = True,
+                         workspace: Optional[JobWorkspace] = None) -> Optional[str]:
         """Объединяет несколько PDF в один с правильной ориентацией текста"""
         try:
             if not pdf_paths:
                 return None
 
-            # Сначала обрабатываем каждый PDF для правильной ориентации
-            corrected_pdfs = []
-            for pdf_path in pdf_paths:
-                try:
-                    # Конвертируем PDF в изображения для анализа ориентации
-                    images = await self.pdf_to_images(pdf_path)
-                    if not images:
-                        logger.warning(f"Не удалось конвертировать PDF в изображения: {pdf_path}")
-                        corrected_pdfs.append(pdf_path)
-                        continue
-
-                    # Проверяем ориентацию текста каждой страницы
-                    corrected_images = []
-                    needs_correction = False
-
-                    for i, image_path in enumerate(images):
-                        # Импортируем image_processor для определения ориентации
-                        from image_processor import ImageProcessor
-                        image_processor = ImageProcessor()
-
-                        # Определяем правильную ориентацию текста с помощью OCR
-                        corrected_image = await image_processor.correct_orientation(image_path)
-                        if corrected_image != image_path:
-                            needs_correction = True
-                            logger.info(f"Страница {i+1} требует исправления ориентации")
-                        corrected_images.append(corrected_image)
-
-                    if needs_correction:
-                        # Объединяем исправленные изображения обратно в PDF
-                        corrected_pdf = await self.images_to_pdf(
-                            corrected_images,
-                            f"corrected_{os.path.splitext(os.path.basename(pdf_path))[0]}"
-                        )
-
-                        # Очищаем временные изображения
-                        for img_path in images + corrected_images:
-                            if img_path != pdf_path and os.path.exists(img_path):
-                                os.remove(img_path)
-
-                        if corrected_pdf:
-                            corrected_pdfs.append(corrected_pdf)
-                            logger.info(f"PDF ориентация исправлена: {pdf_path} -> {corrected_pdf}")
-                        else:
-                            corrected_pdfs.append(pdf_path)
-                    else:
-                        # Очищаем временные изображения
-                        for img_path in images:
-                            if img_path != pdf_path and os.path.exists(img_path):
-                                os.remove(img_path)
-                        corrected_pdfs.append(pdf_path)
-                        logger.info(f"PDF ориентация корректна: {pdf_path}")
-
-                except Exception as e:
-                    logger.error(f"Ошибка обработки ориентации PDF {pdf_path}: {e}")
-                    corrected_pdfs.append(pdf_path)
-
-            # Теперь объединяем исправленные PDF
-            pdf_writer = PdfWriter()
+            # Импортируем image_processor для определения ориентации
+            from image_processor import ImageProcessor
+            image_processor = ImageProcessor()
 
-            for pdf_path in corrected_pdfs:
-                try:
-                    with open(pdf_path, 'rb') as pdf_file:
-                        pdf_reader = PdfReader(pdf_file)
-                        for page in pdf_reader.pages:
-                            pdf_writer.add_page(page)
-                except Exception as e:
-                    logger.error(f"Ошибка чтения PDF {pdf_path}: {e}")
+            pages = []
+            for pdf_path in pdf_paths:
+                pdf_pages = await self.pdf_to_pages(pdf_path)
+                if not pdf_pages:
+                    logger.error(f"Ошибка чтения PDF {pdf_path}")
                     continue
 
+                if correct_orientation:
+                    # Определяем правильную ориентацию текста с помощью OCR
+                    for i, page in enumerate(pdf_pages):
+                        await image_processor.correct_page_orientation(page)
+                        page.release()
+                        if page.rotation:
+                            logger.info(
+                                f"Страница {i+1} требует исправления ориентации")
+
+                pages.extend(pdf_pages)
+
             # Если нет страниц, возвращаем None
-            if len(pdf_writer.pages) == 0:
+            if not pages:
                 return None
 
             # Сохраняем объединенный PDF
             merged_pdf_path = self._get_merged_pdf_path(
                 pdf_paths[0], base_name)
+            merged_pdf_path = await self.pages_to_pdf(
+                pages, merged_pdf_path, workspace)
 
-            with open(merged_pdf_path, 'wb') as output_file:
-                pdf_writer.write(output_file)
-
-            logger.info(f"PDF файлы объединены с правильной ориентацией: {merged_pdf_path}")
+            if merged_pdf_path:
+                logger.info(f"PDF файлы объединены с правильной ориентацией: {merged_pdf_path}")
             return merged_pdf_path
 
         except Exception as e:
@@ -136,31 +165,7 @@ class PDFConverter:
 
     def _get_pdf_name(self, original_name: str) -> str:
         """Генерирует имя для PDF файла"""
-        # Убираем расширение
-        name_without_ext = os.path.splitext(original_name)[0]
-
-        # Сохраняем информацию о странице
-        page_info = None
-        for pattern in self.config.PAGE_PATTERNS:
-            match = re.search(pattern, name_without_ext, re.IGNORECASE)
-            if match:
-                page_info = match.group()
-                break
-
-        # Убираем маркеры страниц для базового имени
-        for pattern in self.config.PAGE_PATTERNS:
-            name_without_ext = re.sub(
-                pattern, '', name_without_ext, flags=re.IGNORECASE)
-
-        # Очищаем от лишних пробелов
-        clean_name = name_without_ext.strip()
-
-        # Добавляем информацию о странице обратно, если она была
-        if page_info:
-            clean_name = f"{clean_name} {page_info}"
-
-        # Добавляем расширение PDF
-        return f"{clean_name}.pdf"
+        return pdf_file_name(original_name, self.page_patterns)
 
     def _get_merged_pdf_path(self, first_pdf_path: str, base_name: str) -> str:
         """Генерирует путь для объединенного PDF"""
@@ -209,124 +214,70 @@ class PDFConverter:
             logger.error(f"Ошибка получения информации о PDF {pdf_path}: {e}")
             return {}
 
-    async def pdf_to_images(self, pdf_path: str) -> List[str]:
-        """Конвертирует PDF в список изображений"""
+    async def pdf_to_pages(self, pdf_path: str) -> List[Page]:
+        """Разбивает PDF на страницы без рендеринга"""
         try:
-            import fitz  # PyMuPDF
+            pages_count = await get_cpu_pool().run(
+                CountPdfPagesTask(pdf_path))
 
-            # Открываем PDF
-            doc = fitz.open(pdf_path)
-            image_paths = []
-
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-
-                # Рендерим страницу как изображение с высоким разрешением
-                mat = fitz.Matrix(2.0, 2.0)  # 2x zoom для лучшего качества
-                pix = page.get_pixmap(matrix=mat)
-
-                # Сохраняем изображение
-                image_path = os.path.join(
-                    os.path.dirname(pdf_path),
-                    f"{os.path.splitext(os.path.basename(pdf_path))[0]}_page_{page_num + 1}.png"
-                )
-                pix.save(image_path)
-                image_paths.append(image_path)
+            name = os.path.basename(pdf_path)
+            return [Page(pdf_path, name, page_index)
+                    for page_index in range(pages_count)]
 
-            doc.close()
-            logger.info(f"PDF конвертирован в {len(image_paths)} изображений: {pdf_path}")
-            return image_paths
-
-        except ImportError:
-            logger.warning("PyMuPDF не установлен, используем fallback метод")
-            return await self._pdf_to_images_fallback(pdf_path)
         except Exception as e:
-            logger.error(f"Ошибка конвертации PDF в изображения {pdf_path}: {e}")
+            logger.error(f"Ошибка чтения страниц PDF {pdf_path}: {e}")
             return []
 
-    async def _pdf_to_images_fallback(self, pdf_path: str) -> List[str]:
-        """Fallback метод конвертации PDF в изображения без PyMuPDF"""
+    async def pdf_to_images(self, pdf_path: str) -> List[str]:
+        """Конвертирует PDF в список изображений"""
         try:
-            from pdf2image import convert_from_path
-
-            # Конвертируем PDF в изображения
-            images = convert_from_path(pdf_path, dpi=300)
             image_paths = []
-
-            for i, image in enumerate(images):
+            for page in await self.pdf_to_pages(pdf_path):
+                # Сохраняем изображение
                 image_path = os.path.join(
                     os.path.dirname(pdf_path),
-                    f"{os.path.splitext(os.path.basename(pdf_path))[0]}_page_{i + 1}.png"
+                    f"{os.path.splitext(os.path.basename(pdf_path))[0]}_page_{page.page_index + 1}.png"
                 )
-                image.save(image_path, 'PNG')
+                await materialize_page(page, image_path, 'PNG')
                 image_paths.append(image_path)
 
-            logger.info(f"PDF конвертирован в {len(image_paths)} изображений (fallback): {pdf_path}")
+            logger.info(f"PDF конвертирован в {len(image_paths)} изображений: {pdf_path}")
             return image_paths
 
-        except ImportError:
-            logger.error("pdf2image не установлен, невозможно конвертировать PDF в изображения")
-            return []
         except Exception as e:
-            logger.error(f"Ошибка fallback конвертации PDF в изображения {pdf_path}: {e}")
+            logger.error(f"Ошибка конвертации PDF в изображения {pdf_path}: {e}")
             return []
 
     async def images_to_pdf(self, image_paths: List[str], base_name: str) -> Optional[str]:
         """Конвертирует список изображений в PDF"""
-        try:
-            if not image_paths:
-                return None
+        if not image_paths:
+            return None
 
-            # Создаем PDF
-            pdf_path = os.path.join(
-                os.path.dirname(image_paths[0]),
-                f"{base_name}.pdf"
-            )
-
-            # Открываем первое изображение для определения размера
-            with Image.open(image_paths[0]) as first_img:
-                # Конвертируем в RGB если нужно
-                if first_img.mode != 'RGB':
-                    first_img = first_img.convert('RGB')
-
-                # Создаем список изображений
-                images = []
-                for img_path in image_paths:
-                    with Image.open(img_path) as img:
-                        if img.mode != 'RGB':
-                            img = img.convert('RGB')
-                        images.append(img.copy())
-
-                # Сохраняем как PDF
-                first_img.save(pdf_path, 'PDF', save_all=True, append_images=images[1:])
-
-            logger.info(f"Изображения конвертированы в PDF: {pdf_path}")
-            return pdf_path
+        # Создаем PDF
+        pdf_path = os.path.join(
+            os.path.dirname(image_paths[0]),
+            f"{base_name}.pdf"
+        )
 
-        except Exception as e:
-            logger.error(f"Ошибка конвертации изображений в PDF: {e}")
-            return None
+        pages = [Page(image_path) for image_path in image_paths]
+        try:
+            return await self.pages_to_pdf(pages, pdf_path)
+        finally:
+            for page in pages:
+                page.release()
 
     async def optimize_pdf(self, pdf_path: str) -> str:
         """Оптимизирует PDF файл"""
         try:
-            with open(pdf_path, 'rb') as input_file:
-                pdf_reader = PdfReader(input_file)
-                pdf_writer = PdfWriter()
-
-                # Добавляем страницы
-                for page in pdf_reader.pages:
-                    pdf_writer.add_page(page)
+            # Генерируем путь для оптимизированного файла
+            optimized_path = self._get_optimized_pdf_path(pdf_path)
 
-                # Генерируем путь для оптимизированного файла
-                optimized_path = self._get_optimized_pdf_path(pdf_path)
+            # Пересохраняем PDF в пуле процессов
+            await get_cpu_pool().run(
+                OptimizePdfTask(pdf_path, optimized_path))
 
-                # Сохраняем с оптимизацией
-                with open(optimized_path, 'wb') as output_file:
-                    pdf_writer.write(output_file)
-
-                logger.info(f"PDF оптимизирован: {optimized_path}")
-                return optimized_path
+            logger.info(f"PDF оптимизирован: {optimized_path}")
+            return optimized_path
 
         except Exception as e:
             logger.error(f"Ошибка оптимизации PDF {pdf_path}: {e}")
@@ -340,3 +291,100 @@ class PDFConverter:
 
         optimized_filename = f"{name}_optimized{ext}"
         return os.path.join(directory, optimized_filename)
+
+
+class WritePagesPdfTask(CpuTask):
+    """Записывает страницы в PDF в процессе пула"""
+
+    __slots__ = ('pages', 'pdf_path', 'orient_timeout')
+
+    def __init__(self, pages: List[Page], pdf_path: str,
+                 orient_timeout: Optional[float] = None):
+        self.pages = pages
+        self.pdf_path = pdf_path
+        self.orient_timeout = orient_timeout
+
+    def run(self) -> List[Page]:
+        if self.orient_timeout is not None:
+            for page in self.pages:
+                if not page.is_pdf_page:
+                    raise_if_cancelled()
+                    orient_page(page, self.orient_timeout)
+        if all(page.is_pdf_page for page in self.pages):
+            # Страницы PDF копируем как есть, поворот задаем через /Rotate
+            write_pdf_pages(self.pages, self.pdf_path)
+        else:
+            write_raster_pages(self.pages, self.pdf_path)
+        # Обратно уходят поворот и provenance страниц, без пикселей
+        for page in self.pages:
+            page.release()
+        return self.pages
+
+
+class CountPdfPagesTask(CpuTask):
+    """Считает страницы PDF в процессе пула"""
+
+    __slots__ = ('pdf_path',)
+
+    def __init__(self, pdf_path: str):
+        self.pdf_path = pdf_path
+
+    def run(self) -> int:
+        with open(self.pdf_path, 'rb') as pdf_file:
+            return len(PdfReader(pdf_file).pages)
+
+
+class OptimizePdfTask(CpuTask):
+    """Пересохраняет PDF в процессе пула"""
+
+    __slots__ = ('pdf_path', 'optimized_path')
+
+    def __init__(self, pdf_path: str, optimized_path: str):
+        self.pdf_path = pdf_path
+        self.optimized_path = optimized_path
+
+    def run(self) -> str:
+        with open(self.pdf_path, 'rb') as input_file:
+            pdf_reader = PdfReader(input_file)
+            pdf_writer = PdfWriter()
+
+            # Добавляем страницы
+            for page in pdf_reader.pages:
+                pdf_writer.add_page(page)
+
+            # Сохраняем с оптимизацией
+            with open(self.optimized_path, 'wb') as output_file:
+                pdf_writer.write(output_file)
+        return self.optimized_path
+
+
+def write_pdf_pages(pages: List[Page], pdf_path: str):
+    """Копирует страницы исходных PDF без перекодирования"""
+    pdf_writer = PdfWriter()
+
+    with ExitStack() as stack:
+        readers = {}
+        for page in pages:
+            raise_if_cancelled()
+            pdf_reader = readers.get(page.source)
+            if pdf_reader is None:
+                pdf_file = stack.enter_context(open(page.source, 'rb'))
+                pdf_reader = PdfReader(pdf_file)
+                readers[page.source] = pdf_reader
+
+            pdf_page = pdf_writer.add_page(pdf_reader.pages[page.page_index])
+            if page.rotation:
+                pdf_page.rotate(page.rotation)
+
+        with open(pdf_path, 'wb') as output_file:
+            pdf_writer.write(output_file)
+
+
+def write_raster_pages(pages: List[Page], pdf_path: str):
+    """Кодирует страницы-изображения в PDF за один проход"""
+    images = []
+    for page in pages:
+        raise_if_cancelled()
+        images.append(page.render())
+    images[0].save(pdf_path, 'PDF', resolution=300.0,
+                   save_all=True, append_images=images[1:])
@@ -0,0 +1,108 @@
+"""
+Обновление сообщений с прогрессом для DocKitBot
+"""
+
+import asyncio
+import time
+from typing import Any, Optional, Tuple
+
+from loguru import logger
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from config import Config
+
+
+class ProgressReporter:
+    """Редактирует сообщение с прогрессом не чаще заданного интервала.
+
+    Промежуточные состояния схлопываются: отправляется только последнее,
+    одинаковый текст повторно не отправляется. Отправка идет в отдельной
+    задаче, поэтому update не ждет ответа Telegram.
+    """
+
+    def __init__(self, message: Message, interval: Optional[float] = None):
+        self.message = message
+        self.interval = (Config().PROGRESS_UPDATE_INTERVAL
+                         if interval is None else interval)
+        # Последнее еще не отправленное состояние (текст, клавиатура)
+        self._pending: Optional[Tuple[str, Any]] = None
+        # Состояние, которое сейчас показано пользователю
+        self._shown: Optional[Tuple[str, Any]] = None
+        self._last_edit = 0.0
+        # Telegram запретил редактирование до этого момента (RetryAfter)
+        self._retry_at = 0.0
+        self._flushing = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+
+    def update(self, text: str, reply_markup: Any = None):
+        """Запоминает новое состояние, отправка произойдет в фоне"""
+        self._pending = (text, reply_markup)
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_loop())
+
+    async def flush(self):
+        """Немедленно отправляет последнее состояние и дожидается этого"""
+        if self._sender is None or self._sender.done():
+            if self._pending is None:
+                return
+            self._sender = asyncio.create_task(self._send_loop())
+        self._flushing.set()
+        try:
+            await self._sender
+        finally:
+            self._flushing.clear()
+
+    async def finish(self, text: str, reply_markup: Any = None):
+        """Показывает итоговое состояние в обход интервала"""
+        self.update(text, reply_markup)
+        await self.flush()
+
+    def cancel(self):
+        """Отбрасывает неотправленное состояние и останавливает отправку"""
+        self._pending = None
+        if self._sender is not None and not self._sender.done():
+            self._sender.cancel()
+
+    async def _send_loop(self):
+        while self._pending is not None:
+            # Ограничение Telegram соблюдаем всегда, даже при flush
+            retry_delay = self._retry_at - time.monotonic()
+            if retry_delay > 0:
+                await asyncio.sleep(retry_delay)
+
+            throttle_delay = self._last_edit + self.interval - time.monotonic()
+            if throttle_delay > 0 and not self._flushing.is_set():
+                try:
+                    await asyncio.wait_for(
+                        self._flushing.wait(), throttle_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            await self._send_pending()
+
+    async def _send_pending(self):
+        state, self._pending = self._pending, None
+        if state is None or state == self._shown:
+            return
+
+        text, reply_markup = state
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup)
+            self._shown = state
+        except RetryAfter as e:
+            logger.warning(
+                f"Telegram ограничил частоту обновлений, ждем {e.retry_after} с")
+            self._retry_at = time.monotonic() + e.retry_after
+            # Повторим с самым свежим состоянием
+            if self._pending is None:
+                self._pending = state
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                self._shown = state
+            else:
+                logger.warning(f"Не удалось обновить прогресс: {e}")
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс: {e}")
+        finally:
+            self._last_edit = time.monotonic()
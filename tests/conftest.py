@@ -0,0 +1,48 @@
+"""
+Общая настройка тестов DocKitBot
+"""
+
+import importlib.util
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Config требует токен уже при создании
+os.environ.setdefault("TELEGRAM_TOKEN", "test-token")
+
+# Модули импортируют config напрямую, а друг друга - через пакет DocKitBot
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+if importlib.util.find_spec("DocKitBot") is None:
+    spec = importlib.util.spec_from_file_location(
+        "DocKitBot", os.path.join(ROOT, "__init__.py"),
+        submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["DocKitBot"] = package
+    spec.loader.exec_module(package)
+
+
+@pytest.fixture
+def http_server():
+    """Запускает подставной HTTP сервер с заданным обработчиком.
+
+    Возвращает функцию serve(handler_class) -> базовый URL сервера.
+    """
+    servers = []
+
+    def serve(handler_class) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
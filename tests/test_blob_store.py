@@ -0,0 +1,169 @@
+"""
+Тесты BlobStore: копии вместо ссылок, проверка хэша, запись манифеста,
+однократное чтение файлов
+"""
+
+import asyncio
+import json
+import os
+
+from DocKitBot import blob_store as blob_store_module
+from DocKitBot import document_processor as document_processor_module
+from DocKitBot.blob_store import BlobStore, digest_file
+from DocKitBot.document_processor import PROCESSED_STEP, DocumentProcessor
+
+
+def make_store(tmp_path, interval=3600.0) -> BlobStore:
+    store = BlobStore(str(tmp_path / "blobs"))
+    store.config.BLOB_STORE_SAVE_INTERVAL = interval
+    return store
+
+
+def read_manifest(store):
+    with open(store._manifest_path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def test_put_stores_a_copy(tmp_path):
+    store = make_store(tmp_path)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"original")
+
+    digest = store.put(str(source), "job-1")
+    # Исходник переписан на месте: хранилище это не затрагивает
+    with open(source, "r+b") as file:
+        file.write(b"modified")
+
+    assert not os.path.samefile(source, store.blob_path(digest))
+    target = tmp_path / "target.pdf"
+    assert store.checkout(digest, str(target), "job-2")
+    assert target.read_bytes() == b"original"
+
+
+def test_checkout_drops_corrupted_blob(tmp_path):
+    store = make_store(tmp_path)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"original")
+    digest = store.put(str(source))
+    derived_source = tmp_path / "derived.pdf"
+    derived_source.write_bytes(b"derived")
+    store.put_derived(digest, PROCESSED_STEP, str(derived_source))
+
+    first = tmp_path / "first.pdf"
+    assert store.checkout(digest, str(first))
+    # Выданная жесткая ссылка переписана на месте
+    with open(first, "r+b") as file:
+        file.write(b"tampered")
+
+    assert not store.checkout(digest, str(tmp_path / "second.pdf"))
+    assert not os.path.exists(store.blob_path(digest))
+    assert store.get_derived(digest, PROCESSED_STEP) is None
+
+
+def count_reads(monkeypatch):
+    """Считает полные чтения файлов хранилищем"""
+    reads = []
+    original_digest = blob_store_module.digest_file
+    original_copy = blob_store_module.copy_with_digest
+
+    def digest_file_counted(file_path):
+        reads.append(file_path)
+        return original_digest(file_path)
+
+    def copy_counted(source_path, target_path):
+        reads.append(source_path)
+        return original_copy(source_path, target_path)
+
+    monkeypatch.setattr(blob_store_module, "digest_file", digest_file_counted)
+    monkeypatch.setattr(blob_store_module, "copy_with_digest", copy_counted)
+    return reads
+
+
+def test_files_are_read_once(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    reads = count_reads(monkeypatch)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"original")
+
+    digest = store.put(str(source), "job-1")
+    assert reads == [str(source)]
+
+    # Хэш, посчитанный при приеме, избавляет от чтения известного файла
+    assert store.put(str(source), "job-2", digest) == digest
+    # Нетронутый файл выдается без пересчета хэша
+    for index in range(3):
+        assert store.checkout(digest, str(tmp_path / f"out{index}.pdf"))
+    assert reads == [str(source)]
+
+
+def test_blob_without_recorded_mtime_is_verified_once(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"original")
+    digest = store.put(str(source))
+    # Запись манифеста прежней версии: времени изменения в ней нет
+    del store._manifest["blobs"][digest]["mtime"]
+    reads = count_reads(monkeypatch)
+
+    assert store.checkout(digest, str(tmp_path / "first.pdf"))
+    assert store.checkout(digest, str(tmp_path / "second.pdf"))
+    assert reads == [store.blob_path(digest)]
+
+
+def test_manifest_writes_are_batched(tmp_path):
+    store = make_store(tmp_path)
+    for index in range(20):
+        source = tmp_path / f"file{index}.pdf"
+        source.write_bytes(f"content {index}".encode())
+        store.put(str(source), f"job-{index}")
+
+    # Первая запись сразу, остальные ждут интервала
+    assert len(read_manifest(store)["blobs"]) == 1
+    store.flush()
+    assert len(read_manifest(store)["blobs"]) == 20
+
+
+def test_gc_flushes_and_unsaved_blobs_are_collected(tmp_path):
+    store = make_store(tmp_path)
+    source = tmp_path / "saved.pdf"
+    source.write_bytes(b"saved")
+    store.put(str(source), "job")
+    lost = tmp_path / "lost.pdf"
+    lost.write_bytes(b"lost")
+    lost_digest = store.put(str(lost), "job")
+
+    # Перезапуск без сохранения манифеста: второй файл есть только на диске
+    restarted = make_store(tmp_path)
+    assert restarted.blob_size(lost_digest) == len(b"lost")
+    restarted.gc(retention=0)
+    assert not os.path.exists(restarted.blob_path(lost_digest))
+    assert lost_digest not in read_manifest(restarted)["blobs"]
+
+
+def test_result_without_ocr_is_not_stored(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    monkeypatch.setattr(blob_store_module, "_shared_store", store)
+    monkeypatch.setattr(document_processor_module, "get_blob_store",
+                        lambda: store)
+    processor = DocumentProcessor()
+    source = tmp_path / "scan.jpg"
+    source.write_bytes(b"jpeg")
+    result = tmp_path / "scan.pdf"
+    result.write_bytes(b"pdf")
+    complete = False
+
+    async def process_file(record, workspace=None, outcome=None,
+                           output_path=None):
+        outcome["complete"] = complete
+        return str(result)
+
+    processor._process_file = process_file
+    record = processor.file_handler.create_record(str(source))
+
+    asyncio.run(processor._process_file_stored(record))
+    digest = digest_file(str(source))
+    assert store.get_derived(digest, PROCESSED_STEP) is None
+
+    complete = True
+    asyncio.run(processor._process_file_stored(record))
+    assert store.get_derived(digest, PROCESSED_STEP) == digest_file(str(result))
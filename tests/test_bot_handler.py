@@ -0,0 +1,86 @@
+"""
+Тесты BotHandler: защита файлов сессий и заданий от очистки диска
+"""
+
+import asyncio
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from DocKitBot import bot_handler as bot_handler_module
+from DocKitBot.bot_handler import BotHandler
+from DocKitBot.job_scheduler import Job
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    handler = BotHandler()
+    handler.config.SPECULATIVE_PROCESSING = False
+    handler.config.DUPLICATE_DETECTION = False
+    return handler
+
+
+def upload(handler, user_id, name):
+    user_dir = os.path.join(handler.config.TEMP_DIR, str(user_id))
+    os.makedirs(user_dir, exist_ok=True)
+    file_path = os.path.join(user_dir, name)
+    with open(file_path, "wb") as file:
+        file.write(b"%PDF-1.4")
+    session = handler._get_user_session(user_id)
+    return asyncio.run(handler._register_files(session, [file_path]))[0]
+
+
+def test_idle_sessions_expire_with_their_files(handler):
+    stale = upload(handler, 1, "old.pdf")
+    fresh = upload(handler, 2, "new.pdf")
+    handler.user_sessions[1]["last_activity"] = (
+        time.monotonic() - handler.config.SESSION_IDLE_TIMEOUT - 1)
+
+    assert handler.expire_idle_sessions() == 1
+
+    assert 1 not in handler.user_sessions
+    assert not os.path.exists(stale.path)
+    protected = handler.paths_in_use()
+    assert stale.path not in protected
+    assert fresh.path in protected
+
+
+def test_session_collecting_album_does_not_expire(handler):
+    upload(handler, 1, "old.pdf")
+    handler.user_sessions[1]["last_activity"] = 0.0
+    handler._media_groups[(1, "album")] = {
+        "update": None, "photos": [], "last_seen": time.monotonic()}
+
+    assert handler.expire_idle_sessions() == 0
+    assert 1 in handler.user_sessions
+
+
+def test_job_inputs_stay_protected_while_adopted(handler, monkeypatch):
+    record = upload(handler, 1, "doc.pdf")
+    session = handler.user_sessions[1]
+    files, speculative = handler._detach_session_files(session)
+    job = Job(1, len(files), None)
+    handler._queued_inputs[job.job_id] = (files, speculative)
+    seen_during_adopt = []
+    original_adopt = bot_handler_module.JobWorkspace.adopt
+
+    def adopt(workspace, file_paths):
+        seen_during_adopt.append(record.path in handler.paths_in_use())
+        return original_adopt(workspace, file_paths)
+
+    async def process(files, *args, **kwargs):
+        return {"success": False, "error": "test"}
+
+    monkeypatch.setattr(bot_handler_module.JobWorkspace, "adopt", adopt)
+    monkeypatch.setattr(handler, "_process_files_with_progress", process)
+    progress_message = mock.AsyncMock()
+
+    asyncio.run(handler._run_processing_job(
+        None, job, files, progress_message, {}, speculative))
+
+    assert seen_during_adopt == [True]
+    assert job.job_id not in handler._queued_inputs
+    assert job.job_id not in handler._workspaces
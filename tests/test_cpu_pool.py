@@ -0,0 +1,78 @@
+"""
+Тесты CpuPool: отмена задания останавливает его задачи в пуле процессов
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from DocKitBot.cpu_pool import (CancelToken, CpuPool, CpuTask, TaskCancelled,
+                                _run_task, raise_if_cancelled)
+from DocKitBot.job_scheduler import JOB_CANCELLED, JobScheduler
+
+
+class SlowPagesTask(CpuTask):
+    """Обрабатывает страницы по pause секунд каждая"""
+
+    __slots__ = ('pages', 'pause')
+
+    def __init__(self, pages: int, pause: float):
+        self.pages = pages
+        self.pause = pause
+
+    def run(self) -> int:
+        for _ in range(self.pages):
+            raise_if_cancelled()
+            time.sleep(self.pause)
+        return self.pages
+
+
+def test_cpu_task_requires_run():
+    class Incomplete(CpuTask):
+        __slots__ = ()
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_task_stops_when_token_is_cancelled():
+    token = CancelToken()
+    try:
+        assert _run_task(SlowPagesTask(2, 0), token.path) == 2
+        token.cancel()
+        with pytest.raises(TaskCancelled):
+            _run_task(SlowPagesTask(2, 0), token.path)
+    finally:
+        token.close()
+    assert not token.cancelled
+
+
+def test_cancelled_job_frees_the_pool_worker():
+    # fork: процесс пула наследует модули теста вместе с пакетом DocKitBot
+    pool = CpuPool(max_workers=1)
+    pool.config.CPU_POOL_START_METHOD = "fork"
+    scheduler = JobScheduler()
+    # 100 страниц по 0.05 с: без проверки флага задача заняла бы пул на 5 с
+    slow = SlowPagesTask(100, 0.05)
+
+    async def scenario():
+        # Процесс пула запускается заранее, чтобы не мерить его старт
+        await pool.run(SlowPagesTask(1, 0))
+        job = scheduler.submit(1, 1, lambda: pool.run(slow))
+        await asyncio.sleep(0.3)
+        scheduler.cancel(job.job_id)
+        await asyncio.wait([job.task])
+
+        started = time.monotonic()
+        assert await pool.run(SlowPagesTask(1, 0)) == 1
+        return job, time.monotonic() - started
+
+    try:
+        job, waited = asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+
+    assert job.status == JOB_CANCELLED
+    assert waited < 1.0
+    assert not job.cancel_token.cancelled
@@ -0,0 +1,135 @@
+"""
+Тесты DocumentProcessor: предобработка и размещение результатов
+"""
+
+import asyncio
+import os
+
+import pytest
+from PIL import Image
+
+from DocKitBot import blob_store as blob_store_module
+from DocKitBot import cpu_pool as cpu_pool_module
+from DocKitBot import workspace as workspace_module
+from DocKitBot.cpu_pool import CpuPool
+from DocKitBot.document_processor import DocumentProcessor
+from DocKitBot.file_handler import FileHandler
+from DocKitBot.workspace import JobWorkspace, RamBudget
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    """Процессор с пулом и хранилищем в каталоге теста"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("WORKSPACE_RAM_DIR", str(tmp_path / "shm"))
+    monkeypatch.setattr(workspace_module, "_shared_budget",
+                        RamBudget(64 * 1024 * 1024))
+    monkeypatch.setattr(blob_store_module, "_shared_store", None)
+    # fork: процесс пула наследует пакет DocKitBot, загруженный conftest
+    pool = CpuPool(max_workers=1)
+    pool.config.CPU_POOL_START_METHOD = "fork"
+    monkeypatch.setattr(cpu_pool_module, "_shared_pool", pool)
+    yield DocumentProcessor()
+    pool.shutdown()
+
+
+def upload(name, data=None) -> str:
+    """Файл пользователя 1 в temp/1; без data - изображение страницы"""
+    os.makedirs(os.path.join("temp", "1"), exist_ok=True)
+    file_path = os.path.join("temp", "1", name)
+    if data is None:
+        Image.new("RGB", (120, 160), "white").save(file_path)
+    else:
+        with open(file_path, "wb") as file:
+            file.write(data)
+    return file_path
+
+
+def test_speculation_does_not_touch_uploads(processor):
+    uploaded_pdf = upload("Договор.pdf", b"%PDF-1.4 uploaded")
+    image = upload("Договор.jpg")
+    record = FileHandler().create_record(image)
+
+    async def scenario():
+        speculation = processor.speculate(record, 1, asyncio.Semaphore(1))
+        await asyncio.wait([speculation.task])
+        return speculation, await speculation.claim()
+
+    speculation, result = asyncio.run(scenario())
+    processed_file = result["processed_file"]
+
+    assert result["success"]
+    assert os.path.basename(processed_file) == "Договор.pdf"
+    # Результат лежит в каталоге предобработки, а не рядом с загрузкой
+    assert speculation.workspace._owns(processed_file)
+    with open(uploaded_pdf, "rb") as file:
+        assert file.read() == b"%PDF-1.4 uploaded"
+
+    speculation.discard()
+
+    assert not os.path.exists(processed_file)
+    assert os.path.exists(uploaded_pdf)
+    assert os.path.exists(image)
+
+
+def test_inventory_lists_documents_too_large_to_send(processor):
+    handler = FileHandler()
+    records = [handler.create_record(upload(name, b"%PDF-1.4"))
+               for name in ("Иск.pdf", "Приложение.pdf")]
+
+    inventory = processor._create_inventory(
+        records, archives=[{"path": "a.zip", "files": [records[0].path]}],
+        oversized=[records[1].path])
+
+    listed, not_sent = inventory.split("🚫")
+    assert "1. Иск.pdf" in listed and "Приложение" not in listed
+    assert "• Приложение.pdf" in not_sent
+
+
+def test_same_stem_uploads_get_their_own_results(processor):
+    handler = FileHandler()
+    uploaded_pdf = upload("Договор.pdf", b"%PDF-1.4 uploaded")
+    records = [handler.create_record(upload(name))
+               for name in ("Договор.jpg", "Договор.png")]
+    workspace = JobWorkspace(1, "job")
+    adopted = workspace.adopt([uploaded_pdf] + [r.path for r in records])
+    records = [record.with_path(adopted[record.path]) for record in records]
+
+    async def scenario():
+        return await asyncio.gather(*(
+            processor._process_file_isolated(record, "job", workspace)
+            for record in records))
+
+    try:
+        results = asyncio.run(scenario())
+        processed = [result["processed_file"] for result in results]
+
+        assert all(result["success"] for result in results)
+        # Ни один результат не занял имя загруженного PDF и имя соседа
+        assert sorted(os.path.basename(path) for path in processed) == [
+            "Договор (2).pdf", "Договор (3).pdf"]
+        for path in processed:
+            with open(path, "rb") as file:
+                assert file.read(5) == b"%PDF-"
+        with open(adopted[uploaded_pdf], "rb") as file:
+            assert file.read() == b"%PDF-1.4 uploaded"
+    finally:
+        workspace.cleanup()
+
+
+def test_processing_takes_names_from_the_record(processor, monkeypatch):
+    record = FileHandler().create_record(upload("Скан стр 1.jpg"))
+
+    def parsed_again(*args):
+        raise AssertionError("имя файла разбирается повторно")
+
+    monkeypatch.setattr(processor.file_handler, "get_file_info", parsed_again)
+    monkeypatch.setattr(
+        processor.file_handler, "validate_file_name", parsed_again)
+    monkeypatch.setattr(processor.pdf_converter, "_get_pdf_name", parsed_again)
+
+    result = asyncio.run(processor._process_file_isolated(record))
+
+    assert result["success"]
+    assert os.path.basename(result["processed_file"]) == "Скан стр 1.pdf"
+    assert result["warnings"] == record.name_validation["warnings"]
@@ -0,0 +1,176 @@
+"""
+Тесты DownloadManager на подставном HTTP сервере: повторы и докачка
+"""
+
+import asyncio
+import os
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from DocKitBot.download_manager import DownloadError, DownloadManager
+
+CONTENT = bytes(range(256)) * 4096  # 1MB
+CUT = len(CONTENT) // 3
+
+
+def make_handler(support_range: bool = True, fail_first: bool = True,
+                 status: int = 200):
+    """Сервер файла CONTENT: первый ответ обрывается после CUT байт"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        requests = []
+
+        def do_GET(self):
+            range_header = self.headers.get("Range")
+            Handler.requests.append(range_header)
+            if status != 200:
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            offset = 0
+            if range_header and support_range:
+                offset = int(range_header.split("=")[1].rstrip("-"))
+                if offset >= len(CONTENT):
+                    self.send_response(416)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range",
+                    f"bytes {offset}-{len(CONTENT) - 1}/{len(CONTENT)}")
+            else:
+                self.send_response(200)
+            body = CONTENT[offset:]
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+
+            if fail_first and len(Handler.requests) == 1:
+                # Обрыв соединения посреди ответа
+                self.wfile.write(body[:CUT])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def make_manager() -> DownloadManager:
+    manager = DownloadManager()
+    manager.config.DOWNLOAD_BACKOFF_BASE = 0.01
+    manager.config.DOWNLOAD_BACKOFF_MAX = 0.01
+    manager.config.DOWNLOAD_MAX_ATTEMPTS = 3
+    return manager
+
+
+def resume_offset(handler) -> int:
+    """Смещение, с которого клиент продолжил скачивание"""
+    assert len(handler.requests) == 2 and handler.requests[0] is None
+    offset = int(handler.requests[1].split("=")[1].rstrip("-"))
+    # Недописанный кусок DOWNLOAD_CHUNK_SIZE после обрыва скачивается заново
+    assert 0 < offset <= CUT
+    return offset
+
+
+async def download(manager, url, file_path):
+    try:
+        return await manager.download(url, file_path, user_id=1)
+    finally:
+        await manager.close()
+
+
+async def download_to_memory(manager, url):
+    try:
+        return await manager.download_to_memory(url, user_id=1)
+    finally:
+        await manager.close()
+
+
+def test_resumes_interrupted_download_with_range(http_server, tmp_path):
+    handler = make_handler()
+    url = http_server(handler) + "/file"
+    file_path = str(tmp_path / "file.bin")
+
+    stats = asyncio.run(download(make_manager(), url, file_path))
+
+    with open(file_path, "rb") as file:
+        assert file.read() == CONTENT
+    offset = resume_offset(handler)
+    assert stats.attempts == 2
+    assert stats.bytes == len(CONTENT)
+    assert stats.resumed_bytes == len(CONTENT) - offset
+    assert not os.path.exists(file_path + ".part")
+
+
+def test_restarts_when_server_ignores_range(http_server, tmp_path):
+    handler = make_handler(support_range=False)
+    url = http_server(handler) + "/file"
+    file_path = str(tmp_path / "file.bin")
+
+    stats = asyncio.run(download(make_manager(), url, file_path))
+
+    with open(file_path, "rb") as file:
+        assert file.read() == CONTENT
+    resume_offset(handler)
+    assert stats.resumed_bytes == 0
+
+
+def test_resumes_download_to_memory(http_server):
+    handler = make_handler()
+    url = http_server(handler) + "/file"
+
+    data, stats = asyncio.run(download_to_memory(make_manager(), url))
+
+    assert bytes(data) == CONTENT
+    assert stats.resumed_bytes == len(CONTENT) - resume_offset(handler)
+
+
+def test_client_error_is_not_retried(http_server, tmp_path):
+    handler = make_handler(status=404)
+    url = http_server(handler) + "/file"
+    file_path = str(tmp_path / "file.bin")
+
+    with pytest.raises(DownloadError) as error:
+        asyncio.run(download(make_manager(), url, file_path))
+
+    assert not error.value.retryable
+    assert len(handler.requests) == 1
+    assert not os.path.exists(file_path)
+    assert not os.path.exists(file_path + ".part")
+
+
+def test_server_error_is_retried_until_limit(http_server, tmp_path):
+    handler = make_handler(status=503)
+    url = http_server(handler) + "/file"
+
+    with pytest.raises(DownloadError):
+        asyncio.run(download(make_manager(), url, str(tmp_path / "file.bin")))
+
+    assert len(handler.requests) == 3
+
+
+def test_user_slots_are_released_after_downloads(http_server, tmp_path):
+    handler = make_handler(fail_first=False)
+    url = http_server(handler) + "/file"
+    manager = make_manager()
+
+    async def scenario():
+        try:
+            await asyncio.gather(*(
+                manager.download(url, str(tmp_path / f"{user_id}-{i}.bin"),
+                                 user_id)
+                for user_id in range(3) for i in range(3)))
+        finally:
+            await manager.close()
+
+    asyncio.run(scenario())
+    assert not manager._user_slots
+    assert not manager._user_waiters
@@ -0,0 +1,158 @@
+"""
+Тесты распаковки архивов и поиска дубликатов FileHandler
+"""
+
+import asyncio
+import io
+import os
+import random
+import zipfile
+
+import pytest
+from PIL import Image, ImageDraw
+
+from DocKitBot.file_handler import ArchiveLimitError, FileHandler
+
+
+def make_archive(members) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def extract(handler, archive, max_bytes=10 * 1024 * 1024):
+    return asyncio.run(handler.extract_archive(
+        archive, user_id=1, max_bytes=max_bytes))
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return FileHandler()
+
+
+def test_extraction_does_not_touch_existing_files(handler, tmp_path):
+    # Файл сессии из прошлого архива с тем же именем и ссылкой на него
+    first = extract(handler, make_archive([("Иск.pdf", b"first")]))
+    link = tmp_path / "linked.pdf"
+    os.link(first[0], link)
+
+    second = extract(handler, make_archive([("Иск.pdf", b"second")]))
+
+    assert os.path.basename(second[0]) == "Иск.pdf"
+    assert second[0] != first[0]
+    assert link.read_bytes() == b"first"
+    assert open(second[0], "rb").read() == b"second"
+
+
+def test_names_fixed_to_the_same_file_get_unique_paths(handler):
+    members = [
+        ("Договор.pdf", b"utf-8 name"),
+        # То же имя в UTF-8 без флага: zipfile читает его как cp437
+        ("Договор.pdf".encode("utf-8").decode("cp437"), b"mojibake name"),
+    ]
+    archive = make_archive(members)
+    with zipfile.ZipFile(archive) as check:
+        assert len(check.namelist()) == 2
+
+    paths = extract(handler, archive)
+
+    assert sorted(os.path.basename(path) for path in paths) == [
+        "Договор (2).pdf", "Договор.pdf"]
+    assert sorted(open(path, "rb").read() for path in paths) == [
+        b"mojibake name", b"utf-8 name"]
+    assert not [path for path in paths if path.endswith(".part")]
+
+
+def test_oversized_member_leaves_no_files(handler, tmp_path):
+    archive = make_archive([("Иск.pdf", b"x" * 1000)])
+
+    with pytest.raises(ArchiveLimitError):
+        extract(handler, archive, max_bytes=100)
+
+    leftovers = [name for _, _, names in os.walk(tmp_path / "temp")
+                 for name in names]
+    assert not leftovers
+
+
+def make_page(path, seed, quality=90):
+    """Страница с общей версткой: заголовок, три абзаца случайного
+    «текста» и подпись"""
+    rng = random.Random(seed)
+    image = Image.new("L", (600, 850), 255)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((200, 60, 400, 80), fill=0)
+    for top in (140, 400, 620):
+        for y in range(top, top + 200, 4):
+            for x in range(70, 530, 2):
+                if rng.random() < 0.5:
+                    draw.point((x, y), fill=0)
+    draw.rectangle((380, 780, 520, 800), fill=0)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path, quality=quality)
+    return str(path)
+
+
+def fingerprinted(handler, paths):
+    records = [handler.create_record(path) for path in paths]
+    for record in records:
+        asyncio.run(handler.fingerprint_record(record))
+    return records
+
+
+def test_pages_with_the_same_layout_are_not_duplicates(handler, tmp_path):
+    paths = [make_page(tmp_path / f"Дело стр {page}.jpg", seed=page)
+             for page in range(1, 5)]
+    records = fingerprinted(handler, paths)
+    # Хэши разных страниц близки: прежний порог в 24 бита их склеивал
+    distances = [(a.image_hash ^ b.image_hash).bit_count()
+                 for a in records for b in records if a is not b]
+    assert max(distances) <= 24
+
+    duplicates, similar = handler.find_duplicates(records)
+
+    assert duplicates == {}
+    assert similar == {}
+
+
+def test_only_identical_file_for_the_same_page_is_dropped(handler, tmp_path):
+    original = make_page(tmp_path / "a" / "Дело стр 1.jpg", seed=1)
+    copy = tmp_path / "b" / "Дело стр 1.jpg"
+    copy.parent.mkdir()
+    copy.write_bytes(open(original, "rb").read())
+    # Тот же снимок, пересжатый мессенджером
+    rescan = make_page(tmp_path / "c" / "Дело стр 1.jpg", seed=1, quality=60)
+    # Те же байты под номером другой страницы
+    other_page = tmp_path / "Дело стр 2.jpg"
+    other_page.write_bytes(open(original, "rb").read())
+
+    records = fingerprinted(
+        handler, [original, str(copy), rescan, str(other_page)])
+    duplicates, similar = handler.find_duplicates(records)
+
+    assert duplicates == {records[1]: records[0]}
+    assert similar == {records[2]: records[0], records[3]: records[0]}
+
+
+def test_document_over_upload_limit_is_left_out(handler, tmp_path):
+    handler.config.MAX_UPLOAD_SIZE = 10_000
+    handler.config.ARCHIVE_PART_MARGIN = 1_000
+    small = tmp_path / "Иск.pdf"
+    small.write_bytes(b"x" * 1_000)
+    large = tmp_path / "Приложение.pdf"
+    large.write_bytes(b"x" * 20_000)
+    oversized = []
+
+    archives = handler.create_archives(
+        [str(small), str(large)], user_id=1, oversized=oversized)
+
+    assert oversized == [str(large)]
+    assert [archive["files"] for archive in archives] == [[str(small)]]
+    with zipfile.ZipFile(archives[0]["path"]) as archive:
+        assert archive.namelist() == ["Иск.pdf"]
+
+    # Единственный документ больше лимита: отправлять нечего
+    assert handler.create_archives([str(large)], user_id=1) == []
@@ -0,0 +1,62 @@
+"""
+Регрессионный корпус исправления кодировки имен файлов
+"""
+
+import os
+
+import pytest
+
+from DocKitBot.filename_encoding import (contains_mojibake,
+                                         fix_filename_encoding,
+                                         try_decode_with_encodings)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+CORPUS_PATH = os.path.join(DATA_DIR, "filename_corpus.txt")
+PARTIAL_CORPUS_PATH = os.path.join(DATA_DIR, "filename_partial_corpus.txt")
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as file:
+        return [line.strip() for line in file
+                if line.strip() and not line.startswith("#")]
+
+
+def to_mojibake(name: str) -> str:
+    """Имя, каким его видит zipfile в архиве без флага UTF-8"""
+    return name.encode("utf-8").decode("cp437")
+
+
+CORPUS = load_corpus()
+PARTIAL_CORPUS = [tuple(line.split("\t"))
+                  for line in load_corpus(PARTIAL_CORPUS_PATH)]
+
+
+@pytest.mark.parametrize("name", CORPUS)
+def test_corpus_names_are_restored(name):
+    mojibake = to_mojibake(name)
+    assert contains_mojibake(mojibake)
+    assert fix_filename_encoding(mojibake) == name
+
+
+@pytest.mark.parametrize("name", CORPUS)
+def test_correct_names_are_untouched(name):
+    assert fix_filename_encoding(name) == name
+
+
+@pytest.mark.parametrize("mojibake, expected", [
+    # Часть имени уже исправлена другим инструментом
+    ("Водительс╨║╨╛╨╡ удостоверение.jpg", "Водительское удостоверение.jpg"),
+    ("╨ó╤Ç╨░╨╜с╨┐╤Çот╨╜╨░╤Å накладная.pdf", "Транспортная накладная.pdf"),
+    # Замена для "Ответч" не должна терять букву
+    ("╨₧╤é╨▓╨╡╤é╤çик.pdf", "Ответчик.pdf"),
+])
+def test_partially_fixed_names_use_replacements(mojibake, expected):
+    assert fix_filename_encoding(mojibake) == expected
+
+
+
+@pytest.mark.parametrize("mojibake, expected", PARTIAL_CORPUS)
+def test_partial_corpus_is_restored_by_replacements(mojibake, expected):
+    # Кириллица рядом с кракозябрами: декодирование целиком не помогает
+    assert try_decode_with_encodings(mojibake) == mojibake
+    assert fix_filename_encoding(mojibake) == expected
@@ -0,0 +1,180 @@
+"""
+Тесты сборки приложения в main.py с подставным сервером Bot API
+"""
+
+import asyncio
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+from telegram import Document
+
+from DocKitBot import file_cache
+from DocKitBot.main import DocKitBot
+from DocKitBot.update_processor import UserOrderedUpdateProcessor
+
+TOKEN = "123:test"
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "DocKitBot",
+            "username": "dockit_test_bot"}
+
+
+def make_bot_api(results):
+    """Подставной сервер Bot API: отвечает results[метод] и пишет журнал"""
+
+    class Handler(BaseHTTPRequestHandler):
+        calls = []
+
+        def do_POST(self):
+            method = self.path.rsplit("/", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(body or b"{}")
+            else:
+                params = {key: values[0] for key, values in
+                          parse_qs(body.decode()).items()}
+            Handler.calls.append((self.path, method, params))
+
+            answer = json.dumps({"ok": True, "result": results.get(method, True)})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(answer)))
+            self.end_headers()
+            self.wfile.write(answer.encode())
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def local_bot_api(http_server, monkeypatch, tmp_path):
+    """Окружение бота, работающего с локальным сервером Bot API"""
+
+    def start(results=None, **env):
+        handler = make_bot_api(dict(results or {}, getMe=BOT_USER))
+        url = http_server(handler)
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv("TELEGRAM_TOKEN", TOKEN)
+        monkeypatch.setenv("TELEGRAM_API_URL", f"{url}/bot")
+        monkeypatch.setenv("TELEGRAM_LOCAL_MODE", "true")
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        # Кэш файлов создается в рабочем каталоге теста
+        monkeypatch.setattr(file_cache, "_shared_cache", None)
+        return url, handler
+
+    return start
+
+
+def test_build_application_uses_local_bot_api(local_bot_api):
+    url, handler = local_bot_api()
+    bot = DocKitBot()
+    application = bot.build_application()
+
+    assert application.bot.base_url == f"{url}/bot{TOKEN}"
+    assert application.bot.base_file_url == f"{url}/file/bot{TOKEN}"
+    assert application.bot.local_mode
+    assert isinstance(application.update_processor,
+                      UserOrderedUpdateProcessor)
+    assert bot.config.MAX_DOWNLOAD_SIZE == bot.config.MAX_FILE_SIZE
+
+    async def scenario():
+        await application.initialize()
+        await application.shutdown()
+
+    asyncio.run(scenario())
+    assert (f"/bot{TOKEN}/getMe", "getMe", {}) in handler.calls
+    assert application.bot.username == BOT_USER["username"]
+
+
+def test_local_mode_links_file_from_bot_api_disk(local_bot_api, tmp_path):
+    # Локальный сервер Bot API отдает абсолютный путь к уже скачанному файлу
+    server_file = tmp_path / "bot-api" / "documents" / "file_0.pdf"
+    server_file.parent.mkdir(parents=True)
+    server_file.write_bytes(b"%PDF-1.4 test")
+    _, handler = local_bot_api(results={"getFile": {
+        "file_id": "doc", "file_unique_id": "unique-doc",
+        "file_size": server_file.stat().st_size,
+        "file_path": str(server_file)}})
+    bot = DocKitBot()
+    application = bot.build_application()
+    document = Document("doc", "unique-doc", file_name="Иск.pdf",
+                        file_size=server_file.stat().st_size)
+    document.set_bot(application.bot)
+
+    async def scenario():
+        async with application:
+            return await bot.bot_handler.file_handler.download_file(
+                document, user_id=1)
+
+    file_path = asyncio.run(scenario())
+
+    assert os.path.basename(file_path) == "Иск.pdf"
+    # Файл не скачивался по сети, а связан с файлом сервера Bot API
+    assert os.path.samefile(file_path, server_file)
+    assert [method for _, method, _ in handler.calls] == ["getMe", "getFile"]
+
+
+def test_webhook_receives_updates(local_bot_api):
+    # Webhook сервер python-telegram-bot устанавливается с [webhooks]
+    pytest.importorskip("tornado")
+
+    # Свободный порт для webhook сервера бота
+    probe = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    port = probe.server_address[1]
+    probe.server_close()
+
+    _, handler = local_bot_api(
+        BOT_MODE="webhook", WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(port), WEBHOOK_PATH="hook",
+        WEBHOOK_URL="https://bot.example.com/hook",
+        WEBHOOK_SECRET_TOKEN="secret")
+    bot = DocKitBot()
+    received = []
+
+    async def handle_status(update, context):
+        received.append(update.effective_user.id)
+
+    bot.bot_handler.handle_status = handle_status
+    application = bot.build_application()
+    config = bot.config
+    update = {
+        "update_id": 1,
+        "message": {
+            "message_id": 1, "date": 0, "text": "/status",
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": 7}],
+        },
+    }
+
+    async def scenario():
+        async with application:
+            await application.updater.start_webhook(
+                listen=config.WEBHOOK_LISTEN, port=config.WEBHOOK_PORT,
+                url_path=config.WEBHOOK_PATH, webhook_url=config.WEBHOOK_URL,
+                secret_token=config.WEBHOOK_SECRET_TOKEN)
+            await application.start()
+            async with httpx.AsyncClient() as client:
+                base = f"http://127.0.0.1:{port}/{config.WEBHOOK_PATH}"
+                rejected = await client.post(base, json=update)
+                accepted = await client.post(base, json=update, headers={
+                    "X-Telegram-Bot-Api-Secret-Token": "secret"})
+            for _ in range(100):
+                if received:
+                    break
+                await asyncio.sleep(0.01)
+            await application.updater.stop()
+            await application.stop()
+        return rejected.status_code, accepted.status_code
+
+    assert asyncio.run(scenario()) == (403, 200)
+    assert received == [42]
+    webhook_calls = [params for _, method, params in handler.calls
+                     if method == "setWebhook"]
+    assert webhook_calls[0]["url"] == config.WEBHOOK_URL
+    assert webhook_calls[0]["secret_token"] == "secret"
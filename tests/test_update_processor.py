@@ -0,0 +1,181 @@
+"""
+Тесты UserOrderedUpdateProcessor: очередность и параллельность обновлений
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, ContextTypes
+
+from config import Config
+from DocKitBot.bot_handler import BotHandler
+from DocKitBot.update_processor import UserOrderedUpdateProcessor
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    """Текстовое сообщение от пользователя user_id"""
+    user = User(user_id, f"user{user_id}", False)
+    message = Message(update_id, datetime.now(), Chat(user_id, Chat.PRIVATE),
+                      from_user=user, text="/status")
+    return Update(update_id, message=message)
+
+
+async def run_updates(processor, updates, handler):
+    """Передает обновления процессору так же, как Application"""
+    await asyncio.gather(*(
+        processor.process_update(update, handler(update))
+        for update in updates))
+
+
+def test_same_user_updates_run_in_order():
+    async def scenario():
+        processor = UserOrderedUpdateProcessor(max_concurrent_updates=8)
+        order = []
+        running = 0
+        overlap = False
+
+        async def handler(update):
+            nonlocal running, overlap
+            running += 1
+            overlap = overlap or running > 1
+            # Ранние обновления работают дольше поздних
+            await asyncio.sleep(0.01 * (10 - update.update_id))
+            order.append(update.update_id)
+            running -= 1
+
+        await run_updates(processor,
+                          [make_update(i, 1) for i in range(10)], handler)
+        assert order == list(range(10))
+        assert not overlap
+        # Блокировки пользователя не накапливаются
+        assert not processor._user_locks
+        assert not processor._user_waiters
+
+    asyncio.run(scenario())
+
+
+def test_different_users_run_in_parallel():
+    async def scenario():
+        processor = UserOrderedUpdateProcessor(max_concurrent_updates=8)
+        started = asyncio.Event()
+        both_running = asyncio.Event()
+        running = set()
+
+        async def handler(update):
+            running.add(update.effective_user.id)
+            if len(running) == 2:
+                both_running.set()
+            started.set()
+            # Обновление первого пользователя ждет второго: при
+            # последовательной обработке здесь был бы таймаут
+            await asyncio.wait_for(both_running.wait(), 1)
+
+        await run_updates(processor,
+                          [make_update(1, 1), make_update(2, 2)], handler)
+        assert both_running.is_set()
+
+    asyncio.run(scenario())
+
+
+def test_slow_user_does_not_block_others():
+    async def scenario():
+        processor = UserOrderedUpdateProcessor(max_concurrent_updates=2)
+        release = asyncio.Event()
+        finished = []
+
+        async def handler(update):
+            if update.effective_user.id == 1:
+                await release.wait()
+            finished.append(update.update_id)
+            if len(finished) == 3:
+                release.set()
+
+        # Очередь пользователя 1 занимает один слот, остальные
+        # пользователи проходят через второй
+        updates = ([make_update(i, 1) for i in range(3)] +
+                   [make_update(10 + i, 10 + i) for i in range(3)])
+        await asyncio.wait_for(run_updates(processor, updates, handler), 2)
+        assert finished[:3] == [10, 11, 12]
+        assert finished[3:] == [0, 1, 2]
+
+    asyncio.run(scenario())
+
+
+def test_media_group_flush_waits_for_user_updates():
+    async def scenario():
+        processor = UserOrderedUpdateProcessor(max_concurrent_updates=8)
+        application = (Application.builder().token("123:test")
+                       .concurrent_updates(processor).build())
+        context = ContextTypes.DEFAULT_TYPE(application)
+        handler = BotHandler()
+        handler.config.MEDIA_GROUP_WAIT = 0.01
+        events = []
+
+        async def fake_flush(key, context):
+            events.append('album')
+            handler._media_groups.pop(key)
+
+        handler._flush_media_group = fake_flush
+        key = (1, 'album')
+        handler._media_groups[key] = {
+            'update': None, 'photos': [], 'last_seen': 0.0}
+
+        release = asyncio.Event()
+
+        async def slow_update(update):
+            events.append('update started')
+            await release.wait()
+            events.append('update finished')
+
+        update_task = asyncio.create_task(
+            processor.process_update(make_update(1, 1), slow_update(None)))
+        await asyncio.sleep(0)
+        flush_task = asyncio.create_task(
+            handler._flush_media_group_later(key, context))
+        await asyncio.sleep(0.05)
+        # Пока обновление пользователя выполняется, альбом ждет
+        assert events == ['update started']
+        release.set()
+        await asyncio.gather(update_task, flush_task)
+        assert events == ['update started', 'update finished', 'album']
+
+    asyncio.run(scenario())
+
+
+def test_throughput_scales_with_slots():
+    users, updates_per_user, latency = 8, 5, 0.02
+    # Обновления пользователей вперемешку, как они приходят от Telegram
+    updates = [make_update(user * 100 + index, user)
+               for index in range(updates_per_user)
+               for user in range(1, users + 1)]
+
+    async def load(max_concurrent_updates):
+        processor = UserOrderedUpdateProcessor(
+            max_concurrent_updates=max_concurrent_updates)
+        order = {}
+
+        async def handler(update):
+            # Задержка обработчика: запросы к Telegram, запись файлов
+            await asyncio.sleep(latency)
+            order.setdefault(update.effective_user.id, []).append(
+                update.update_id)
+
+        started = time.perf_counter()
+        await run_updates(processor, updates, handler)
+        return time.perf_counter() - started, order
+
+    serial, serial_order = asyncio.run(load(1))
+    slots = Config().MAX_CONCURRENT_UPDATES
+    parallel, parallel_order = asyncio.run(load(slots))
+
+    expected = {user: [user * 100 + index for index in range(updates_per_user)]
+                for user in range(1, users + 1)}
+    assert serial_order == expected
+    assert parallel_order == expected
+    # Один слот: все обновления подряд; слотов больше, чем пользователей:
+    # время определяется самой длинной очередью одного пользователя
+    assert serial >= users * updates_per_user * latency
+    assert parallel < serial / 3
+    assert parallel < updates_per_user * latency * 3
@@ -0,0 +1,92 @@
+"""
+Тесты JobWorkspace: бюджеты памяти и запись на диск при нехватке места
+"""
+
+import errno
+import os
+from collections import namedtuple
+
+import pytest
+
+from DocKitBot import workspace as workspace_module
+from DocKitBot.file_handler import FileHandler
+from DocKitBot.workspace import JobWorkspace, RamBudget
+
+MB = 1024 * 1024
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+
+@pytest.fixture
+def ram(tmp_path, monkeypatch):
+    """tmpfs заменяется каталогом теста, бюджет процесса - свежий"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("WORKSPACE_RAM_DIR", str(tmp_path / "shm"))
+    budget = RamBudget(10 * MB)
+    monkeypatch.setattr(workspace_module, "_shared_budget", budget)
+    return budget
+
+
+def make_workspace(job_id, budget=8 * MB) -> JobWorkspace:
+    workspace = JobWorkspace(1, job_id)
+    workspace.config.WORKSPACE_RAM_BUDGET = budget
+    workspace.config.WORKSPACE_RAM_MIN_FREE = 0
+    return workspace
+
+
+def test_jobs_share_process_budget(ram):
+    first = make_workspace("first")
+    second = make_workspace("second")
+
+    in_ram = first.place(os.path.join("temp", "1", "a.pdf"), 6 * MB)
+    assert in_ram.startswith(first.ram_root)
+    # Задание в своем бюджете, но вместе с первым превысило бы общий
+    on_disk = second.place(os.path.join("temp", "1", "b.pdf"), 6 * MB)
+    assert on_disk.startswith(second.root)
+    assert ram.used == 6 * MB
+
+    first.settle(in_ram)
+    assert ram.used == 0
+    first.cleanup()
+    second.cleanup()
+
+
+def test_place_checks_free_space_on_tmpfs(ram, monkeypatch):
+    workspace = make_workspace("job")
+    workspace.config.WORKSPACE_RAM_MIN_FREE = 1 * MB
+    monkeypatch.setattr(workspace_module.shutil, "disk_usage",
+                        lambda path: DiskUsage(64 * MB, 62 * MB, 2 * MB))
+
+    assert workspace.place("temp/1/small.pdf", MB // 2).startswith(
+        workspace.ram_root)
+    assert workspace.place("temp/1/large.pdf", 2 * MB).startswith(
+        workspace.root)
+    workspace.cleanup()
+    assert ram.used == 0
+
+
+def test_archive_falls_back_to_disk_when_ram_is_full(ram, monkeypatch):
+    workspace = make_workspace("job")
+    handler = FileHandler()
+    os.makedirs(os.path.join("temp", "1"))
+    document = os.path.join("temp", "1", "doc.pdf")
+    with open(document, "wb") as file:
+        file.write(b"%PDF-1.4" * 100)
+    write_archive = handler._write_archive
+
+    def full_tmpfs(files, part_path):
+        if part_path.startswith(workspace.ram_root):
+            with open(part_path, "wb") as file:
+                file.write(b"partial")
+            raise OSError(errno.ENOSPC, "No space left on device")
+        return write_archive(files, part_path)
+
+    monkeypatch.setattr(handler, "_write_archive", full_tmpfs)
+
+    archive = handler.create_archive([document], 1, "result.zip", workspace)
+
+    assert archive.startswith(workspace.root)
+    assert os.path.getsize(archive) > 0
+    assert not os.listdir(os.path.join(workspace.ram_root, os.path.dirname(
+        os.path.relpath(archive, workspace.root))))
+    assert ram.used == 0
+    workspace.cleanup()
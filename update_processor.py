@@ -0,0 +1,75 @@
+"""
+Параллельная обработка обновлений Telegram для DocKitBot
+"""
+
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import Config
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных пользователей параллельно.
+
+    Обновления одного пользователя выполняются строго по очереди, в порядке
+    поступления, поэтому его сессия меняется так же, как при
+    последовательной обработке. Ожидающие своей очереди обновления
+    не занимают слоты MAX_CONCURRENT_UPDATES.
+    """
+
+    __slots__ = ('_slots', '_user_locks', '_user_waiters')
+
+    def __init__(self, max_concurrent_updates: Optional[int] = None,
+                 max_pending_updates: Optional[int] = None):
+        config = Config()
+        # Семафор базового класса ограничивает все принятые обновления,
+        # включая ждущие своей очереди у пользователя
+        super().__init__(max_pending_updates or config.MAX_PENDING_UPDATES)
+        self._slots = asyncio.Semaphore(
+            max_concurrent_updates or config.MAX_CONCURRENT_UPDATES)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_waiters: Dict[int, int] = {}
+
+    async def do_process_update(self, update: object,
+                                coroutine: Awaitable[Any]) -> None:
+        user_id = self._get_user_id(update)
+        if user_id is None:
+            async with self._slots:
+                await coroutine
+            return
+        await self.run_for_user(user_id, coroutine)
+
+    async def run_for_user(self, user_id: int,
+                           coroutine: Awaitable[Any]) -> Any:
+        """Выполняет coroutine в очереди обновлений пользователя.
+
+        Нужна для работы, которая начинается не с обновления Telegram
+        (например, сборка альбома по таймеру), но меняет сессию
+        пользователя и не должна пересекаться с его обновлениями.
+        """
+        # asyncio.Lock пропускает ожидающих в порядке очереди
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        self._user_waiters[user_id] = self._user_waiters.get(user_id, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    return await coroutine
+        finally:
+            self._user_waiters[user_id] -= 1
+            if not self._user_waiters[user_id]:
+                del self._user_waiters[user_id]
+                del self._user_locks[user_id]
+
+    def _get_user_id(self, update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def initialize(self) -> None:
+        """Ресурсы не требуются"""
+
+    async def shutdown(self) -> None:
+        """Ресурсы не требуются"""
@@ -0,0 +1,277 @@
+"""
+Рабочие каталоги заданий DocKitBot
+"""
+
+import errno
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from config import Config
+from DocKitBot.file_cache import link_file
+
+
+def is_out_of_space(error: BaseException) -> bool:
+    """Запись не удалась из-за нехватки места (например, на tmpfs)"""
+    return isinstance(error, OSError) and error.errno == errno.ENOSPC
+
+
+class RamBudget:
+    """Память tmpfs, занятая промежуточными файлами всех заданий процесса.
+
+    Бюджет одного задания (WORKSPACE_RAM_BUDGET) не ограничивает
+    параллельные задания вместе, поэтому place и settle дополнительно
+    резервируют место здесь.
+    """
+
+    __slots__ = ('limit', 'used', '_lock')
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int, force: bool = False) -> bool:
+        """Резервирует size байт; force - учесть уже занятое место"""
+        with self._lock:
+            if size > 0 and not force and self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size: int):
+        with self._lock:
+            self.used = max(0, self.used - size)
+
+
+_shared_budget: Optional[RamBudget] = None
+
+
+def get_ram_budget() -> RamBudget:
+    """Возвращает общий для всего бота бюджет памяти заданий"""
+    global _shared_budget
+    if _shared_budget is None:
+        _shared_budget = RamBudget(Config().WORKSPACE_RAM_TOTAL_BUDGET)
+    return _shared_budget
+
+
+class JobWorkspace:
+    """Собственный каталог задания внутри temp/<user_id>/jobs.
+
+    Файлы сессии попадают в него жесткими ссылками, поэтому обработка
+    (исправление PDF на месте, конвертация, объединение) не затрагивает
+    загрузки, пришедшие во время задания, и другие задания пользователя.
+
+    Промежуточные результаты (PDF страниц, объединенные документы,
+    архивы) размещаются через place/settle: пока хватает бюджета
+    задания WORKSPACE_RAM_BUDGET, общего бюджета процесса и свободного
+    места на tmpfs, они живут в WORKSPACE_RAM_DIR (то есть в памяти),
+    остальное - в каталоге задания на диске. Если запись в память
+    все же не поместилась, этап повторяет ее по пути из spill.
+    Процессы пула работают с путями, поэтому память общая с ними
+    через tmpfs.
+    """
+
+    __slots__ = ('config', 'user_id', 'job_id', 'user_dir', 'root',
+                 'ram_root', '_sources', '_ram_files', '_ram_used', '_lock')
+
+    def __init__(self, user_id: int, job_id: str):
+        self.config = Config()
+        self.user_id = user_id
+        self.job_id = job_id
+        self.user_dir = os.path.join(self.config.TEMP_DIR, str(user_id))
+        self.root = os.path.join(self.user_dir, 'jobs', job_id)
+        # Исходные загрузки задания и их inode на момент передачи
+        self._sources: Dict[str, tuple] = {}
+        # Каталог задания в памяти (None - только диск)
+        self.ram_root: Optional[str] = None
+        if self.config.WORKSPACE_RAM_DIR and self.config.WORKSPACE_RAM_BUDGET:
+            self.ram_root = os.path.join(
+                self.config.WORKSPACE_RAM_DIR, str(user_id), job_id)
+        # Файлы в памяти: путь -> занятые байты (до записи - оценка)
+        self._ram_files: Dict[str, int] = {}
+        self._ram_used = 0
+        self._lock = threading.Lock()
+
+    def adopt(self, file_paths: List[str]) -> Dict[str, str]:
+        """Связывает файлы с каталогом задания: {исходный путь: путь задания}.
+
+        Относительные пути внутри каталога пользователя сохраняются,
+        чтобы одноименные файлы из разных папок архива не совпали.
+        Файлы, уже лежащие в каталоге задания, остаются на месте.
+        """
+        adopted = {}
+        for file_path in file_paths:
+            if self._owns(file_path):
+                # Файл уже принадлежит заданию
+                adopted[file_path] = file_path
+                continue
+            job_path = os.path.join(self.root, self._relative_path(file_path))
+            os.makedirs(os.path.dirname(job_path), exist_ok=True)
+            link_file(file_path, job_path)
+            stat = os.stat(file_path)
+            self._sources[file_path] = (stat.st_dev, stat.st_ino)
+            adopted[file_path] = job_path
+        return adopted
+
+    def release_sources(self):
+        """Удаляет загрузки, которые задание забрало себе.
+
+        Файл, замененный новой загрузкой с тем же именем, не трогаем.
+        """
+        for file_path, identity in self._sources.items():
+            try:
+                stat = os.stat(file_path)
+                if (stat.st_dev, stat.st_ino) == identity:
+                    os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл {file_path}: {e}")
+        self._sources.clear()
+
+    def place(self, file_path: str, expected_size: int = 0) -> str:
+        """Выбирает место для промежуточного файла задания.
+
+        file_path - путь, который этап построил бы сам (рядом с исходником).
+        Если оценка размера помещается в бюджет, возвращается такой же
+        путь в памяти, иначе - в каталоге задания на диске.
+        """
+        relative_path = self._relative_path(file_path)
+        disk_path = os.path.join(self.root, relative_path)
+        with self._lock:
+            if self.ram_root is not None:
+                ram_path = os.path.join(self.ram_root, relative_path)
+                reserved = self._ram_files.get(ram_path, 0)
+                delta = expected_size - reserved
+                if (self._ram_used + delta <= self.config.WORKSPACE_RAM_BUDGET
+                        and self._ram_has_room(expected_size) and
+                        get_ram_budget().reserve(delta)):
+                    try:
+                        os.makedirs(os.path.dirname(ram_path), exist_ok=True)
+                        self._ram_used += delta
+                        self._ram_files[ram_path] = expected_size
+                        return ram_path
+                    except OSError as e:
+                        get_ram_budget().release(delta)
+                        logger.warning(f"Каталог в памяти недоступен: {e}")
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        return disk_path
+
+    def _ram_has_room(self, size: int) -> bool:
+        """На tmpfs останется WORKSPACE_RAM_MIN_FREE после записи size байт"""
+        try:
+            os.makedirs(self.config.WORKSPACE_RAM_DIR, exist_ok=True)
+            free = shutil.disk_usage(self.config.WORKSPACE_RAM_DIR).free
+        except OSError:
+            return False
+        return free - size >= self.config.WORKSPACE_RAM_MIN_FREE
+
+    def spill(self, file_path: str) -> Optional[str]:
+        """Путь на диске для файла, запись которого в память не поместилась.
+
+        Резерв памяти освобождается. None - файл и так размещен на диске.
+        """
+        if self.ram_root is None or not self._under(file_path, self.ram_root):
+            return None
+        with self._lock:
+            reserved = self._ram_files.pop(file_path, 0)
+            self._ram_used -= reserved
+            get_ram_budget().release(reserved)
+            if os.path.exists(file_path):
+                # Прежний файл под этим путем (например, исходник,
+                # исправляемый на месте) остается в памяти до очистки
+                size = os.path.getsize(file_path)
+                self._ram_files[file_path] = size
+                self._ram_used += size
+                get_ram_budget().reserve(size, force=True)
+        disk_path = os.path.join(self.root, self._relative_path(file_path))
+        logger.info(
+            f"Не хватило места в памяти для {os.path.basename(file_path)}, "
+            f"запись повторяется на диске")
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        return disk_path
+
+    def settle(self, file_path: Optional[str]) -> Optional[str]:
+        """Учитывает записанный файл; сверх бюджета переносит его на диск.
+
+        Возвращает итоговый путь файла. Блокирующий, вызывается через
+        asyncio.to_thread.
+        """
+        with self._lock:
+            if file_path not in self._ram_files:
+                return file_path
+            reserved = self._ram_files.pop(file_path)
+            self._ram_used -= reserved
+            get_ram_budget().release(reserved)
+            if not os.path.exists(file_path):
+                # Этап не записал файл, резерв просто освобождается
+                return file_path
+            size = os.path.getsize(file_path)
+            if (self._ram_used + size <= self.config.WORKSPACE_RAM_BUDGET and
+                    get_ram_budget().reserve(size)):
+                self._ram_files[file_path] = size
+                self._ram_used += size
+                return file_path
+
+        disk_path = os.path.join(self.root, self._relative_path(file_path))
+        logger.info(
+            f"Бюджет памяти задания {self.job_id} исчерпан, "
+            f"{os.path.basename(file_path)} переносится на диск")
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        # Копия через замену: под disk_path может лежать жесткая ссылка
+        # на исходник, которую нельзя перезаписывать
+        temp_path = f"{disk_path}.part"
+        shutil.copyfile(file_path, temp_path)
+        os.replace(temp_path, disk_path)
+        os.remove(file_path)
+        return disk_path
+
+    def _owns(self, file_path: str) -> bool:
+        """Файл лежит в каталоге задания на диске или в памяти"""
+        return any(root is not None and self._under(file_path, root)
+                   for root in (self.root, self.ram_root))
+
+    def _under(self, file_path: str, root: str) -> bool:
+        return not os.path.relpath(file_path, root).startswith(os.pardir)
+
+    def _relative_path(self, file_path: str) -> str:
+        """Путь файла относительно каталога задания (на диске или в памяти)"""
+        for root in (self.root, self.ram_root):
+            if root is None:
+                continue
+            relative_path = os.path.relpath(file_path, root)
+            if not relative_path.startswith(os.pardir):
+                return relative_path
+        relative_path = os.path.relpath(file_path, self.user_dir)
+        if relative_path.startswith(os.pardir):
+            relative_path = os.path.basename(file_path)
+        return relative_path
+
+    def paths_in_use(self) -> List[str]:
+        """Каталог задания и загрузки, которые оно еще не освободило"""
+        paths = [self.root, *self._sources]
+        if self.ram_root is not None:
+            paths.append(self.ram_root)
+        return paths
+
+    def cleanup(self):
+        """Удаляет каталог задания на диске и в памяти"""
+        if self.ram_root is not None:
+            shutil.rmtree(self.ram_root, ignore_errors=True)
+            with self._lock:
+                get_ram_budget().release(self._ram_used)
+                self._ram_files.clear()
+                self._ram_used = 0
+        try:
+            shutil.rmtree(self.root, ignore_errors=False)
+            logger.info(
+                f"Каталог задания {self.job_id} пользователя "
+                f"{self.user_id} очищен")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Ошибка очистки каталога задания {self.job_id}: {e}")